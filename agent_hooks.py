@@ -0,0 +1,152 @@
+"""
+Strands hook providers used by the KCA University assistant agent
+"""
+
+from strands.hooks import (
+    AfterInvocationEvent,
+    AfterModelCallEvent,
+    AfterToolCallEvent,
+    BeforeInvocationEvent,
+    BeforeModelCallEvent,
+    BeforeToolCallEvent,
+    HookProvider,
+    HookRegistry,
+)
+
+from kb_store.budget import REFUSED_TOOL_MESSAGE, current_budget, partial_answer
+from kb_store.tracing import _current_span, current_span, start_span
+from kb_store.usage import record_usage, set_current_tool
+
+_TURN_SPAN = "_trace_turn_span"
+_MODEL_SPAN = "_trace_model_span"
+_TOOL_SPANS = "_trace_tool_spans"
+_FIRST_MESSAGE = "_budget_first_message"
+
+
+class TracingHooks(HookProvider):
+    """Records the agent invocation, every model call and every tool call as spans"""
+
+    def register_hooks(self, registry: HookRegistry, **kwargs) -> None:
+        registry.add_callback(BeforeInvocationEvent, self.before_invocation)
+        registry.add_callback(AfterInvocationEvent, self.after_invocation)
+        registry.add_callback(BeforeModelCallEvent, self.before_model_call)
+        registry.add_callback(AfterModelCallEvent, self.after_model_call)
+        registry.add_callback(BeforeToolCallEvent, self.before_tool_call)
+        registry.add_callback(AfterToolCallEvent, self.after_tool_call)
+
+    def before_invocation(self, event: BeforeInvocationEvent) -> None:
+        turn_span = start_span("agent.invocation", agent=event.agent.name)
+        event.invocation_state[_TURN_SPAN] = turn_span
+        event.invocation_state[_TOOL_SPANS] = {}
+        # make the invocation the parent of tool and KB spans created in this context
+        _current_span.set(turn_span)
+
+    def after_invocation(self, event: AfterInvocationEvent) -> None:
+        turn_span = event.invocation_state.pop(_TURN_SPAN, None)
+        if turn_span is not None:
+            if event.result is not None:
+                turn_span.set_attribute("stop_reason", str(event.result.stop_reason))
+                turn_span.set_attribute("cycles", event.result.metrics.cycle_count)
+            turn_span.end()
+
+    def before_model_call(self, event: BeforeModelCallEvent) -> None:
+        event.invocation_state[_MODEL_SPAN] = start_span(
+            "agent.model_call",
+            parent=event.invocation_state.get(_TURN_SPAN),
+            model_id=event.agent.model.config.get("model_id"),
+        )
+
+    def after_model_call(self, event: AfterModelCallEvent) -> None:
+        model_span = event.invocation_state.pop(_MODEL_SPAN, None)
+        if model_span is None:
+            return
+        if event.stop_response is not None:
+            model_span.set_attribute("stop_reason", str(event.stop_response.stop_reason))
+        if event.exception is not None:
+            model_span.set_attribute("error", f"{type(event.exception).__name__}: {event.exception}")
+            model_span.end(status="error")
+        else:
+            model_span.end()
+
+    def before_tool_call(self, event: BeforeToolCallEvent) -> None:
+        tool_span = start_span(
+            f"agent.tool.{event.tool_use['name']}",
+            parent=event.invocation_state.get(_TURN_SPAN) or current_span(),
+        )
+        event.invocation_state.setdefault(_TOOL_SPANS, {})[event.tool_use["toolUseId"]] = tool_span
+        # spans opened inside the tool body nest under the tool span
+        _current_span.set(tool_span)
+
+    def after_tool_call(self, event: AfterToolCallEvent) -> None:
+        tool_span = event.invocation_state.get(_TOOL_SPANS, {}).pop(event.tool_use["toolUseId"], None)
+        if tool_span is None:
+            return
+        _current_span.set(event.invocation_state.get(_TURN_SPAN))
+        failed = event.exception is not None or event.result.get("status") == "error"
+        tool_span.end(status="error" if failed else None)
+
+
+class UsageHooks(HookProvider):
+    """Writes the token usage of every agent model call to the usage ledger"""
+
+    def register_hooks(self, registry: HookRegistry, **kwargs) -> None:
+        registry.add_callback(AfterModelCallEvent, self.after_model_call)
+        registry.add_callback(BeforeToolCallEvent, self.before_tool_call)
+        registry.add_callback(AfterToolCallEvent, self.after_tool_call)
+
+    def after_model_call(self, event: AfterModelCallEvent) -> None:
+        if event.stop_response is None:
+            return
+        usage = event.stop_response.message.get("metadata", {}).get("usage")
+        if not usage:
+            return
+        record_usage(
+            "agent",
+            event.agent.model.config.get("model_id", "unknown"),
+            input_tokens=usage.get("inputTokens", 0),
+            output_tokens=usage.get("outputTokens", 0),
+            cached_tokens=usage.get("cacheReadInputTokens", 0),
+            tool="agent",
+        )
+
+    def before_tool_call(self, event: BeforeToolCallEvent) -> None:
+        # KB calls made inside the tool body are attributed to this tool
+        set_current_tool(event.tool_use["name"])
+
+    def after_tool_call(self, event: AfterToolCallEvent) -> None:
+        set_current_tool(None)
+
+
+class BudgetHooks(HookProvider):
+    """
+    Enforces the per-turn budget (kb_store/budget.py): refuses tool calls once
+    the tool, model-call or time budget is used up so the model answers with
+    what it has, and replaces model calls beyond the budget with the partial
+    answer gathered so far
+    """
+
+    def register_hooks(self, registry: HookRegistry, **kwargs) -> None:
+        registry.add_callback(BeforeInvocationEvent, self.before_invocation)
+        registry.add_callback(BeforeModelCallEvent, self.before_model_call)
+        registry.add_callback(BeforeToolCallEvent, self.before_tool_call)
+
+    def before_invocation(self, event: BeforeInvocationEvent) -> None:
+        event.invocation_state[_FIRST_MESSAGE] = len(event.agent.messages)
+
+    def before_model_call(self, event: BeforeModelCallEvent) -> None:
+        budget = current_budget()
+        if budget is None or budget.allow_model_call() is None:
+            return
+        first = event.invocation_state.get(_FIRST_MESSAGE, 0)
+        event.cancel = partial_answer(event.agent.messages[first:])
+        turn_span = event.invocation_state.get(_TURN_SPAN)
+        if turn_span is not None:
+            turn_span.set_attribute("budget_exhausted", ",".join(budget.exhausted))
+
+    def before_tool_call(self, event: BeforeToolCallEvent) -> None:
+        budget = current_budget()
+        if budget is None:
+            return
+        reason = budget.allow_tool_call()
+        if reason is not None:
+            event.cancel_tool = REFUSED_TOOL_MESSAGE.format(reason=reason.replace("_", " "))
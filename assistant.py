@@ -4,7 +4,21 @@
 Shared assistant configuration for CLI and UI entry points.
 """
 
+import threading
+import time
+
+from agent_hooks import BudgetHooks, TracingHooks, UsageHooks
 from kb_tools import search_knowledge_base, intelligent_search, manage_knowledge_base
+from kb_store.answer_cache import get_answer_cache
+from kb_store.budget import partial_answer, turn_budget
+from kb_store.clients import create_client, fake_bedrock_enabled, transport_config
+from kb_store.config import get_section, load_config
+from kb_store.faq import match_faq
+from kb_store.kb_sessions import get_kb_sessions
+from kb_store.routing import default_tier, route_question, tier_settings, validate_tiers
+from kb_store.tenants import Tenant, current_tenant, tenant_scope
+from kb_store.tracing import metrics, setup_tracing, span
+from kb_store.usage import WARMUP_SESSION_ID, estimate_cost, get_ledger, usage_scope
 from strands import Agent
 from strands_tools import think
 from strands.models import BedrockModel
@@ -61,16 +75,260 @@ Remember: You are here to help the KCA University community navigate their acade
 """
 
 
-def create_agent() -> Agent:
-    """Create a configured KCA University assistant agent."""
-    bedrock_model = BedrockModel(
-        model_id="amazon.nova-lite-v1:0",
-        region_name="us-east-1",
-        temperature=0.3,
-    )
+def system_prompt_for(tenant: Tenant) -> str:
+    """System prompt of a tenant: its own, or the KCA University prompt"""
+    return tenant.system_prompt or KCA_UNIVERSITY_SYSTEM_PROMPT
+
+
+def create_agent(warm_cache: bool = True, read_only: bool = False, **agent_kwargs) -> Agent:
+    """
+    Create a configured KCA University assistant agent.
+    The agent starts with the current tenant's system prompt; ask() switches
+    it to the prompt of the tenant being served, so agents can be pooled
+    across tenants.
+
+    Args:
+        warm_cache: start the background answer-cache warm-up (once per process)
+        read_only: only the search tools, without manage_knowledge_base
+        agent_kwargs: extra keyword arguments for the Agent, e.g. callback_handler
+    """
+    setup_tracing()
+    with span("agent.create"):
+        # a misnamed tier fails here rather than on the first complex question
+        validate_tiers()
+        bedrock_model = tier_model(default_tier())
+
+        agent = Agent(
+            system_prompt=system_prompt_for(current_tenant()),
+            model=bedrock_model,
+            tools=([search_knowledge_base, intelligent_search, think] if read_only
+                   else [search_knowledge_base, intelligent_search, manage_knowledge_base, think]),
+            hooks=[TracingHooks(), UsageHooks(), BudgetHooks()],
+            **agent_kwargs,
+        )
+    if warm_cache:
+        start_cache_warmup()
+    return agent
+
+
+_tier_models = {}
+_tier_models_lock = threading.Lock()
+
+
+def tier_model(tier: str) -> BedrockModel:
+    """
+    Model of a tier from the `model_tiers` config, built once per process and
+    shared by every agent (BedrockModel holds no per-conversation state)
+    """
+    with _tier_models_lock:
+        if tier not in _tier_models:
+            settings = tier_settings(tier)
+            model_settings = {"temperature": settings.get("temperature", 0.3)}
+            if settings.get("max_tokens"):
+                model_settings["max_tokens"] = settings["max_tokens"]
+            model = BedrockModel(
+                model_id=settings["model_id"],
+                region_name=load_config().get("region_name", "us-east-1"),
+                boto_client_config=transport_config(),
+                **model_settings,
+            )
+            if fake_bedrock_enabled():
+                # offline runs: converse calls go to the local fake (see kb_store/clients.py)
+                model.client = create_client("bedrock-runtime", model.config.get("region_name"))
+            _tier_models[tier] = model
+        return _tier_models[tier]
+
+
+def _accumulated_tokens(agent: Agent) -> tuple:
+    usage = agent.event_loop_metrics.accumulated_usage
+    return usage.get("inputTokens", 0), usage.get("outputTokens", 0), usage.get("cacheReadInputTokens", 0)
+
+
+_warmup_thread = None
+_warmup_lock = threading.Lock()
 
-    return Agent(
-        system_prompt=KCA_UNIVERSITY_SYSTEM_PROMPT,
-        model=bedrock_model,
-        tools=[search_knowledge_base, intelligent_search, manage_knowledge_base, think],
+
+def warmup_questions() -> list:
+    """
+    Questions answered ahead of time: the configured list followed by the most
+    asked questions from the usage ledger, without duplicates
+    """
+    settings = get_section("answer_cache").get("warmup") or {}
+    questions = list(settings.get("questions") or [])
+    top_n = settings.get("top_n", 20)
+    ledger = get_ledger()
+    if ledger is not None and top_n:
+        try:
+            questions.extend(ledger.top_questions(top_n, settings.get("since_days", 7)))
+        except Exception as e:
+            print(f"Could not read recent questions for cache warm-up: {str(e)}")
+    seen, unique = set(), []
+    for question in questions:
+        key = " ".join(question.lower().split())
+        if key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique
+
+
+def _warm_cache():
+    cache = get_answer_cache()
+    # a separate, silent agent so the interactive agent's conversation is untouched;
+    # logged questions are replayed, so it cannot create or delete knowledge bases
+    agent = create_agent(warm_cache=False, read_only=True, callback_handler=None)
+    with span("cache.warmup") as warmup_span:
+        warmed = 0
+        for question in warmup_questions():
+            # FAQ matches are already instant
+            if question in cache or match_faq(question) is not None:
+                continue
+            try:
+                agent.messages.clear()
+                ask(agent, question, WARMUP_SESSION_ID)
+                warmed += 1
+            except Exception as e:
+                warmup_span.set_attribute("last_error", str(e))
+        warmup_span.set_attribute("warmed", warmed)
+    metrics.inc("school_assistant_answer_cache_warmed_total", warmed,
+                help_text="Answers precomputed by the cache warm-up")
+
+
+def start_cache_warmup():
+    """Precompute popular answers in a background thread, once per process"""
+    global _warmup_thread
+    settings = get_section("answer_cache")
+    if not settings.get("enabled", True) or not (settings.get("warmup") or {}).get("enabled", True):
+        return None
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warm_cache, name="answer-cache-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+
+def _remember_exchange(agent: Agent, question: str, answer: str):
+    """Add an answer given without the model to the conversation, for follow-ups"""
+    agent.messages.append({"role": "user", "content": [{"text": question}]})
+    agent.messages.append({"role": "assistant", "content": [{"text": answer}]})
+
+
+def _answer_within_budget(agent: Agent, question: str, budget) -> str:
+    """
+    Run the agent on a question, cancelling it at the turn deadline. A turn
+    cut short answers with the findings gathered so far, and its unfinished
+    tool calls are dropped from the conversation so the next question starts
+    from a consistent history.
+    """
+    if budget is None:
+        return str(agent(question))
+    first = len(agent.messages)
+    deadline = threading.Event()
+    timer = threading.Timer(max(0.0, budget.remaining()), deadline.set)
+    timer.daemon = True
+    timer.start()
+    try:
+        result = agent(question, cancel_signal=deadline)
+    finally:
+        timer.cancel()
+    if result.stop_reason != "cancelled":
+        return str(result)
+    budget.mark_exhausted("deadline")
+    # the cancelled model call leaves a placeholder message, not findings
+    answer = partial_answer([message for message in agent.messages[first:] if message != result.message])
+    del agent.messages[first:]
+    _remember_exchange(agent, question, answer)
+    return answer
+
+
+def ask(agent: Agent, question: str, session_id: str, tenant_id: str = None) -> str:
+    """
+    Answer one question with the agent, tracing the turn and attributing its
+    token usage to the given session. Recently answered questions come from the
+    answer cache and questions that closely match an FAQ entry are answered
+    from FAQ.json, both without calling the model. Other questions are routed
+    to the model tier that fits their complexity (see kb_store/routing.py) and
+    answered within the per-turn budget (see kb_store/budget.py).
+    Everything runs for the given tenant (default: the current tenant): its
+    system prompt, knowledge bases, cache namespace and rate limits.
+    """
+    start = time.perf_counter()
+    cache = get_answer_cache()
+    with tenant_scope(tenant_id) as tenant, usage_scope(session_id, question), \
+            span("turn", session_id=session_id, tenant=tenant.tenant_id) as turn_span:
+        # answers that depend on earlier turns are not reusable for other students,
+        # and a follow-up must not get another student's answer to the same words
+        standalone = not agent.messages
+        with span("cache.lookup", standalone=standalone) as cache_span:
+            cached = cache.get(question) if cache is not None and standalone else None
+            cache_span.set_attribute("hit", cached is not None)
+        faq_match = None
+        if cached is None and tenant.faq:
+            with span("faq.match") as faq_span:
+                faq_match = match_faq(question)
+                faq_span.set_attribute("hit", faq_match is not None)
+        if cached is not None:
+            answered_by = "cache"
+            answer = cached
+            _remember_exchange(agent, question, answer)
+        elif faq_match is not None:
+            answered_by = "faq"
+            turn_span.set_attribute("faq_score", round(faq_match.score, 3))
+            answer = f"{faq_match.answer}\n\n_(From the {tenant.display_name} FAQ: \"{faq_match.question}\")_"
+            _remember_exchange(agent, question, answer)
+        else:
+            answered_by = "agent"
+            route = route_question(question)
+            tier = route.tier
+            agent.model = tier_model(tier)
+            if agent.system_prompt != system_prompt_for(tenant):
+                agent.system_prompt = system_prompt_for(tenant)
+            turn_span.set_attribute("model_id", agent.model.config.get("model_id"))
+            turn_span.set_attribute("route_reasons", "; ".join(route.reasons))
+            kb_sessions = get_kb_sessions()
+            if standalone and kb_sessions is not None:
+                # a new conversation must not inherit the KB context of an earlier one
+                kb_sessions.forget(tenant.tenant_id, session_id)
+            tokens_before = _accumulated_tokens(agent)
+            with turn_budget() as budget:
+                answer = _answer_within_budget(agent, question, budget)
+            exhausted = budget.exhausted if budget is not None else []
+            # partial answers are not worth reusing
+            if cache is not None and standalone and not exhausted:
+                cache.put(question, answer)
+            if budget is not None:
+                turn_span.set_attribute("model_calls", budget.model_calls)
+                turn_span.set_attribute("tool_calls", budget.tool_calls)
+                metrics.observe("school_assistant_turn_tool_calls", budget.tool_calls,
+                                {"turn": "first" if standalone else "follow_up"},
+                                help_text="Tool calls per answered question, first turns vs follow-ups",
+                                buckets=(0, 1, 2, 3, 4, 6, 8, 12))
+            for reason in exhausted:
+                metrics.inc("school_assistant_turn_budget_exhausted_total", labels={"reason": reason},
+                            help_text="Questions answered after a turn budget ran out, by budget")
+            if exhausted:
+                turn_span.set_attribute("budget_exhausted", ",".join(exhausted))
+            input_tokens, output_tokens, cached_tokens = (
+                after - before for after, before in zip(_accumulated_tokens(agent), tokens_before)
+            )
+            cost = estimate_cost(agent.model.config.get("model_id"), input_tokens, output_tokens, cached_tokens)
+            turn_span.set_attribute("cost_usd", round(cost, 6))
+            metrics.inc("school_assistant_tier_cost_usd_total", cost, {"tier": tier},
+                        help_text="Estimated model cost of answered questions by tier")
+        if answered_by != "agent":
+            tier = "lookup"
+        turn_span.set_attribute("answered_by", answered_by)
+        turn_span.set_attribute("tier", tier)
+        metrics.inc("school_assistant_tenant_questions_total",
+                    labels={"tenant": tenant.tenant_id, "answered_by": answered_by},
+                    help_text="Questions answered per tenant by what answered them")
+
+    elapsed = time.perf_counter() - start
+    metrics.observe(
+        "school_assistant_answer_seconds", elapsed, {"answered_by": answered_by},
+        help_text="End-to-end latency of a question by what answered it",
+    )
+    metrics.observe(
+        "school_assistant_tier_answer_seconds", elapsed, {"tier": tier},
+        help_text="End-to-end latency of a question by model tier",
     )
+    return answer
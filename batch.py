@@ -0,0 +1,172 @@
+"""
+Batch question answering
+
+Answers a list of questions concurrently, e.g. to pre-answer the known
+orientation-week questions before publishing them. Each worker thread owns
+its own agent (agents keep conversation state and are not thread-safe), and
+a shared token bucket caps the rate at which questions are started so the
+Bedrock quotas are respected. Results keep the input order and are written
+as JSONL, one line per question with its latency.
+
+Usage:
+    python deploy_kb.py --action batch --input questions.jsonl --output answers.jsonl
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from assistant import ask, create_agent
+from kb_store.config import get_section
+from kb_store.resilience import TokenBucket
+from kb_store.tracing import metrics
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    Read questions from a file
+    Args:
+        path: a .jsonl file of {"id": ..., "question": ...} objects, a .json
+            list of strings or objects, or a text file with one question per line
+
+    Returns:
+        list of {"id", "question"} dicts in file order
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".json"):
+            raw_items = json.load(file)
+        elif path.endswith(".jsonl"):
+            raw_items = [json.loads(line) for line in file if line.strip()]
+        else:
+            raw_items = [line.strip() for line in file if line.strip()]
+
+    questions = []
+    for i, item in enumerate(raw_items):
+        if isinstance(item, str):
+            item = {"question": item}
+        if not item.get("question"):
+            raise ValueError(f"Item {i} of {path} has no question")
+        questions.append({"id": item.get("id", i), "question": item["question"]})
+    return questions
+
+
+class _OrderedWriter:
+    """Writes results as JSONL in input order as soon as each prefix is complete"""
+
+    def __init__(self, path: Optional[str]):
+        self.file = open(path, "w", encoding="utf-8") if path else None
+        self.pending: Dict[int, Dict[str, Any]] = {}
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def add(self, index: int, result: Dict[str, Any]):
+        with self.lock:
+            self.pending[index] = result
+            while self.next_index in self.pending:
+                line = self.pending.pop(self.next_index)
+                if self.file:
+                    self.file.write(json.dumps(line, ensure_ascii=False) + "\n")
+                    self.file.flush()
+                self.next_index += 1
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def answer_batch(
+    questions: List[Dict[str, Any]],
+    output_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    requests_per_second: Optional[float] = None,
+    agent_factory: Callable = create_agent,
+    progress: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Answer questions concurrently with a bounded worker pool
+    Args:
+        questions: {"id", "question"} dicts, e.g. from load_questions
+        output_path: JSONL file the results are written to, in input order
+        workers: worker threads, each with its own agent (default: batch.workers)
+        requests_per_second: rate at which questions are started (default: batch.requests_per_second)
+        agent_factory: builds one agent per worker
+        progress: print a line per finished question
+
+    Returns:
+        one result per question, in input order, with id, question, answer,
+        error and latency_ms
+    """
+    settings = get_section("batch")
+    workers = max(1, workers or settings.get("workers", 4))
+    rate = requests_per_second or settings.get("requests_per_second", 2)
+    limiter = TokenBucket(rate, settings.get("burst", workers))
+    batch_id = uuid.uuid4().hex[:12]
+    local = threading.local()
+    writer = _OrderedWriter(output_path)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    done = [0]
+    done_lock = threading.Lock()
+
+    def run(index: int, item: Dict[str, Any]):
+        if getattr(local, "agent", None) is None:
+            local.agent = agent_factory()
+        # every question is answered independently of the previous ones
+        local.agent.messages.clear()
+        limiter.acquire()
+        start = time.perf_counter()
+        answer, error = None, None
+        try:
+            # a session per question: concurrent questions must not continue each other's KB session
+            answer = ask(local.agent, item["question"], f"batch-{batch_id}-{index}")
+        except Exception as e:
+            error = str(e)
+        latency = time.perf_counter() - start
+        status = "error" if error else "ok"
+        metrics.inc("school_assistant_batch_items_total", labels={"status": status},
+                    help_text="Questions answered by the batch API")
+        result = {
+            "id": item["id"],
+            "question": item["question"],
+            "answer": answer,
+            "error": error,
+            "latency_ms": round(latency * 1000, 1),
+        }
+        results[index] = result
+        writer.add(index, result)
+        if progress:
+            with done_lock:
+                done[0] += 1
+                print(f"[{done[0]}/{len(questions)}] {status} {latency:6.2f}s  {item['question'][:70]}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-worker") as executor:
+            futures = [executor.submit(run, i, item) for i, item in enumerate(questions)]
+            for future in futures:
+                future.result()
+    finally:
+        writer.close()
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> str:
+    """One-paragraph summary of a batch run"""
+    latencies = sorted(r["latency_ms"] for r in results)
+    errors = sum(1 for r in results if r["error"])
+    if not latencies:
+        return "No questions answered"
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return (
+        f"Answered {len(results) - errors}/{len(results)} questions in {elapsed:.1f}s "
+        f"({len(results) / elapsed if elapsed else 0:.2f}/s), {errors} errors\n"
+        f"   Latency p50 {p50 / 1000:.2f}s, p95 {p95 / 1000:.2f}s, max {latencies[-1] / 1000:.2f}s"
+    )
+
+
+def default_output_path(input_path: str) -> str:
+    root, _ = os.path.splitext(input_path)
+    return f"{root}.answers.jsonl"
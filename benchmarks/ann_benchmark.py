@@ -0,0 +1,107 @@
+"""
+ANN Benchmark
+
+Measures the local IVF index against exact search on synthetic clustered
+embeddings: build time, recall@k, query latency (p50/p95) and index memory,
+for each corpus size and nprobe setting.
+
+Usage:
+    python benchmarks/ann_benchmark.py
+    python benchmarks/ann_benchmark.py --sizes 10000 100000 1000000 --dimension 256 --nprobe 4 8 16 32
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_store.ann import IVFIndex, _normalize  # noqa: E402
+
+
+def synthetic_embeddings(n: int, dimension: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Gaussian clusters on the unit sphere, a rough stand-in for text embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = _normalize(rng.standard_normal((clusters, dimension)).astype(np.float32))
+    vectors = np.empty((n, dimension), dtype=np.float32)
+    for start in range(0, n, 100000):
+        size = min(100000, n - start)
+        labels = rng.integers(0, clusters, size=size)
+        noise = rng.standard_normal((size, dimension)).astype(np.float32) * 0.08
+        vectors[start:start + size] = centers[labels] + noise
+    return _normalize(vectors)
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def percentile_ms(samples, q) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+def run(size: int, dimension: int, k: int, queries: int, nprobes, kmeans_iterations: int):
+    print(f"\n=== {size:,} chunks x {dimension} dims ===")
+    vectors = synthetic_embeddings(size, dimension, clusters=max(16, size // 500))
+    rng = np.random.default_rng(1)
+    query_ids = rng.choice(size, size=queries, replace=False)
+    query_vectors = _normalize(vectors[query_ids] + rng.standard_normal((queries, dimension)).astype(np.float32) * 0.05)
+
+    exact_latencies, truth = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        truth.append(set(exact_top_k(vectors, query, k).tolist()))
+        exact_latencies.append(time.perf_counter() - start)
+    print(f"exact      p50 {percentile_ms(exact_latencies, 50):8.3f} ms   p95 {percentile_ms(exact_latencies, 95):8.3f} ms"
+          f"   memory {vectors.nbytes / 2**20:8.1f} MiB")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, kmeans_iterations=kmeans_iterations)
+    build_seconds = time.perf_counter() - start
+
+    # measure the index the way production uses it: saved to disk and memory-mapped
+    directory = tempfile.mkdtemp(prefix="ivf-bench-")
+    try:
+        index.save(directory)
+        start = time.perf_counter()
+        index = IVFIndex.load(directory)
+        load_ms = (time.perf_counter() - start) * 1000
+        print(f"ivf build  {build_seconds:8.2f} s   nlist {index.params['nlist']}   "
+              f"load {load_ms:.2f} ms   memory {index.memory_bytes() / 2**20:8.1f} MiB")
+        for nprobe in nprobes:
+            latencies, hits = [], 0
+            for query, expected in zip(query_vectors, truth):
+                start = time.perf_counter()
+                ids, _ = index.search(query, k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - start)
+                hits += len(expected & set(ids.tolist()))
+            print(f"nprobe {nprobe:<4} recall@{k} {hits / (k * queries):6.3f}   "
+                  f"p50 {percentile_ms(latencies, 50):8.3f} ms   p95 {percentile_ms(latencies, 95):8.3f} ms   "
+                  f"speedup {np.median(exact_latencies) / np.median(latencies):6.1f}x")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local IVF index against exact search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--kmeans-iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.dimension, args.k, args.queries, args.nprobe, args.kmeans_iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Load Test
+
+Replays a JSONL corpus of questions against the assistant and reports, for
+each load step, p50/p95/p99 latency, throughput, error rate and answer-cache
+hit rate.
+
+Targets:
+- in process (default): pooled agents calling assistant.ask directly. With
+  --fake (the default in process) the model and knowledge base are replaced by
+  offline stand-ins with configurable latency distributions, so no AWS
+  credentials are needed.
+- over HTTP: the `server.py` service at --url
+
+Load shapes:
+- closed loop (--concurrency 1 4 16): N clients, each sending its next
+  question as soon as the previous answer arrives
+- open loop (--rates 2 5 10): questions arrive at N per second (Poisson)
+  regardless of how fast they are answered, so queueing shows up in latency
+
+Usage:
+    python benchmarks/loadtest.py --concurrency 1 4 16 --duration 20
+    python benchmarks/loadtest.py --rates 2 5 10 --model-latency lognormal:1.2,0.5 --no-cache
+    python benchmarks/loadtest.py --mode http --url http://127.0.0.1:8080 --concurrency 4 8
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import load_questions  # noqa: E402
+from kb_store.config import load_config  # noqa: E402
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_questions.jsonl")
+_CACHE_LINE_RE = re.compile(r'^school_assistant_answer_cache_lookups_total\{([^}]*)\}\s+([0-9.eE+-]+)$', re.M)
+
+
+def isolate_state(directory: str, cache: bool):
+    """
+    Point the usage ledger, answer cache and span log at a scratch directory so
+    a load test does not pollute the real ones
+    """
+    config = load_config()
+    config.setdefault("usage", {})["db_path"] = os.path.join(directory, "usage.db")
+    config.setdefault("tracing", {})["jsonl_path"] = os.path.join(directory, "spans.jsonl")
+    answer_cache = config.setdefault("answer_cache", {})
+    answer_cache["enabled"] = cache
+    answer_cache.setdefault("persistent", {})["db_path"] = os.path.join(directory, "answer_cache.db")
+
+
+def use_fake_bedrock(model_latency: str, throttle_rate: float):
+    """
+    Route every Bedrock client through the offline fakes (BEDROCK_FAKE), with
+    the given model latency and throttling. Set before any client is created:
+    ask() swaps in the model of the routed tier, and every tier model gets its
+    client from the shared fake runtime.
+    """
+    os.environ["BEDROCK_FAKE"] = "1"
+    operations = load_config().setdefault("fake_bedrock", {}).setdefault("operations", {})
+    for operation in ("ConverseStream", "Converse"):
+        operations[operation] = {**operations.get(operation, {}),
+                                 "latency": model_latency, "throttle_rate": throttle_rate}
+
+
+def cache_counters(metrics_text: str) -> Tuple[float, float]:
+    """(hits, lookups) of the answer cache from Prometheus text"""
+    hits = lookups = 0.0
+    for labels, value in _CACHE_LINE_RE.findall(metrics_text):
+        lookups += float(value)
+        if 'result="hit"' in labels:
+            hits += float(value)
+    return hits, lookups
+
+
+class InProcessTarget:
+    """Calls assistant.ask on a pool of agents, one agent per concurrent request"""
+
+    def __init__(self):
+        from assistant import ask, create_agent
+        from kb_store.tracing import metrics
+
+        self._ask = ask
+        self._metrics = metrics
+        self._agents: "queue.Queue" = queue.Queue()
+
+        self._factory = lambda: create_agent(warm_cache=False, callback_handler=None)
+
+    def call(self, question: str) -> Optional[str]:
+        """Answer one question; returns an error message or None"""
+        try:
+            agent = self._agents.get_nowait()
+        except queue.Empty:
+            agent = self._factory()
+        try:
+            agent.messages.clear()
+            self._ask(agent, question, f"loadtest-{uuid.uuid4().hex[:8]}")
+            return None
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        finally:
+            self._agents.put(agent)
+
+    def metrics_text(self) -> str:
+        return self._metrics.render()
+
+
+class HttpTarget:
+    """Posts questions to the assistant's HTTP service"""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def call(self, question: str) -> Optional[str]:
+        body = json.dumps({"question": question}).encode("utf-8")
+        request = urllib.request.Request(f"{self.url}/ask", data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            return None
+        except urllib.error.HTTPError as e:
+            return f"HTTP {e.code}"
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+    def metrics_text(self) -> str:
+        try:
+            with urllib.request.urlopen(f"{self.url}/metrics", timeout=self.timeout) as response:
+                return response.read().decode("utf-8")
+        except Exception:
+            return ""
+
+
+class Recorder:
+    """Collects per-request outcomes for one load step"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: Optional[str]):
+        with self._lock:
+            if error is None:
+                self.latencies.append(latency)
+            else:
+                kind = error.split(":")[0]
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def _next_question(questions: List[Dict[str, Any]], counter, lock) -> str:
+    with lock:
+        question = questions[counter[0] % len(questions)]["question"]
+        counter[0] += 1
+    return question
+
+
+def closed_loop(target, questions, concurrency: int, duration: float, recorder: Recorder):
+    counter, lock = [random.randrange(len(questions))], threading.Lock()
+    end = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < end:
+            question = _next_question(questions, counter, lock)
+            start = time.perf_counter()
+            error = target.call(question)
+            recorder.record(time.perf_counter() - start, error)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def open_loop(target, questions, rate: float, duration: float, recorder: Recorder, max_in_flight: int):
+    counter, lock = [random.randrange(len(questions))], threading.Lock()
+
+    def request(arrival: float):
+        error = target.call(_next_question(questions, counter, lock))
+        # latency from the scheduled arrival, so time spent queued counts
+        recorder.record(time.perf_counter() - arrival, error)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadtest") as executor:
+        start = time.perf_counter()
+        arrival = start
+        while True:
+            arrival += random.expovariate(rate)
+            if arrival - start > duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(request, arrival)
+
+
+def run_step(target, questions, label: str, shape: str, load: float, duration: float,
+             max_in_flight: int) -> Dict[str, Any]:
+    hits_before, lookups_before = cache_counters(target.metrics_text())
+    recorder = Recorder()
+    start = time.perf_counter()
+    if shape == "concurrency":
+        closed_loop(target, questions, int(load), duration, recorder)
+    else:
+        open_loop(target, questions, load, duration, recorder, max_in_flight)
+    elapsed = time.perf_counter() - start
+    hits_after, lookups_after = cache_counters(target.metrics_text())
+
+    completed = len(recorder.latencies)
+    errors = sum(recorder.errors.values())
+    total = completed + errors
+    latencies = np.array(recorder.latencies or [0.0]) * 1000
+    lookups = lookups_after - lookups_before
+    return {
+        "step": label,
+        "requests": total,
+        "throughput_rps": completed / elapsed if elapsed else 0.0,
+        "error_rate": errors / total if total else 0.0,
+        "errors": recorder.errors,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "cache_hit_rate": (hits_after - hits_before) / lookups if lookups else None,
+    }
+
+
+def print_step(result: Dict[str, Any]):
+    cache = f"{result['cache_hit_rate']:6.1%}" if result["cache_hit_rate"] is not None else "     -"
+    print(f"{result['step']:>16} {result['requests']:>8} {result['throughput_rps']:>8.2f} "
+          f"{result['p50_ms']:>9.0f} {result['p95_ms']:>9.0f} {result['p99_ms']:>9.0f} "
+          f"{result['error_rate']:>7.1%} {cache:>7}"
+          + (f"   {result['errors']}" if result["errors"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the assistant in process or over HTTP")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="JSONL/JSON/text file of questions")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="Service URL for --mode http")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=None,
+                        help="Closed-loop steps: number of concurrent clients")
+    parser.add_argument("--rates", type=float, nargs="+", default=None,
+                        help="Open-loop steps: arrivals per second")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per step")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Open-loop cap on concurrent requests")
+    parser.add_argument("--timeout", type=float, default=120, help="HTTP request timeout")
+    parser.add_argument("--live", action="store_true", help="In process: call real Bedrock instead of the fakes")
+    parser.add_argument("--model-latency", default="lognormal:0.8,0.4",
+                        help="Fake model latency per call, e.g. fixed:0.5, uniform:0.2,1, lognormal:0.8,0.4")
+    parser.add_argument("--kb-latency", default="uniform:0.05,0.2", help="Fake knowledge base latency per search")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of fake calls that are throttled")
+    parser.add_argument("--no-cache", action="store_true", help="In process: disable the answer cache")
+    parser.add_argument("--json-out", default=None, help="Write step results to this JSON file")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if args.rates:
+        shape, steps = "rate", args.rates
+    else:
+        shape, steps = "concurrency", args.concurrency or [1, 4, 16]
+
+    if args.mode == "http":
+        target = HttpTarget(args.url, args.timeout)
+        description = f"HTTP {args.url}"
+    else:
+        fake = not args.live
+        isolate_state(tempfile.mkdtemp(prefix="loadtest-"), cache=not args.no_cache)
+        if fake:
+            from kb_store.fake_bedrock import configure_fake_knowledge_base
+            os.environ["KB_BACKEND"] = "fake"
+            use_fake_bedrock(args.model_latency, args.throttle_rate)
+            configure_fake_knowledge_base(args.kb_latency, args.throttle_rate)
+        target = InProcessTarget()
+        description = (f"in process, fake model {args.model_latency}, fake KB {args.kb_latency}" if fake
+                       else "in process, live Bedrock")
+
+    print(f"Load test: {len(questions)} questions, {description}, {args.duration:g}s per step")
+    print(f"{shape + ' step':>16} {'requests':>8} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'errors':>7} {'cache':>7}")
+    results = []
+    for load in steps:
+        label = f"{int(load)} clients" if shape == "concurrency" else f"{load:g}/s"
+        result = run_step(target, questions, label, shape, load, args.duration, args.max_in_flight)
+        print_step(result)
+        results.append(result)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
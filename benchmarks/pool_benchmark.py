@@ -0,0 +1,165 @@
+"""
+Connection Pool Benchmark
+
+Measures how the botocore connection pool size (`aws_transport.max_pool_connections`)
+affects throughput and latency of concurrent knowledge base `retrieve` calls.
+When more threads call a client than it has pooled connections, the extra
+requests open new connections (TCP + TLS handshake) that are thrown away
+afterwards, so every request beyond the pool size pays the handshake again.
+
+By default the calls go to a local HTTP endpoint that answers like
+bedrock-agent-runtime after a simulated service latency and charges a
+simulated handshake on every new connection, so no AWS credentials are needed.
+With --live the calls go to the real service (requires --kb-id).
+
+Usage:
+    python benchmarks/pool_benchmark.py
+    python benchmarks/pool_benchmark.py --pools 5 10 25 50 --concurrency 32 --latency-ms 80 --handshake-ms 40
+    python benchmarks/pool_benchmark.py --live --kb-id ABCDEFGHIJ --pools 10 50 --concurrency 16
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_store.clients import transport_config  # noqa: E402
+from kb_store.config import load_config  # noqa: E402
+
+
+class FakeRetrieveServer(ThreadingHTTPServer):
+    """Keep-alive HTTP endpoint answering `retrieve` calls, counting new connections"""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float, handshake: float):
+        self.latency = latency
+        self.handshake = handshake
+        self.connections = 0
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _RetrieveHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _RetrieveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes; with Nagle on they wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+        # what a fresh TCP + TLS connection costs before the first request
+        time.sleep(self.server.handshake)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        body = json.dumps({"retrievalResults": [
+            {"content": {"text": "The January trimester starts on 5 January."}, "score": 0.8}
+        ]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_client(pool_size: int, endpoint_url=None):
+    config = transport_config(guarded=True, max_pool_connections=pool_size)
+    if endpoint_url is None:
+        return boto3.client("bedrock-agent-runtime", region_name=load_config().get("region_name", "us-east-1"),
+                            config=config)
+    session = boto3.Session(aws_access_key_id="benchmark", aws_secret_access_key="benchmark",
+                            region_name="us-east-1")
+    return session.client("bedrock-agent-runtime", endpoint_url=endpoint_url, config=config)
+
+
+def run(client, kb_id: str, concurrency: int, duration: float, think: float):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                client.retrieve(knowledgeBaseId=kb_id, retrievalQuery={"text": "When does the January trimester start?"})
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+            if think:
+                # bursty callers: connections go idle and pile up beyond the pool size
+                time.sleep(random.expovariate(1.0 / think))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark botocore connection pool sizes")
+    parser.add_argument("--pools", type=int, nargs="+", default=[5, 10, 25, 50])
+    parser.add_argument("--concurrency", type=int, default=32, help="Threads sharing one client")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per pool size")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Simulated service latency")
+    parser.add_argument("--handshake-ms", type=float, default=30, help="Simulated cost of a new connection")
+    parser.add_argument("--think-ms", type=float, default=50, help="Mean pause of each thread between calls")
+    parser.add_argument("--live", action="store_true", help="Call the real bedrock-agent-runtime")
+    parser.add_argument("--kb-id", default="FAKEKB0001", help="Knowledge base to retrieve from")
+    args = parser.parse_args()
+
+    # the pool-full warnings are the effect being measured
+    logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
+
+    server = None
+    if not args.live:
+        server = FakeRetrieveServer(args.latency_ms / 1000.0, args.handshake_ms / 1000.0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Local endpoint: {args.latency_ms:g} ms latency, {args.handshake_ms:g} ms per new connection")
+    else:
+        print("Live bedrock-agent-runtime")
+    print(f"{args.concurrency} threads, {args.think_ms:g} ms mean pause between calls, {args.duration:g}s per pool size\n")
+    print(f"{'pool':>6} {'calls':>7} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'new conns':>10} {'errors':>7}")
+
+    for pool_size in args.pools:
+        client = make_client(pool_size, server.url if server else None)
+        connections_before = server.connections if server else 0
+        latencies, errors, elapsed = run(client, args.kb_id, args.concurrency, args.duration, args.think_ms / 1000.0)
+        samples = np.array(latencies or [0.0]) * 1000
+        connections = f"{server.connections - connections_before:>10}" if server else f"{'-':>10}"
+        print(f"{pool_size:>6} {len(latencies):>7} {len(latencies) / elapsed:>8.1f} "
+              f"{np.percentile(samples, 50):>8.0f} {np.percentile(samples, 95):>8.0f} "
+              f"{np.percentile(samples, 99):>8.0f} {connections} {len(errors):>7}")
+        client.close()
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,25 @@ and populates it with school documents.
 
 import os
 import sys
+import time
 import argparse
+from kb_store.chunking import chunk_documents, chunk_statistics, get_profile, get_profiles, size_histogram
+from kb_store.clients import create_client
+from kb_store.compaction import compact_corpus, format_compaction_report, output_dir, upload_source_dir
+from kb_store.config import load_config
+from kb_store.corpus import kb_files_dir, load_documents
+from kb_store.ingestion_history import find_regressions, format_history, get_ingestion_history
 from kb_store.kb import KnowledgeBasesForAmazonBedrock, read_yaml_file
-import boto3
+from kb_store.local_store import HashingEmbedder, LocalKnowledgeBase
+from kb_store.tenants import UnknownTenant, current_tenant, tenant_scope
+from kb_store.usage import GROUP_BY_COLUMNS, estimate_cost, format_report, get_ledger
+from kb_store.watch import CorpusSync, watch_corpus
 
 
-def deploy_knowledge_base():
+EMBEDDING_MODEL = "amazon.titan-embed-text-v2:0"
+
+
+def deploy_knowledge_base(chunking_profile: str = None):
     """Deploy the knowledge base infrastructure and populate it with data"""
     print("Starting Knowledge Base deployment...")
     
@@ -30,8 +43,14 @@ def deploy_knowledge_base():
             return False
         
         print(f"Configuration loaded successfully")
-        print(f"   Knowledge Base Name: {config_data['knowledge_base_name']}")
-        print(f"   Description: {config_data['knowledge_base_description']}")
+        tenant = current_tenant()
+        print(f"   Tenant: {tenant.tenant_id} ({tenant.display_name})")
+        print(f"   Knowledge Base Name: {tenant.knowledge_base_name}")
+        print(f"   Description: {tenant.knowledge_base_description}")
+        if tenant.corpus_dir is None:
+            print(f"Error: tenant '{tenant.tenant_id}' has no corpus of its own. "
+                  f"Set kb_files_path in its tenants profile before deploying")
+            return False
         
         # Initialize Knowledge Base manager
         print("🔧 Initializing Knowledge Base manager...")
@@ -40,8 +59,10 @@ def deploy_knowledge_base():
         # Create or retrieve knowledge base
         print("Creating or retrieving Knowledge Base...")
         kb_id, ds_id = kb.create_or_retrieve_knowledge_base(
-            config_data["knowledge_base_name"], 
-            config_data["knowledge_base_description"]
+            tenant.knowledge_base_name, 
+            tenant.knowledge_base_description,
+            embedding_model=EMBEDDING_MODEL,
+            chunking_profile=chunking_profile,
         )
         
         if not kb_id or not ds_id:
@@ -53,7 +74,7 @@ def deploy_knowledge_base():
         print(f"   Data Source ID: {ds_id}")
         
         # Upload documents
-        documents_path = os.path.join(current_dir, "kb_store", config_data["kb_files_path"])
+        documents_path = tenant.corpus_dir
         print(f"Uploading documents from {documents_path}")
         
         if not os.path.exists(documents_path):
@@ -61,7 +82,8 @@ def deploy_knowledge_base():
             print("Knowledge Base created but no documents uploaded.")
             return True
             
-        kb.upload_directory(documents_path, kb.get_data_bucket_name())
+        upload_path = upload_source_dir(documents_path)
+        kb.upload_directory(upload_path, kb.get_data_bucket_name(), remove_stale=upload_path != documents_path)
         print("Documents uploaded successfully")
         
         # Synchronize data
@@ -72,10 +94,10 @@ def deploy_knowledge_base():
         # Store KB ID in SSM for future reference
         print("Storing Knowledge Base ID in SSM Parameter Store...")
         try:
-            ssm_client = boto3.client("ssm", region_name=config_data.get("region_name", "us-east-1"))
+            ssm_client = create_client("ssm", config_data.get("region_name", "us-east-1"))
             ssm_client.put_parameter(
-                Name=f"{config_data['knowledge_base_name']}-kb-id",
-                Description=f"{config_data['knowledge_base_name']} kb id",
+                Name=f"{tenant.knowledge_base_name}-kb-id",
+                Description=f"{tenant.knowledge_base_name} kb id",
                 Value=kb_id,
                 Type="String",
                 Overwrite=True,
@@ -111,12 +133,13 @@ def check_knowledge_base_status():
         
         # Initialize KB manager
         kb = KnowledgeBasesForAmazonBedrock()
+        tenant = current_tenant()
         
         # Get knowledge base ID
-        kb_id = kb.get_kb_id_from_name(config_data["knowledge_base_name"])
+        kb_id = kb.get_kb_id_from_name(tenant.knowledge_base_name)
         
         if not kb_id:
-            print(f"Knowledge Base '{config_data['knowledge_base_name']}' not found")
+            print(f"Knowledge Base '{tenant.knowledge_base_name}' not found")
             return False
         
         # Get knowledge base details
@@ -164,7 +187,7 @@ def delete_knowledge_base():
             return False
         
         # Confirm deletion
-        kb_name = config_data["knowledge_base_name"]
+        kb_name = current_tenant().knowledge_base_name
         confirmation = input(f"Are you sure you want to delete Knowledge Base '{kb_name}' and ALL associated resources? (yes/no): ")
         
         if confirmation.lower() != 'yes':
@@ -184,7 +207,7 @@ def delete_knowledge_base():
         
         # Remove SSM parameter
         try:
-            ssm_client = boto3.client("ssm", region_name=config_data.get("region_name", "us-east-1"))
+            ssm_client = create_client("ssm", config_data.get("region_name", "us-east-1"))
             ssm_client.delete_parameter(Name=f"{kb_name}-kb-id")
             print("SSM parameter removed")
         except Exception:
@@ -198,27 +221,261 @@ def delete_knowledge_base():
         return False
 
 
+def build_local_index():
+    """Build the local vector store from kb_files"""
+    print("Building local vector index...")
+
+    try:
+        local_kb = LocalKnowledgeBase()
+        store = local_kb.build()
+        print(f"Indexed {store.metadata['count']} chunks from {local_kb.corpus_dir}")
+        print(f"   Embedder: {store.metadata['embedder']} ({store.metadata['dimension']} dimensions)")
+        print(f"   Index directory: {local_kb.index_dir}")
+        print("Set retrieval_backend: 'local' in prereqs_config.yaml (or KB_BACKEND=local) to use it")
+        return True
+
+    except Exception as e:
+        print(f"Error building local index: {str(e)}")
+        return False
+
+
+def watch_knowledge_base():
+    """Sync the knowledge base with kb_files after every burst of edits, until Ctrl+C"""
+    print("Starting watch mode...")
+
+    try:
+        documents_path = kb_files_dir()
+        backend = os.environ.get("KB_BACKEND", load_config().get("retrieval_backend", "bedrock"))
+        if backend != "bedrock":
+            # the local and fake backends read kb_files directly: only their caches need refreshing
+            print(f"Retrieval backend '{backend}': changes refresh the local index and caches only")
+            corpus_sync = CorpusSync(documents_path)
+        else:
+            tenant = current_tenant()
+            if tenant.corpus_dir is None:
+                print(f"Tenant '{tenant.tenant_id}' has no corpus of its own. Set kb_files_path in its tenants profile")
+                return False
+            documents_path = tenant.corpus_dir
+            kb = KnowledgeBasesForAmazonBedrock()
+            kb_name = tenant.knowledge_base_name
+            kb_id = kb.get_kb_id_from_name(kb_name)
+            ds_id = kb.get_data_source(kb_id) if kb_id else None
+            if not kb_id or not ds_id:
+                print(f"Knowledge Base '{kb_name}' not found. Deploy it first with --action deploy")
+                return False
+            print(f"   Knowledge Base ID: {kb_id}")
+            print(f"   Data bucket: {kb.get_data_bucket_name()}")
+            corpus_sync = CorpusSync(documents_path, kb, kb_id, ds_id)
+        watch_corpus(corpus_sync)
+        return True
+
+    except Exception as e:
+        print(f"Error in watch mode: {str(e)}")
+        return False
+
+
+def compact_documents():
+    """Write the compacted copy of kb_files and print token counts before and after"""
+    try:
+        results = compact_corpus()
+        print(f"Compacted {len(results)} documents from {kb_files_dir()} into {output_dir()}\n")
+        print(format_compaction_report(results))
+        print("\nEstimates use ~4 characters per token; Bedrock's tokenizer may differ slightly")
+        return True
+
+    except Exception as e:
+        print(f"Error compacting documents: {str(e)}")
+        return False
+
+
+def preview_chunks(profile_name: str = None, show: int = 0):
+    """
+    Chunk kb_files locally with one chunking profile (or all of them) and print
+    chunk counts, a size histogram and the tokens ingestion would embed
+    """
+    try:
+        documents = load_documents(kb_files_dir())
+        names = [profile_name] if profile_name else list(get_profiles())
+        print(f"Previewing {len(documents)} documents from {kb_files_dir()}")
+
+        for name in names:
+            profile = get_profile(name)
+            # semantic breakpoints use the offline hashing embedder as a stand-in for Titan
+            result = chunk_documents(documents, profile, embedder=HashingEmbedder())
+            stats = chunk_statistics(result)
+            print(f"\nProfile '{name}' ({profile.get('strategy', 'FIXED_SIZE')})")
+            print(f"   Chunks: {stats['chunks']} from {stats['documents']} documents")
+            print(f"   Chunk tokens: min {stats['min']}, median {stats['median']}, "
+                  f"p95 {stats['p95']}, max {stats['max']}")
+            print(size_histogram(stats["sizes"]))
+            print(f"   Indexed tokens: {stats['total_tokens']:,}")
+            print(f"   Embedding tokens per full ingestion: {stats['embedding_tokens']:,} "
+                  f"(~${estimate_cost(EMBEDDING_MODEL, stats['embedding_tokens'], 0):.4f} with {EMBEDDING_MODEL})")
+            for chunk in result.chunks[:show]:
+                print(f"\n   [{chunk.chunk_id}] {chunk.text[:300]}")
+        print("\nEstimates use ~4 characters per token; Bedrock's tokenizer may differ slightly")
+        return True
+
+    except Exception as e:
+        print(f"Error previewing chunks: {str(e)}")
+        return False
+
+
+def batch_answer(input_path: str, output_path: str = None, workers: int = None):
+    """Answer every question of a file concurrently and write JSONL results"""
+    try:
+        # imported here so the other actions do not need the agent dependencies
+        from batch import answer_batch, default_output_path, load_questions, summarize
+
+        if not input_path:
+            print("Error: --input is required for the batch action")
+            return False
+        output_path = output_path or default_output_path(input_path)
+        questions = load_questions(input_path)
+        print(f"Answering {len(questions)} questions from {input_path}")
+
+        start = time.perf_counter()
+        results = answer_batch(questions, output_path, workers=workers)
+        print(summarize(results, time.perf_counter() - start))
+        print(f"   Results written to {output_path}")
+        return not any(result["error"] for result in results)
+
+    except Exception as e:
+        print(f"Error answering batch: {str(e)}")
+        return False
+
+
+def usage_report(group_by: str = "question", since_days: float = None, limit: int = 20):
+    """Print token usage and estimated cost, most expensive first"""
+    try:
+        ledger = get_ledger()
+        if ledger is None:
+            print("Usage ledger is disabled in the configuration")
+            return False
+
+        period = f"last {since_days:g} days" if since_days is not None else "all time"
+        print(f"Token usage and estimated cost by {group_by} ({period})\n")
+        print(format_report(ledger.summarize(group_by, since_days, limit), group_by))
+        return True
+
+    except Exception as e:
+        print(f"Error building usage report: {str(e)}")
+        return False
+
+
+def ingestion_report(since_days: float = None, limit: int = 20):
+    """Print recent ingestion jobs of the tenant's knowledge base and flag regressions"""
+    try:
+        history = get_ingestion_history()
+        if history is None:
+            print("Ingestion history is disabled in the configuration")
+            return False
+
+        tenant = current_tenant()
+        jobs = history.jobs(since_days, limit, tenant=tenant.tenant_id)
+        period = f"last {since_days:g} days" if since_days is not None else "all time"
+        print(f"Ingestion jobs of {tenant.knowledge_base_name} ({period})\n")
+        print(format_history(jobs))
+        for warning in find_regressions(jobs):
+            print(f"⚠️  {warning}")
+        return True
+
+    except Exception as e:
+        print(f"Error building ingestion report: {str(e)}")
+        return False
+
+
 def main():
     """Main function to handle command line arguments"""
     parser = argparse.ArgumentParser(description="Knowledge Base deployment and management")
     parser.add_argument(
         "--action",
-        choices=["deploy", "status", "delete"],
+        choices=["deploy", "status", "delete", "usage", "build-local", "preview-chunks", "compact", "batch",
+                 "watch", "ingestions"],
         default="deploy",
         help="Action to perform (default: deploy)"
     )
+    parser.add_argument(
+        "--group-by",
+        choices=sorted(GROUP_BY_COLUMNS),
+        default="question",
+        help="Grouping for the usage report (default: question)"
+    )
+    parser.add_argument(
+        "--since-days",
+        type=float,
+        default=None,
+        help="Only include the last N days in the usage and ingestions reports"
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="Maximum number of rows in the usage and ingestions reports (default: 20)"
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="Chunking profile for deploy and preview-chunks (default: chunking.profile; preview shows all)"
+    )
+    parser.add_argument(
+        "--show",
+        type=int,
+        default=0,
+        help="Number of sample chunks printed by preview-chunks (default: 0)"
+    )
+    parser.add_argument(
+        "--input",
+        default=None,
+        help="Questions file for the batch action (.jsonl, .json or one question per line)"
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="JSONL results file for the batch action (default: <input>.answers.jsonl)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Concurrent workers for the batch action (default: batch.workers)"
+    )
+    parser.add_argument(
+        "--tenant",
+        default=None,
+        help="Tenant whose knowledge base is deployed, checked or deleted (default: ASSISTANT_TENANT or tenants.default)"
+    )
     
     args = parser.parse_args()
     
     print("🎓 Knowledge Base Management Tool")
     print("=" * 50)
     
-    if args.action == "deploy":
-        success = deploy_knowledge_base()
-    elif args.action == "status":
-        success = check_knowledge_base_status()
-    elif args.action == "delete":
-        success = delete_knowledge_base()
+    try:
+        with tenant_scope(args.tenant):
+            if args.action == "deploy":
+                success = deploy_knowledge_base(args.profile)
+            elif args.action == "status":
+                success = check_knowledge_base_status()
+            elif args.action == "delete":
+                success = delete_knowledge_base()
+            elif args.action == "build-local":
+                success = build_local_index()
+            elif args.action == "usage":
+                success = usage_report(args.group_by, args.since_days, args.limit)
+            elif args.action == "preview-chunks":
+                success = preview_chunks(args.profile, args.show)
+            elif args.action == "compact":
+                success = compact_documents()
+            elif args.action == "batch":
+                success = batch_answer(args.input, args.output, args.workers)
+            elif args.action == "watch":
+                success = watch_knowledge_base()
+            elif args.action == "ingestions":
+                success = ingestion_report(args.since_days, args.limit)
+    except UnknownTenant as e:
+        print(f"❌ {str(e)}")
+        success = False
     
     if success:
         print("\nOperation completed successfully!")
@@ -0,0 +1,183 @@
+"""
+Approximate nearest-neighbor index for the local vector store
+
+An inverted-file (IVF) index over L2-normalized vectors:
+    - build: k-means clusters the vectors into `nlist` lists
+      (`kmeans_iterations` Lloyd iterations on a sample of `train_sample_size`)
+    - search: score the query against the centroids and scan only the
+      `nprobe` closest lists
+
+Vectors are stored reordered by list, so every probed list is one contiguous
+slice of the matrix. All arrays are written as .npy files and opened with
+mmap_mode="r", so loading an index is instant and its pages are shared
+between processes.
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+IDS_FILE = "ivf_ids.npy"
+VECTORS_FILE = "ivf_vectors.npy"
+PARAMS_FILE = "ivf_params.json"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """Index of the most similar centroid for every vector (batched to bound memory)"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        block = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, sample_size: int = 65536,
+                 seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means centroids for cosine similarity
+    Args:
+        vectors: normalized vectors, shape (n, d)
+        nlist: number of clusters
+        iterations: Lloyd iterations
+        sample_size: maximum number of vectors used for training
+        seed: random seed, so builds are reproducible
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_ids = rng.choice(n, size=min(n, sample_size), replace=False)
+    sample = np.asarray(vectors[np.sort(sample_ids)], dtype=np.float32)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        # re-seed empty clusters with random sample points
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index with tunable build (nlist, k-means iterations/sample)
+    and search (nprobe) parameters
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, vectors: np.ndarray,
+                 params: Dict[str, Any]):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.params = params
+        self.nprobe = params.get("nprobe", 8)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: Optional[int] = None, nprobe: int = 8,
+              kmeans_iterations: int = 10, train_sample_size: int = 65536, seed: int = 0) -> "IVFIndex":
+        """
+        Build an index over normalized vectors
+        Args:
+            vectors: normalized float32 vectors, shape (n, d); may be a memmap
+            nlist: number of inverted lists, defaults to ~4*sqrt(n)
+            nprobe: default number of lists scanned per query
+            kmeans_iterations: Lloyd iterations for the coarse quantizer
+            train_sample_size: vectors sampled to train the quantizer
+            seed: random seed
+        """
+        n = len(vectors)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        centroids = train_kmeans(vectors, nlist, kmeans_iterations, train_sample_size, seed)
+        assignments = _assign(vectors, centroids)
+        ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        reordered = np.empty((n, vectors.shape[1]), dtype=np.float32)
+        for start in range(0, n, 65536):
+            reordered[start:start + 65536] = vectors[ids[start:start + 65536]]
+        params = {
+            "nlist": int(len(centroids)),
+            "nprobe": int(nprobe),
+            "kmeans_iterations": int(kmeans_iterations),
+            "train_sample_size": int(train_sample_size),
+            "seed": int(seed),
+            "count": int(n),
+            "dimension": int(vectors.shape[1]),
+        }
+        return cls(centroids, offsets, ids, reordered, params)
+
+    def save(self, directory: str):
+        """Write the index arrays as .npy files plus a JSON parameter file"""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in (
+            (CENTROIDS_FILE, self.centroids),
+            (OFFSETS_FILE, self.offsets),
+            (IDS_FILE, self.ids),
+            (VECTORS_FILE, self.vectors),
+        ):
+            tmp_path = os.path.join(directory, name + ".tmp.npy")
+            np.save(tmp_path, np.asarray(array))
+            os.replace(tmp_path, os.path.join(directory, name))
+        with open(os.path.join(directory, PARAMS_FILE), "w", encoding="utf-8") as file:
+            json.dump(self.params, file)
+
+    @classmethod
+    def load(cls, directory: str) -> "IVFIndex":
+        """Open a saved index with every array memory-mapped read-only"""
+        with open(os.path.join(directory, PARAMS_FILE), "r", encoding="utf-8") as file:
+            params = json.load(file)
+        arrays = [
+            np.load(os.path.join(directory, name), mmap_mode="r")
+            for name in (CENTROIDS_FILE, OFFSETS_FILE, IDS_FILE, VECTORS_FILE)
+        ]
+        return cls(*arrays, params=params)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, PARAMS_FILE))
+
+    def search(self, query_vector: np.ndarray, k: int = 5, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate cosine top-k
+        Args:
+            query_vector: normalized query, shape (d,)
+            k: number of results
+            nprobe: lists to scan, defaults to the index setting
+
+        Returns:
+            (ids, scores) of the top-k vectors, best first; ids refer to the
+            row order of the vectors the index was built from
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        query_vector = query_vector.astype(np.float32)
+        centroid_scores = self.centroids @ query_vector
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        slices = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in probe]
+        positions = np.concatenate([np.arange(start, end) for start, end in slices if end > start] or [np.empty(0, np.int64)])
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.concatenate([self.vectors[start:end] @ query_vector for start, end in slices if end > start])
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return np.asarray(self.ids[positions[top]]), scores[top]
+
+    def memory_bytes(self) -> int:
+        """Size of the index arrays (on disk / in the page cache when mapped)"""
+        return int(sum(np.asarray(a).nbytes for a in (self.centroids, self.offsets, self.ids, self.vectors)))
@@ -0,0 +1,334 @@
+"""
+Answer cache
+
+Keeps agent answers keyed on the normalized question and the corpus version,
+so popular questions are answered instantly after the first time and a new
+ingestion automatically retires every answer built from the old documents.
+
+Two tiers:
+- an in-process LRU with a TTL (`answer_cache.max_entries`, `ttl_seconds`)
+- a SQLite database in WAL mode shared by every process on the host
+  (`answer_cache.persistent`), e.g. the Streamlit workers, with
+  least-recently-used eviction beyond `max_entries`
+
+The corpus version combines the content hash of kb_files with the ID of the
+last completed ingestion job recorded by `synchronize_data`. Only answers
+produced without prior conversation context are stored, so an answer never
+depends on another student's earlier turns.
+
+Every tenant (see tenants.py) has its own namespace: answers, corpus versions
+and ingestion job IDs of one institution are never seen by another.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from kb_store.config import get_section
+from kb_store.corpus import corpus_manifest_hash
+from kb_store.tenants import current_tenant, get_tenants
+from kb_store.tracing import metrics
+from kb_store.usage import BASE_DIR, normalize_question
+
+DEFAULT_CACHE_PATH = os.path.join(BASE_DIR, "traces", "answer_cache.db")
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+
+def cache_key(question: str) -> str:
+    """Normalized question: case, whitespace and punctuation are ignored"""
+    return " ".join(_PUNCTUATION_RE.sub(" ", normalize_question(question)).split())
+
+
+class AnswerCache:
+    """Thread-safe in-memory LRU cache of answers with a time-to-live"""
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question: str, version: str = "", namespace: str = "") -> Optional[str]:
+        """Cached answer for a question at a corpus version, or None"""
+        key = (namespace, version, cache_key(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        return entry[1] if entry else None
+
+    def put(self, question: str, answer: str, version: str = "", namespace: str = ""):
+        key = (namespace, version, cache_key(question))
+        with self._lock:
+            self._entries[key] = (time.time(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            size = len(self._entries)
+        metrics.set_gauge("school_assistant_answer_cache_entries", size, {"tier": "memory"},
+                          help_text="Answers currently held in the answer cache")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PersistentAnswerCache:
+    """SQLite (WAL) answer cache shared across processes, evicting least recently used"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 5000, ttl_seconds: float = 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(answers)")]
+        if columns and "namespace" not in columns:
+            # cache from before tenant namespaces: cheaper to rebuild than to migrate
+            self._conn.execute("DROP TABLE answers")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                namespace TEXT NOT NULL,
+                question_key TEXT NOT NULL,
+                corpus_version TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (namespace, question_key, corpus_version)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def get(self, question: str, version: str = "", namespace: str = "") -> Optional[str]:
+        now = time.time()
+        key = cache_key(question)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM answers "
+                "WHERE namespace = ? AND question_key = ? AND corpus_version = ? AND created >= ?",
+                (namespace, key, version, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE answers SET last_used = ?, hits = hits + 1 "
+                    "WHERE namespace = ? AND question_key = ? AND corpus_version = ?",
+                    (now, namespace, key, version),
+                )
+                self._conn.commit()
+        return row[0] if row else None
+
+    def put(self, question: str, answer: str, version: str = "", namespace: str = ""):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(namespace, question_key, corpus_version, question, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, cache_key(question), version, question, answer, now, now),
+            )
+            self._puts += 1
+            # evicting on every write would scan the table each time
+            if self._puts % 20 == 1:
+                self._evict(version, namespace, now)
+            self._conn.commit()
+
+    def _evict(self, version: str, namespace: str, now: float):
+        self._conn.execute(
+            "DELETE FROM answers WHERE (namespace = ? AND corpus_version != ?) OR created < ?",
+            (namespace, version, now - self.ttl_seconds),
+        )
+        self._conn.execute(
+            "DELETE FROM answers WHERE rowid IN "
+            "(SELECT rowid FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        metrics.set_gauge("school_assistant_answer_cache_entries", size, {"tier": "persistent"},
+                          help_text="Answers currently held in the answer cache")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+
+def ingestion_meta_key(namespace: str) -> str:
+    return f"ingestion_job_id:{namespace}"
+
+
+class TieredAnswerCache:
+    """
+    Memory tier in front of the shared persistent tier, both keyed on the
+    tenant's namespace and its current corpus version. Methods default to the
+    namespace of the current tenant.
+    """
+
+    def __init__(self, memory: AnswerCache, persistent: Optional[PersistentAnswerCache] = None,
+                 version_check_seconds: float = 30):
+        self.memory = memory
+        self.persistent = persistent
+        self.version_check_seconds = version_check_seconds
+        self._versions: Dict[str, Tuple[float, str]] = {}
+        self._version_lock = threading.Lock()
+
+    def corpus_version(self, namespace: Optional[str] = None) -> str:
+        """
+        Content hash of the corpus of the namespace's tenant plus the
+        namespace's last completed ingestion job ID, recomputed at most every
+        `version_check_seconds`
+        """
+        namespace = _namespace(namespace)
+        with self._version_lock:
+            checked, version = self._versions.get(namespace, (None, ""))
+            if checked is None or time.monotonic() - checked > self.version_check_seconds:
+                try:
+                    corpus_dir = _corpus_dir(namespace)
+                    manifest = corpus_manifest_hash(corpus_dir) if corpus_dir else ""
+                except OSError:
+                    manifest = ""
+                job_id = self.persistent.get_meta(ingestion_meta_key(namespace)) if self.persistent else None
+                version = f"{manifest}:{job_id or ''}"
+                self._versions[namespace] = (time.monotonic(), version)
+            return version
+
+    def invalidate_version(self):
+        """Recompute the corpus versions on the next lookup"""
+        with self._version_lock:
+            self._versions.clear()
+
+    def get(self, question: str, namespace: Optional[str] = None) -> Optional[str]:
+        """Cached answer for a question, or None"""
+        namespace = _namespace(namespace)
+        version = self.corpus_version(namespace)
+        answer, tier = self.memory.get(question, version, namespace), "memory"
+        if answer is None and self.persistent is not None:
+            try:
+                answer, tier = self.persistent.get(question, version, namespace), "persistent"
+            except sqlite3.Error as e:
+                print(f"Answer cache read failed: {str(e)}")
+            if answer is not None:
+                self.memory.put(question, answer, version, namespace)
+        metrics.inc("school_assistant_answer_cache_lookups_total",
+                    labels={"result": "hit" if answer is not None else "miss",
+                            "tier": tier if answer is not None else "none"},
+                    help_text="Answer cache lookups by result and tier")
+        return answer
+
+    def put(self, question: str, answer: str, namespace: Optional[str] = None):
+        namespace = _namespace(namespace)
+        version = self.corpus_version(namespace)
+        self.memory.put(question, answer, version, namespace)
+        if self.persistent is not None:
+            try:
+                self.persistent.put(question, answer, version, namespace)
+            except sqlite3.Error as e:
+                print(f"Answer cache write failed: {str(e)}")
+
+    def __contains__(self, question: str) -> bool:
+        namespace = _namespace(None)
+        version = self.corpus_version(namespace)
+        if self.memory.get(question, version, namespace) is not None:
+            return True
+        return self.persistent is not None and self.persistent.get(question, version, namespace) is not None
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+        self.invalidate_version()
+
+
+_cache: Optional[TieredAnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def _namespace(namespace: Optional[str]) -> str:
+    return current_tenant().cache_namespace if namespace is None else namespace
+
+
+def _corpus_dir(namespace: str) -> Optional[str]:
+    """Corpus directory of the tenant caching under a namespace"""
+    for tenant in get_tenants().values():
+        if tenant.cache_namespace == namespace:
+            return tenant.corpus_dir
+    return None
+
+
+def _persistent_cache() -> Optional[PersistentAnswerCache]:
+    settings = get_section("answer_cache").get("persistent") or {}
+    if not settings.get("enabled", True):
+        return None
+    path = settings.get("db_path") or DEFAULT_CACHE_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(BASE_DIR, path)
+    return PersistentAnswerCache(path, settings.get("max_entries", 5000), settings.get("ttl_seconds", 86400))
+
+
+def get_answer_cache() -> Optional[TieredAnswerCache]:
+    """Process-wide answer cache configured from `answer_cache` (None when disabled)"""
+    global _cache
+    settings = get_section("answer_cache")
+    if not settings.get("enabled", True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TieredAnswerCache(
+                AnswerCache(settings.get("max_entries", 500), settings.get("ttl_seconds", 3600)),
+                _persistent_cache(),
+                (settings.get("persistent") or {}).get("version_check_seconds", 30),
+            )
+        return _cache
+
+
+def record_ingestion(job_id: str, namespace: Optional[str] = None):
+    """
+    Store the ID of a completed ingestion job as part of the corpus version,
+    retiring the cached answers of every process
+    Args:
+        job_id: ingestion job ID
+        namespace: cache namespace of the knowledge base's tenant (default: the current tenant)
+    """
+    cache = get_answer_cache()
+    if cache is None:
+        return
+    try:
+        if cache.persistent is not None:
+            cache.persistent.set_meta(ingestion_meta_key(_namespace(namespace)), job_id)
+        cache.invalidate_version()
+    except sqlite3.Error as e:
+        print(f"Could not record ingestion job in the answer cache: {str(e)}")
+
+
+def clear_answer_cache():
+    """Drop every cached answer, e.g. after the knowledge base changed"""
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,210 @@
+"""
+Per-turn budgets
+
+Every question gets an end-to-end deadline and caps on the number of model
+calls and tool calls the agent may make while answering it (the `turn_budget`
+section of prereqs_config.yaml). The active budget lives in a context variable
+set by assistant.ask, so tools and backend calls running in the agent's worker
+threads see it without extra parameters:
+
+- BudgetHooks (agent_hooks.py) refuse tool calls and model calls once the
+  budget is used up, so the model answers with what it already gathered
+- BedrockCallGuard and HybridRetriever shorten their waits to the time left
+- when even that is not possible, the turn ends with partial_answer(): the
+  findings collected so far instead of an error
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from kb_store.config import get_section
+
+DEFAULTS = {
+    "enabled": True,
+    "deadline_seconds": 20.0,
+    "max_model_calls": 6,
+    "max_tool_calls": 6,
+    "answer_reserve_seconds": 5.0,
+    "partial_answer_chars": 1500,
+}
+
+REFUSED_TOOL_MESSAGE = (
+    "Not run: the {reason} budget for this question is used up. "
+    "Answer now using only the information already gathered."
+)
+
+
+class BudgetExhausted(RuntimeError):
+    """Raised by backend calls that cannot start or finish before the turn deadline"""
+
+
+class TurnBudget:
+    """
+    Deadline and call counters of one question. Shared by the threads working
+    on the turn, so counters are updated under a lock.
+    """
+
+    def __init__(self, deadline_seconds: float, max_model_calls: int, max_tool_calls: int,
+                 answer_reserve_seconds: float = 0.0):
+        self.deadline_seconds = float(deadline_seconds)
+        self.deadline = time.monotonic() + self.deadline_seconds
+        self.max_model_calls = int(max_model_calls)
+        self.max_tool_calls = int(max_tool_calls)
+        self.answer_reserve_seconds = float(answer_reserve_seconds)
+        self.model_calls = 0
+        self.tool_calls = 0
+        self.exhausted: List[str] = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (negative once it has passed)"""
+        return self.deadline - time.monotonic()
+
+    def bound(self, timeout: Optional[float]) -> float:
+        """A timeout shortened so it does not run past the deadline"""
+        remaining = max(0.0, self.remaining())
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def mark_exhausted(self, reason: str):
+        with self._lock:
+            if reason not in self.exhausted:
+                self.exhausted.append(reason)
+
+    def allow_model_call(self) -> Optional[str]:
+        """
+        Count a model call
+        Returns:
+            None if the call may go ahead, otherwise the exhausted budget ("deadline", "model_calls")
+        """
+        with self._lock:
+            # checked and counted together: concurrent tool threads cannot both take the last call
+            if self.remaining() <= 0:
+                reason = "deadline"
+            elif self.model_calls >= self.max_model_calls:
+                reason = "model_calls"
+            else:
+                self.model_calls += 1
+                return None
+        self.mark_exhausted(reason)
+        return reason
+
+    def allow_tool_call(self) -> Optional[str]:
+        """
+        Count a tool call. Tools are refused while the model still has its
+        reserve time and a model call left to write the answer.
+        Returns:
+            None if the call may go ahead, otherwise the exhausted budget
+        """
+        with self._lock:
+            if self.remaining() <= self.answer_reserve_seconds:
+                reason = "deadline"
+            # a tool result needs one more model call: after the last but one there
+            # would be none left to turn the findings into an answer
+            elif self.model_calls >= self.max_model_calls - 1:
+                reason = "model_calls"
+            elif self.tool_calls >= self.max_tool_calls:
+                reason = "tool_calls"
+            else:
+                self.tool_calls += 1
+                return None
+        self.mark_exhausted(reason)
+        return reason
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "remaining_seconds": round(self.remaining(), 3),
+            "model_calls": self.model_calls,
+            "tool_calls": self.tool_calls,
+            "exhausted": list(self.exhausted),
+        }
+
+
+_current_budget: contextvars.ContextVar[Optional[TurnBudget]] = contextvars.ContextVar(
+    "turn_budget", default=None
+)
+
+
+def budget_settings() -> Dict[str, Any]:
+    return {**DEFAULTS, **get_section("turn_budget")}
+
+
+def current_budget() -> Optional[TurnBudget]:
+    """Budget of the turn running in this context, or None outside a turn"""
+    return _current_budget.get()
+
+
+def remaining_seconds(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left in the current turn, or `default` outside a turn"""
+    budget = _current_budget.get()
+    return budget.remaining() if budget is not None else default
+
+
+def bounded_timeout(timeout: Optional[float]) -> Optional[float]:
+    """`timeout` shortened to the time left in the current turn"""
+    budget = _current_budget.get()
+    return budget.bound(timeout) if budget is not None else timeout
+
+
+def check_deadline(operation: str, needed_seconds: float = 0.0):
+    """
+    Raise BudgetExhausted if the current turn has less than `needed_seconds` left
+    Args:
+        operation: name of the call, for the error message
+        needed_seconds: time the call needs at least
+    """
+    budget = _current_budget.get()
+    if budget is not None and budget.remaining() <= needed_seconds:
+        budget.mark_exhausted("deadline")
+        raise BudgetExhausted(f"{operation} skipped: the time budget for this question is used up")
+
+
+@contextmanager
+def turn_budget(**overrides):
+    """
+    Run a turn under the configured budget (None when budgets are disabled)
+    Args:
+        overrides: settings replacing the `turn_budget` config, e.g. deadline_seconds=5
+    """
+    settings = {**budget_settings(), **overrides}
+    budget = None
+    if settings.get("enabled", True):
+        budget = TurnBudget(
+            settings["deadline_seconds"],
+            settings["max_model_calls"],
+            settings["max_tool_calls"],
+            settings["answer_reserve_seconds"],
+        )
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def partial_answer(messages: List[Dict[str, Any]], max_chars: Optional[int] = None) -> str:
+    """
+    Best answer that can be given from a turn cut short: the text the model
+    already wrote and the search results it already received
+    Args:
+        messages: the messages added to the conversation during the turn
+        max_chars: cap on the findings included (default from the config)
+    """
+    max_chars = max_chars or budget_settings()["partial_answer_chars"]
+    findings = []
+    for message in messages:
+        for block in message.get("content", []):
+            if message.get("role") == "assistant" and block.get("text"):
+                findings.append(block["text"].strip())
+            result = block.get("toolResult")
+            if result and result.get("status") != "error":
+                findings.extend(item["text"].strip() for item in result.get("content", []) if item.get("text"))
+    text = "\n\n".join(finding for finding in findings if finding)
+    if not text:
+        return ("I could not finish looking this up in time. Please try again, "
+                "or ask a more specific question.")
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + " …"
+    return f"I could not finish a complete answer in time. Here is what I found so far:\n\n{text}"
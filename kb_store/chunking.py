@@ -0,0 +1,240 @@
+"""
+Chunking profiles
+
+Profiles live under `chunking.profiles` in prereqs_config.yaml and describe
+how documents are split before embedding. Each profile maps to a Bedrock
+chunkingConfiguration (FIXED_SIZE, HIERARCHICAL or SEMANTIC) used by
+create_knowledge_base, and has a local re-implementation so the chunks a
+profile produces can be previewed offline (counts, size histogram, embedding
+tokens and cost) without rebuilding the AWS stack.
+"""
+
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from kb_store.config import get_section
+from kb_store.corpus import Chunk, Document
+from kb_store.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+DEFAULT_PROFILES = {
+    "fixed": {"strategy": "FIXED_SIZE", "max_tokens": 512, "overlap_percentage": 20},
+}
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class ChunkingResult(NamedTuple):
+    chunks: List[Chunk]
+    # extra tokens embedded during ingestion that do not end up in the index
+    # (semantic chunking embeds every sentence group to find breakpoints)
+    extra_embedding_tokens: int
+
+
+def get_profiles() -> Dict[str, Dict[str, Any]]:
+    """All configured chunking profiles"""
+    return get_section("chunking").get("profiles") or DEFAULT_PROFILES
+
+
+def get_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    A chunking profile by name, defaulting to `chunking.profile`
+    Args:
+        name: profile name
+    """
+    profiles = get_profiles()
+    name = name or get_section("chunking").get("profile", "fixed")
+    if name not in profiles:
+        raise ValueError(f"Unknown chunking profile '{name}'. Available profiles: {', '.join(profiles)}")
+    return profiles[name]
+
+
+def bedrock_chunking_configuration(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Translate a profile into the chunkingConfiguration of a Bedrock data source
+    Args:
+        profile: a chunking profile from the config
+    """
+    strategy = profile.get("strategy", "FIXED_SIZE")
+    if strategy == "FIXED_SIZE":
+        return {
+            "chunkingStrategy": "FIXED_SIZE",
+            "fixedSizeChunkingConfiguration": {
+                "maxTokens": profile.get("max_tokens", 512),
+                "overlapPercentage": profile.get("overlap_percentage", 20),
+            },
+        }
+    if strategy == "HIERARCHICAL":
+        return {
+            "chunkingStrategy": "HIERARCHICAL",
+            "hierarchicalChunkingConfiguration": {
+                "levelConfigurations": [
+                    {"maxTokens": profile.get("parent_max_tokens", 1500)},
+                    {"maxTokens": profile.get("child_max_tokens", 300)},
+                ],
+                "overlapTokens": profile.get("overlap_tokens", 60),
+            },
+        }
+    if strategy == "SEMANTIC":
+        return {
+            "chunkingStrategy": "SEMANTIC",
+            "semanticChunkingConfiguration": {
+                "maxTokens": profile.get("max_tokens", 300),
+                "bufferSize": profile.get("buffer_size", 1),
+                "breakpointPercentileThreshold": profile.get("breakpoint_percentile_threshold", 95),
+            },
+        }
+    if strategy == "NONE":
+        return {"chunkingStrategy": "NONE"}
+    raise ValueError(f"Unknown chunking strategy '{strategy}'")
+
+
+def _word_tokens(word: str) -> float:
+    # the word plus its separating space, on the same scale as estimate_tokens
+    return (len(word) + 1) / CHARS_PER_TOKEN
+
+
+def split_by_tokens(document: Document, max_tokens: int, overlap_tokens: int, prefix: str = "") -> List[Chunk]:
+    """
+    Split a document into windows of at most `max_tokens` estimated tokens,
+    each overlapping the previous one by about `overlap_tokens`
+    """
+    words = document.text.split()
+    costs = [_word_tokens(word) for word in words]
+    chunks, start = [], 0
+    while start < len(words):
+        end, size = start, 0
+        while end < len(words) and (size + costs[end] <= max_tokens or end == start):
+            size += costs[end]
+            end += 1
+        chunks.append(Chunk(f"{document.source}#{prefix}{len(chunks)}", document.source, " ".join(words[start:end])))
+        if end >= len(words):
+            break
+        # step back over the overlap, always moving forward by at least one word
+        back, overlap = end, 0
+        while back > start + 1 and overlap + costs[back - 1] <= overlap_tokens:
+            back -= 1
+            overlap += costs[back]
+        start = back
+    return chunks
+
+
+def chunk_fixed_size(document: Document, profile: Dict[str, Any]) -> ChunkingResult:
+    max_tokens = profile.get("max_tokens", 512)
+    overlap = int(max_tokens * profile.get("overlap_percentage", 20) / 100)
+    return ChunkingResult(split_by_tokens(document, max_tokens, overlap), 0)
+
+
+def chunk_hierarchical(document: Document, profile: Dict[str, Any]) -> ChunkingResult:
+    """
+    Parent chunks of parent_max_tokens, each split into child chunks of
+    child_max_tokens. Only children are embedded; parents are what Bedrock
+    returns at query time.
+    """
+    children = []
+    parents = split_by_tokens(document, profile.get("parent_max_tokens", 1500), profile.get("overlap_tokens", 60))
+    for p, parent in enumerate(parents):
+        parent_document = Document(document.source, parent.text)
+        children.extend(split_by_tokens(
+            parent_document, profile.get("child_max_tokens", 300), profile.get("overlap_tokens", 60), prefix=f"{p}.",
+        ))
+    return ChunkingResult(children, 0)
+
+
+def chunk_semantic(document: Document, profile: Dict[str, Any], embedder) -> ChunkingResult:
+    """
+    Split on sentence boundaries where the embedding distance between
+    consecutive sentence groups exceeds the breakpoint percentile, then cap
+    every chunk at max_tokens
+    """
+    sentences = [sentence.strip() for sentence in _SENTENCE_RE.split(document.text) if sentence.strip()]
+    if not sentences:
+        return ChunkingResult([], 0)
+    buffer = profile.get("buffer_size", 1)
+    groups = [" ".join(sentences[max(0, i - buffer): i + buffer + 1]) for i in range(len(sentences))]
+    extra_tokens = sum(estimate_tokens(group) for group in groups)
+
+    breakpoints = set()
+    if len(groups) > 1:
+        vectors = embedder.embed(groups)
+        distances = 1.0 - np.sum(vectors[:-1] * vectors[1:], axis=1)
+        threshold = np.percentile(distances, profile.get("breakpoint_percentile_threshold", 95))
+        breakpoints = {i + 1 for i, distance in enumerate(distances) if distance >= threshold}
+
+    max_tokens = profile.get("max_tokens", 300)
+    chunks, current = [], []
+    for i, sentence in enumerate(sentences):
+        if current and (i in breakpoints or estimate_tokens(" ".join(current + [sentence])) > max_tokens):
+            chunks.append(" ".join(current))
+            current = []
+        current.append(sentence)
+    if current:
+        chunks.append(" ".join(current))
+
+    result = []
+    for text in chunks:
+        # a single oversized sentence is still split to respect max_tokens
+        for piece in split_by_tokens(Document(document.source, text), max_tokens, 0):
+            result.append(Chunk(f"{document.source}#{len(result)}", document.source, piece.text))
+    return ChunkingResult(result, extra_tokens)
+
+
+def chunk_documents(documents: List[Document], profile: Dict[str, Any], embedder=None) -> ChunkingResult:
+    """
+    Apply a chunking profile to every document
+    Args:
+        documents: documents to chunk
+        profile: chunking profile
+        embedder: embedder used by the semantic strategy
+    """
+    strategy = profile.get("strategy", "FIXED_SIZE")
+    chunks, extra_tokens = [], 0
+    for document in documents:
+        if strategy == "FIXED_SIZE":
+            result = chunk_fixed_size(document, profile)
+        elif strategy == "HIERARCHICAL":
+            result = chunk_hierarchical(document, profile)
+        elif strategy == "SEMANTIC":
+            if embedder is None:
+                raise ValueError("The SEMANTIC strategy needs an embedder")
+            result = chunk_semantic(document, profile, embedder)
+        elif strategy == "NONE":
+            result = ChunkingResult([Chunk(f"{document.source}#0", document.source, document.text)], 0)
+        else:
+            raise ValueError(f"Unknown chunking strategy '{strategy}'")
+        chunks.extend(result.chunks)
+        extra_tokens += result.extra_embedding_tokens
+    return ChunkingResult(chunks, extra_tokens)
+
+
+def chunk_statistics(result: ChunkingResult) -> Dict[str, Any]:
+    """Counts, size distribution and embedding tokens of a chunking result"""
+    sizes = [estimate_tokens(chunk.text) for chunk in result.chunks]
+    if not sizes:
+        return {"chunks": 0, "documents": 0, "total_tokens": 0, "embedding_tokens": result.extra_embedding_tokens,
+                "min": 0, "median": 0, "p95": 0, "max": 0, "sizes": []}
+    return {
+        "chunks": len(sizes),
+        "documents": len({chunk.source for chunk in result.chunks}),
+        "total_tokens": sum(sizes),
+        "embedding_tokens": sum(sizes) + result.extra_embedding_tokens,
+        "min": min(sizes),
+        "median": int(np.median(sizes)),
+        "p95": int(np.percentile(sizes, 95)),
+        "max": max(sizes),
+        "sizes": sizes,
+    }
+
+
+def size_histogram(sizes: List[int], bins: int = 8, width: int = 40) -> str:
+    """Text histogram of chunk sizes in tokens"""
+    if not sizes:
+        return "   (no chunks)"
+    counts, edges = np.histogram(sizes, bins=min(bins, max(1, len(set(sizes)))))
+    peak = max(counts) or 1
+    lines = []
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        bar = "#" * max(1 if count else 0, int(width * count / peak))
+        lines.append(f"   {int(low):>5}-{int(high):<5} tokens | {bar} {count}")
+    return "\n".join(lines)
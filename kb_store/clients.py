@@ -0,0 +1,133 @@
+"""
+AWS client factory
+
+Every boto3 and OpenSearch client of the assistant is created here, with the
+transport settings of the `aws_transport` section of prereqs_config.yaml
+(connection pool size, connect/read timeouts, TCP keepalive, retry mode).
+Clients are thread-safe, so shared_client() keeps one per service and region
+instead of paying for client creation and new connections on every call.
+
+Setting the BEDROCK_FAKE environment variable swaps the Bedrock clients
+(bedrock-runtime, bedrock-agent-runtime, bedrock-agent) and STS for the local
+stand-ins in fake_bedrock.py, so the whole assistant runs offline against kb_files.
+
+    BEDROCK_FAKE=1                    behaviour from the `fake_bedrock` config section
+    BEDROCK_FAKE=path/to/script.yaml  behaviour (latency, throttling) from a script file
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+from kb_store.config import get_section
+
+FAKE_ENV_VAR = "BEDROCK_FAKE"
+FAKE_SERVICES = ("bedrock-runtime", "bedrock-agent-runtime", "bedrock-agent", "sts")
+
+TRANSPORT_DEFAULTS = {
+    "max_pool_connections": 50,
+    "connect_timeout_seconds": 5,
+    "read_timeout_seconds": 60,
+    "tcp_keepalive": True,
+    "retries": {"mode": "adaptive", "max_attempts": 3},
+}
+
+
+def fake_bedrock_enabled() -> bool:
+    """True when BEDROCK_FAKE selects the offline Bedrock stand-ins"""
+    return os.environ.get(FAKE_ENV_VAR, "").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+def transport_settings() -> Dict[str, Any]:
+    return {**TRANSPORT_DEFAULTS, **get_section("aws_transport")}
+
+
+def transport_config(guarded: bool = False, **overrides) -> Config:
+    """
+    botocore Config built from the `aws_transport` config
+    Args:
+        guarded: the calls go through a BedrockCallGuard, which owns the retry
+            policy, so botocore makes a single attempt
+        overrides: settings replacing the `aws_transport` config, e.g. max_pool_connections=10
+    """
+    settings = {**transport_settings(), **overrides}
+    retries = dict(settings.get("retries") or {})
+    if guarded:
+        retries = {"mode": "standard", "max_attempts": 1}
+    return Config(
+        max_pool_connections=settings["max_pool_connections"],
+        connect_timeout=settings["connect_timeout_seconds"],
+        read_timeout=settings["read_timeout_seconds"],
+        tcp_keepalive=settings["tcp_keepalive"],
+        retries=retries,
+    )
+
+
+def create_client(service: str, region_name: Optional[str] = None, config=None, session=None):
+    """
+    Create an AWS client, or its fake when BEDROCK_FAKE is set
+    Args:
+        service: boto3 service name
+        region_name: AWS region
+        config: botocore Config merged over the transport config
+        session: boto3 Session to create the client from (default: the boto3 module)
+    """
+    if fake_bedrock_enabled() and service in FAKE_SERVICES:
+        from kb_store.fake_bedrock import fake_client
+        return fake_client(service, region_name)
+    client_config = transport_config()
+    if config is not None:
+        client_config = client_config.merge(config)
+    return (session or boto3).client(service, region_name=region_name, config=client_config)
+
+
+_shared_clients: Dict[tuple, Any] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def shared_client(service: str, region_name: Optional[str] = None, guarded: bool = False, **overrides):
+    """
+    Process-wide client of a service, created on first use
+    Args:
+        service: boto3 service name
+        region_name: AWS region
+        guarded: the calls go through a BedrockCallGuard (botocore retries disabled)
+        overrides: transport settings of this client, e.g. read_timeout_seconds=5;
+            one client is kept per distinct set
+    """
+    key = (service, region_name, guarded, fake_bedrock_enabled(), tuple(sorted(overrides.items())))
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            config = transport_config(guarded, **overrides) if guarded or overrides else None
+            client = create_client(service, region_name, config=config)
+            _shared_clients[key] = client
+        return client
+
+
+def opensearch_client(host: str, http_auth, **overrides):
+    """
+    OpenSearch client for an OpenSearch Serverless collection
+    Args:
+        host: collection endpoint host
+        http_auth: request signer (AWSV4SignerAuth)
+        overrides: settings replacing `aws_transport.opensearch`
+    """
+    from opensearchpy import OpenSearch, RequestsHttpConnection
+
+    settings = {"timeout_seconds": 300, "pool_maxsize": 10, "max_retries": 3,
+                **(transport_settings().get("opensearch") or {}), **overrides}
+    return OpenSearch(
+        hosts=[{"host": host, "port": 443}],
+        http_auth=http_auth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection,
+        pool_maxsize=settings["pool_maxsize"],
+        timeout=settings["timeout_seconds"],
+        max_retries=settings["max_retries"],
+        retry_on_timeout=True,
+    )
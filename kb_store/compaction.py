@@ -0,0 +1,112 @@
+"""
+Corpus compaction
+
+The kb_files documents are pretty-printed JSON: braces, quotes, indentation and
+repeated keys that Titan embeds during ingestion and that retrieval later puts
+into prompts. Before upload, every file is rewritten as compact,
+self-describing text (see corpus.compact_document) into the
+`corpus_compaction.output_path` directory, and that directory is what
+upload_directory sends to the data bucket. The local index chunks the same
+compact text, so both backends retrieve what Bedrock would.
+
+    python deploy_kb.py --action compact    # write the output and print the token report
+"""
+
+import os
+import shutil
+from typing import List, NamedTuple, Optional
+
+from kb_store.config import get_section
+from kb_store.corpus import KB_STORE_DIR, compact_document, compaction_enabled, kb_files_dir, list_corpus_files
+from kb_store.tokens import estimate_tokens
+
+COMPACT_EXTENSION = ".txt"
+
+
+class CompactedFile(NamedTuple):
+    source: str
+    output: str
+    tokens_before: int
+    tokens_after: int
+
+
+def output_dir(source_dir: Optional[str] = None) -> str:
+    """
+    Absolute path of the directory compacted files are written to: the
+    `corpus_compaction.output_path` for kb_files, a sibling named after any
+    other corpus directory (e.g. a tenant's own kb_files_path)
+    """
+    path = os.path.join(KB_STORE_DIR, get_section("corpus_compaction").get("output_path", "kb_files_compact"))
+    if source_dir is None or os.path.abspath(source_dir) == os.path.abspath(kb_files_dir()):
+        return path
+    return f"{path}-{os.path.basename(os.path.normpath(source_dir))}"
+
+
+def compact_corpus(source_dir: Optional[str] = None, destination: Optional[str] = None) -> List[CompactedFile]:
+    """
+    Write a compact text copy of every corpus file, replacing the previous output
+    Args:
+        source_dir: corpus directory (default: kb_files)
+        destination: output directory (default: corpus_compaction.output_path)
+    Returns:
+        token counts of each file before and after compaction
+    """
+    source_dir = source_dir or kb_files_dir()
+    destination = destination or output_dir(source_dir)
+    # files removed from the corpus must not be uploaded again
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+
+    return [compact_file(source_dir, path, destination) for path in list_corpus_files(source_dir)]
+
+
+def compacted_name(source: str) -> str:
+    """Output path, relative to the output directory, of a corpus file's compact copy"""
+    return os.path.splitext(source)[0] + COMPACT_EXTENSION
+
+
+def compact_file(source_dir: str, path: str, destination: Optional[str] = None) -> CompactedFile:
+    """
+    Write the compact text copy of one corpus file, replacing an older copy
+    Args:
+        source_dir: corpus directory
+        path: the corpus file
+        destination: output directory (default: corpus_compaction.output_path)
+    """
+    destination = destination or output_dir(source_dir)
+    source = os.path.relpath(path, source_dir)
+    with open(path, "r", encoding="utf-8") as file:
+        raw = file.read()
+    text = compact_document(path, raw)
+    output = compacted_name(source)
+    output_path = os.path.join(destination, output)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as file:
+        file.write(text + "\n")
+    return CompactedFile(source, output, estimate_tokens(raw), estimate_tokens(text))
+
+
+def format_compaction_report(results: List[CompactedFile]) -> str:
+    """Per-file and total token counts before and after compaction"""
+    width = max([len(result.source) for result in results] + [len("total")])
+    lines = [f"   {'file':<{width}} {'before':>8} {'after':>8} {'saved':>7}"]
+    for name, before, after in [(r.source, r.tokens_before, r.tokens_after) for r in results] + [
+        ("total", sum(r.tokens_before for r in results), sum(r.tokens_after for r in results))
+    ]:
+        saved = f"{1 - after / before:.0%}" if before else "-"
+        lines.append(f"   {name:<{width}} {before:>8,} {after:>8,} {saved:>7}")
+    return "\n".join(lines)
+
+
+def upload_source_dir(source_dir: str) -> str:
+    """
+    Directory to upload for ingestion: the compacted copy of source_dir
+    (written now, with its token report printed) when compaction is enabled,
+    else source_dir itself
+    """
+    if not compaction_enabled():
+        return source_dir
+    results = compact_corpus(source_dir)
+    print(f"Compacted {len(results)} documents into {output_dir(source_dir)}")
+    print(format_compaction_report(results))
+    return output_dir(source_dir)
@@ -0,0 +1,45 @@
+"""
+Shared access to the project configuration in prereqs_config.yaml
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import yaml
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prereqs_config.yaml")
+
+_config_lock = threading.Lock()
+_config_cache: Optional[Dict[str, Any]] = None
+
+
+def load_config(reload: bool = False) -> Dict[str, Any]:
+    """
+    Load prereqs_config.yaml once and cache it for the lifetime of the process
+    Args:
+        reload: force the file to be read again
+
+    Returns:
+        configuration dictionary (empty if the file cannot be read)
+    """
+    global _config_cache
+    with _config_lock:
+        if _config_cache is None or reload:
+            try:
+                with open(CONFIG_PATH, "r") as file:
+                    _config_cache = yaml.safe_load(file) or {}
+            except (OSError, yaml.YAMLError) as e:
+                print(f"Error reading YAML file: {e}")
+                _config_cache = {}
+        return _config_cache
+
+
+def get_section(name: str) -> Dict[str, Any]:
+    """
+    Return a top-level mapping from the configuration, or an empty dict
+    Args:
+        name: the top-level key in prereqs_config.yaml
+    """
+    section = load_config().get(name)
+    return section if isinstance(section, dict) else {}
@@ -0,0 +1,255 @@
+"""
+Local view of the kb_files corpus
+
+Loads the documents in kb_files, turns JSON into readable text and splits it
+into chunks, so that the corpus can be indexed and searched without AWS.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from kb_store.config import get_section, load_config
+
+KB_STORE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_EXTENSIONS = [".json", ".txt", ".md"]
+
+
+class Document(NamedTuple):
+    source: str
+    text: str
+
+
+class Chunk(NamedTuple):
+    chunk_id: str
+    source: str
+    text: str
+
+
+class SearchResult(NamedTuple):
+    chunk_id: str
+    source: str
+    text: str
+    score: float
+
+
+def kb_files_dir() -> str:
+    """Absolute path of the configured kb_files directory"""
+    return os.path.join(KB_STORE_DIR, load_config().get("kb_files_path", "kb_files"))
+
+
+def is_corpus_file(relative: str, extensions: Optional[Iterable[str]] = None) -> bool:
+    """
+    True for a corpus document: a path inside the corpus with one of the
+    `kb_files_extensions`. False for dotfiles and the files editors write next
+    to the ones being edited: backups (name~), Emacs locks and autosaves
+    (#name#, .#name), vim's write test file 4913 and swap files (.name.swp)
+    Args:
+        relative: path relative to the corpus directory
+        extensions: allowed extensions (default: kb_files_extensions)
+    """
+    if extensions is None:
+        extensions = load_config().get("kb_files_extensions") or DEFAULT_EXTENSIONS
+    parts = relative.replace(os.sep, "/").split("/")
+    name = parts[-1]
+    if parts[0] == ".." or any(part.startswith(".") for part in parts):
+        return False
+    if name.endswith("~") or (name.startswith("#") and name.endswith("#")) or name == "4913":
+        return False
+    return os.path.splitext(name)[1].lower() in {extension.lower() for extension in extensions}
+
+
+def list_corpus_files(directory: str) -> List[str]:
+    """Every corpus document under a directory (see is_corpus_file), sorted for stable ordering"""
+    extensions = load_config().get("kb_files_extensions") or DEFAULT_EXTENSIONS
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            if is_corpus_file(os.path.relpath(path, directory), extensions):
+                paths.append(path)
+    return paths
+
+
+def corpus_manifest_hash(directory: str) -> str:
+    """
+    Content hash of every file in the corpus; changes whenever a file is
+    added, removed or edited
+    """
+    digest = hashlib.sha256()
+    for path in list_corpus_files(directory):
+        digest.update(os.path.relpath(path, directory).encode("utf-8"))
+        with open(path, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+def _json_lines(value: Any, path: str) -> Iterator[str]:
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _json_lines(child, f"{path} > {key}" if path else str(key))
+    elif isinstance(value, list):
+        if all(not isinstance(item, (dict, list)) for item in value):
+            yield f"{path}: " + "; ".join(str(item) for item in value)
+        else:
+            for item in value:
+                yield from _json_lines(item, path)
+    elif value is not None and value != "":
+        yield f"{path}: {value}" if path else str(value)
+
+
+def json_to_text(data: Any) -> str:
+    """Flatten a JSON document into one "key > key: value" line per leaf value"""
+    return "\n".join(_json_lines(data, ""))
+
+
+# fields whose value names the record they belong to
+LABEL_KEYS = ("name", "title", "event")
+
+
+def humanize_key(key: str) -> str:
+    """Readable form of a JSON key, e.g. "clearanceDeadline" -> clearance deadline"""
+    words = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", str(key)).replace("_", " ")
+    return " ".join(words.split()).lower()
+
+
+def _is_leaf(value: Any) -> bool:
+    if isinstance(value, dict):
+        return False
+    return not isinstance(value, list) or all(not isinstance(item, (dict, list)) for item in value)
+
+
+def _leaf_text(value: Any) -> str:
+    if isinstance(value, list):
+        return "; ".join(_leaf_text(item) for item in value if item is not None and item != "")
+    return " ".join(str(value).split())
+
+
+def _json_records(value: Any, section: List[str]) -> Iterator[Tuple[str, str]]:
+    """(section, record) pairs of a JSON value"""
+    if isinstance(value, dict):
+        label_key = next((key for key in LABEL_KEYS if isinstance(value.get(key), str)), None)
+        label = _leaf_text(value[label_key]) if label_key else None
+        nested = [(key, child) for key, child in value.items() if not _is_leaf(child)]
+        fields = [
+            f"{humanize_key(key)}: {_leaf_text(child)}"
+            for key, child in value.items()
+            if key != label_key and _is_leaf(child) and _leaf_text(child)
+        ]
+        if label and section:
+            # a nested record leads with its name; a bare name becomes the heading of its children
+            fields = [label] + fields if fields or not nested else fields
+        elif label:
+            fields.insert(0, f"{humanize_key(label_key)}: {label}")
+        if fields:
+            yield " > ".join(section), " | ".join(fields)
+        for key, child in nested:
+            if label and section:
+                child_section = [label] if isinstance(child, list) else [label, humanize_key(key)]
+            else:
+                child_section = section + [humanize_key(key)]
+            yield from _json_records(child, child_section)
+    elif isinstance(value, list) and not _is_leaf(value):
+        for item in value:
+            yield from _json_records(item, section)
+    elif value is not None and _leaf_text(value):
+        yield " > ".join(section[:-1]), f"{section[-1]}: {_leaf_text(value)}" if section else _leaf_text(value)
+
+
+def json_records(data: Any) -> List[str]:
+    """
+    Compact a JSON document into self-describing text: one line per record
+    with its scalar fields ("Orientation for New Students | date: 2026-01-05"),
+    under a heading naming the section or record it is nested in
+    ("## January - April 2026 Trimester"), without braces, quotes or indentation
+    """
+    lines, current = [], None
+    for section, record in _json_records(data, []):
+        if section != current:
+            if section:
+                lines.extend(["", f"## {section}"])
+            current = section
+        lines.append(record)
+    return lines
+
+
+def compact_document(path: str, raw: str) -> str:
+    """
+    Compact text of a corpus file: JSON as records (see json_records), any
+    other text with runs of spaces and blank lines collapsed
+    Args:
+        path: file path, used to recognise JSON
+        raw: file contents
+    """
+    if path.endswith(".json"):
+        try:
+            return "\n".join(json_records(json.loads(raw))).strip()
+        except json.JSONDecodeError:
+            pass
+    lines = (" ".join(line.split()) for line in raw.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def compaction_enabled() -> bool:
+    """True when corpus files are compacted before they are indexed or ingested"""
+    return get_section("corpus_compaction").get("enabled", True)
+
+
+def load_documents(directory: str, compact: Optional[bool] = None) -> List[Document]:
+    """
+    Read every file of the corpus as text
+    Args:
+        directory: corpus directory, e.g. kb_store/kb_files
+        compact: compact files as they are uploaded for ingestion (see
+            compact_document) instead of flattening JSON to "key > key: value"
+            lines (default: corpus_compaction.enabled)
+    """
+    compact = compaction_enabled() if compact is None else compact
+    documents = []
+    for path in list_corpus_files(directory):
+        source = os.path.relpath(path, directory)
+        with open(path, "r", encoding="utf-8") as file:
+            raw = file.read()
+        if compact:
+            raw = compact_document(path, raw)
+        elif path.endswith(".json"):
+            try:
+                raw = json_to_text(json.loads(raw))
+            except json.JSONDecodeError:
+                pass
+        documents.append(Document(source, raw))
+    return documents
+
+
+def chunk_fixed(document: Document, max_tokens: int = 512, overlap_percentage: int = 20) -> List[Chunk]:
+    """
+    Split a document into fixed-size word windows, mirroring Bedrock's FIXED_SIZE
+    chunking (one word is counted as one token)
+    Args:
+        document: document to split
+        max_tokens: window size
+        overlap_percentage: overlap between consecutive windows
+    """
+    words = document.text.split()
+    step = max(1, int(max_tokens * (100 - overlap_percentage) / 100))
+    chunks = []
+    for start in range(0, max(len(words), 1), step):
+        window = words[start:start + max_tokens]
+        if not window:
+            break
+        chunks.append(Chunk(f"{document.source}#{len(chunks)}", document.source, " ".join(window)))
+        if start + max_tokens >= len(words):
+            break
+    return chunks
+
+
+def load_chunks(directory: str, max_tokens: int = 512, overlap_percentage: int = 20) -> List[Chunk]:
+    """Load and chunk every document of the corpus"""
+    chunks = []
+    for document in load_documents(directory):
+        chunks.extend(chunk_fixed(document, max_tokens, overlap_percentage))
+    return chunks
@@ -0,0 +1,512 @@
+"""
+Offline stand-ins for Bedrock
+
+Lets the assistant run deterministically without AWS credentials, for
+profiling, regression and load tests:
+- FakeBedrockRuntime: converse / converse_stream (asks for one knowledge base
+  search, then answers from the passages it got back) and invoke_model for
+  Titan embeddings
+- FakeAgentRuntime: retrieve / retrieve_and_generate over the local kb_files index
+- FakeBedrockAgent: the knowledge base, data source and ingestion job calls
+- FakeKnowledgeBase: search tool backend (KB_BACKEND=fake) with a simulated delay
+
+Every call first goes through a FakeBehavior that sleeps for a latency drawn
+from a configurable distribution and can throttle, either at random or
+following a repeating pattern. Behaviour is scripted per operation in the
+`fake_bedrock` config section or in a YAML/JSON file named by BEDROCK_FAKE
+(see clients.py).
+"""
+
+import io
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import yaml
+from botocore.exceptions import ClientError
+
+from kb_store.budget import BudgetExhausted, check_deadline
+from kb_store.clients import FAKE_ENV_VAR
+from kb_store.config import get_section, load_config
+from kb_store.corpus import SearchResult
+from kb_store.local_store import HashingEmbedder, get_local_knowledge_base
+from kb_store.tokens import estimate_tokens
+
+FAKE_KB_ID = "FAKEKB0001"
+FAKE_DS_ID = "FAKEDS0001"
+FAKE_ACCOUNT = "000000000000"
+
+
+class LatencyDistribution:
+    """
+    Latency in seconds drawn from a distribution given as a short spec:
+        "0.2" or "fixed:0.2"       always 0.2s
+        "uniform:0.1,0.5"          uniform between 0.1s and 0.5s
+        "normal:0.8,0.2"           mean 0.8s, standard deviation 0.2s
+        "lognormal:0.8,0.5"        median 0.8s, log-space sigma 0.5 (long tail)
+        "exponential:0.3"          mean 0.3s
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+    def __init__(self, kind: str = "fixed", params: Optional[List[float]] = None, seed: Optional[int] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}', expected one of {', '.join(self.KINDS)}")
+        self.kind = kind
+        self.params = list(params or [0.0])
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, seed: Optional[int] = None) -> "LatencyDistribution":
+        if isinstance(spec, LatencyDistribution):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls("fixed", [float(spec)], seed)
+        kind, _, args = str(spec).partition(":")
+        if not args:
+            kind, args = "fixed", kind
+        return cls(kind.strip(), [float(arg) for arg in args.split(",")], seed)
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                value = self.params[0]
+            elif self.kind == "uniform":
+                value = self._random.uniform(self.params[0], self.params[1])
+            elif self.kind == "normal":
+                value = self._random.gauss(self.params[0], self.params[1])
+            elif self.kind == "lognormal":
+                value = self._random.lognormvariate(math.log(self.params[0]), self.params[1])
+            else:
+                value = self._random.expovariate(1.0 / self.params[0])
+        return max(0.0, value)
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{','.join(f'{p:g}' for p in self.params)}"
+
+
+class FakeBehavior:
+    """
+    Latency and throttling of one fake operation
+    Args:
+        latency: latency spec, see LatencyDistribution
+        throttle_rate: probability that a call is throttled
+        throttle_pattern: repeating per-call script, "." passes and "T"
+            throttles, e.g. "....T" throttles every fifth call
+        seed: random seed for reproducible runs
+    """
+
+    def __init__(self, latency="fixed:0", throttle_rate: float = 0.0, throttle_pattern: str = "",
+                 seed: Optional[int] = None):
+        self.latency = LatencyDistribution.parse(latency, seed)
+        self.throttle_rate = throttle_rate
+        self.throttle_pattern = throttle_pattern or ""
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any], seed: Optional[int] = None) -> "FakeBehavior":
+        return cls(settings.get("latency", "fixed:0"), settings.get("throttle_rate", 0.0),
+                   settings.get("throttle_pattern", ""), seed)
+
+    def before_call(self, operation: str):
+        """Sleep for the simulated latency, then raise ThrottlingException if scripted"""
+        with self._lock:
+            call = self.calls
+            self.calls += 1
+            if self.throttle_pattern:
+                throttle = self.throttle_pattern[call % len(self.throttle_pattern)].upper() == "T"
+            else:
+                throttle = self._random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        time.sleep(self.latency.sample())
+        if throttle:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded (fake)"},
+                 "ResponseMetadata": {"HTTPStatusCode": 429}},
+                operation,
+            )
+
+
+class FakeScript:
+    """Per-operation behaviours with a default for unlisted operations"""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        settings = settings or {}
+        self.seed = settings.get("seed")
+        self._operations = settings.get("operations") or {}
+        self._default = self._operations.get("default", {})
+        self._behaviors: Dict[str, FakeBehavior] = {}
+        self._lock = threading.Lock()
+
+    def behavior(self, operation: str) -> FakeBehavior:
+        with self._lock:
+            if operation not in self._behaviors:
+                settings = {**self._default, **self._operations.get(operation, {})}
+                self._behaviors[operation] = FakeBehavior.from_settings(settings, self.seed)
+            return self._behaviors[operation]
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: {"calls": b.calls, "throttled": b.throttled} for name, b in self._behaviors.items()}
+
+
+def load_fake_script() -> FakeScript:
+    """Behaviour from the file named by BEDROCK_FAKE, else the `fake_bedrock` config section"""
+    value = os.environ.get(FAKE_ENV_VAR, "")
+    if value and os.path.isfile(value):
+        with open(value, "r", encoding="utf-8") as file:
+            return FakeScript(json.load(file) if value.endswith(".json") else yaml.safe_load(file))
+    return FakeScript(get_section("fake_bedrock"))
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    parts = []
+    for block in message.get("content", []):
+        if "text" in block:
+            parts.append(block["text"])
+        elif "toolResult" in block:
+            for item in block["toolResult"].get("content", []):
+                if "text" in item:
+                    parts.append(item["text"])
+                elif "json" in item:
+                    parts.append(json.dumps(item["json"]))
+    return "\n".join(parts)
+
+
+def _usage(input_tokens: int, output_text: str) -> Dict[str, int]:
+    output_tokens = estimate_tokens(output_text)
+    return {"inputTokens": input_tokens, "outputTokens": output_tokens, "totalTokens": input_tokens + output_tokens}
+
+
+class FakeBedrockRuntime:
+    """
+    Replacement for the bedrock-runtime client, also usable directly as the
+    client of a strands BedrockModel (`model.client = FakeBedrockRuntime(...)`)
+    """
+
+    def __init__(self, latency="lognormal:0.8,0.4", tool_name: str = "search_knowledge_base",
+                 tool_rate: float = 1.0, throttle_rate: float = 0.0, seed: Optional[int] = None,
+                 script: Optional[FakeScript] = None):
+        self.tool_name = tool_name
+        self.tool_rate = tool_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if script is None:
+            script = FakeScript({"seed": seed, "operations": {
+                "default": {"latency": latency, "throttle_rate": throttle_rate},
+            }})
+        self.script = script
+
+    def _decide(self, operation: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        self.script.behavior(operation).before_call(operation)
+        with self._lock:
+            use_tool = self._random.random() < self.tool_rate
+        messages = request.get("messages", [])
+        last = messages[-1] if messages else {"content": []}
+        input_tokens = sum(estimate_tokens(_message_text(message)) for message in messages)
+        input_tokens += sum(estimate_tokens(block.get("text", "")) for block in request.get("system", []))
+        tool_names = {
+            tool.get("toolSpec", {}).get("name")
+            for tool in (request.get("toolConfig") or {}).get("tools", [])
+        }
+        has_tool_result = any("toolResult" in block for block in last.get("content", []))
+        if use_tool and not has_tool_result and self.tool_name in tool_names:
+            return {"tool_input": {"query": _message_text(last)[:500]}, "input_tokens": input_tokens}
+        if has_tool_result:
+            answer = "Here is what the university documents say:\n\n" + _message_text(last).strip()[:600]
+        else:
+            answer = f"I can help with that. You asked: {_message_text(last)[:200]}"
+        return {"text": answer, "input_tokens": input_tokens}
+
+    def _tool_use_id(self) -> str:
+        with self._lock:
+            return f"tooluse_{self._random.getrandbits(48):012x}"
+
+    def converse(self, **request) -> Dict[str, Any]:
+        decision = self._decide("Converse", request)
+        if "tool_input" in decision:
+            content = [{"toolUse": {"toolUseId": self._tool_use_id(), "name": self.tool_name,
+                                    "input": decision["tool_input"]}}]
+            stop_reason, output = "tool_use", json.dumps(decision["tool_input"])
+        else:
+            content, stop_reason, output = [{"text": decision["text"]}], "end_turn", decision["text"]
+        return {
+            "output": {"message": {"role": "assistant", "content": content}},
+            "stopReason": stop_reason,
+            "usage": _usage(decision["input_tokens"], output),
+            "metrics": {"latencyMs": 0},
+        }
+
+    def converse_stream(self, **request) -> Dict[str, Any]:
+        decision = self._decide("ConverseStream", request)
+        events: List[Dict[str, Any]] = [{"messageStart": {"role": "assistant"}}]
+        if "tool_input" in decision:
+            tool_input = json.dumps(decision["tool_input"])
+            events += [
+                {"contentBlockStart": {"start": {"toolUse": {"toolUseId": self._tool_use_id(),
+                                                             "name": self.tool_name}}}},
+                {"contentBlockDelta": {"delta": {"toolUse": {"input": tool_input}}}},
+                {"contentBlockStop": {}},
+                {"messageStop": {"stopReason": "tool_use"}},
+            ]
+            usage = _usage(decision["input_tokens"], tool_input)
+        else:
+            text = decision["text"]
+            words = text.split(" ")
+            for i in range(0, len(words), 8):
+                events.append({"contentBlockDelta": {"delta": {"text": " ".join(words[i:i + 8]) + " "}}})
+            events += [{"contentBlockStop": {}}, {"messageStop": {"stopReason": "end_turn"}}]
+            usage = _usage(decision["input_tokens"], text)
+        events.append({"metadata": {"usage": usage, "metrics": {"latencyMs": 0}}})
+        return {"stream": events}
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        """Titan-style embeddings from the hashing embedder"""
+        self.script.behavior("InvokeModel").before_call("InvokeModel")
+        request = json.loads(body)
+        text = request.get("inputText", "")
+        vector = HashingEmbedder(request.get("dimensions", 1024)).embed([text])[0]
+        payload = {"embedding": vector.tolist(), "inputTextTokenCount": estimate_tokens(text)}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+
+def _references(results) -> List[Dict[str, Any]]:
+    return [
+        {
+            "content": {"text": result.text},
+            "location": {"type": "S3", "s3Location": {"uri": f"s3://fake-kb/{result.source}"}},
+            "metadata": {"x-amz-bedrock-kb-chunk-id": result.chunk_id},
+        }
+        for result in results
+    ]
+
+
+# retrieve_and_generate sessions live on the service side: shared by every fake client
+_sessions: Dict[str, str] = {}
+_sessions_lock = threading.Lock()
+
+
+class FakeAgentRuntime:
+    """bedrock-agent-runtime retrieve / retrieve_and_generate over the local index"""
+
+    def __init__(self, script: FakeScript):
+        self.script = script
+        self.local_kb = get_local_knowledge_base()
+
+    @staticmethod
+    def _number_of_results(configuration: Dict[str, Any], default: int = 5) -> int:
+        return configuration.get("vectorSearchConfiguration", {}).get("numberOfResults", default)
+
+    def retrieve(self, knowledgeBaseId: str, retrievalQuery: Dict[str, Any],
+                 retrievalConfiguration: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        self.script.behavior("Retrieve").before_call("Retrieve")
+        results = self.local_kb.retrieve(retrievalQuery["text"], self._number_of_results(retrievalConfiguration or {}))
+        references = _references(results)
+        for reference, result in zip(references, results):
+            reference["score"] = float(result.score)
+        return {"retrievalResults": references}
+
+    def retrieve_and_generate(self, input: Dict[str, Any], retrieveAndGenerateConfiguration: Dict[str, Any],
+                              sessionId: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self.script.behavior("RetrieveAndGenerate").before_call("RetrieveAndGenerate")
+        kb_configuration = retrieveAndGenerateConfiguration.get("knowledgeBaseConfiguration", {})
+        number_of_results = self._number_of_results(kb_configuration.get("retrievalConfiguration", {}))
+        with _sessions_lock:
+            if sessionId is not None and sessionId not in _sessions:
+                raise ClientError(
+                    {"Error": {"Code": "ValidationException", "Message": f"Session with Id {sessionId} is not valid."}},
+                    "RetrieveAndGenerate",
+                )
+            previous = _sessions.get(sessionId, "")
+            sessionId = sessionId or str(uuid.uuid4())
+            _sessions[sessionId] = input["text"]
+        # like Bedrock, a follow-up is interpreted with the session's earlier question
+        results = self.local_kb.retrieve(f"{previous} {input['text']}".strip(), number_of_results)
+        if results:
+            text = " ".join(result.text[:300] for result in results[:2])
+        else:
+            text = "Sorry, I am unable to assist you with this request."
+        return {
+            "sessionId": sessionId,
+            "output": {"text": text},
+            "citations": [{
+                "generatedResponsePart": {"textResponsePart": {"text": text, "span": {"start": 0, "end": len(text)}}},
+                "retrievedReferences": _references(results),
+            }] if results else [],
+        }
+
+
+class FakeBedrockAgent:
+    """bedrock-agent calls for the single knowledge base named in the config"""
+
+    def __init__(self, script: FakeScript, region_name: str):
+        self.script = script
+        self.region_name = region_name
+        self.kb_name = load_config().get("knowledge_base_name", "schoolassistant")
+        self.created = datetime.now(timezone.utc)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    def _call(self, operation: str):
+        self.script.behavior(operation).before_call(operation)
+
+    def list_knowledge_bases(self, **kwargs) -> Dict[str, Any]:
+        self._call("ListKnowledgeBases")
+        return {"knowledgeBaseSummaries": [{
+            "knowledgeBaseId": FAKE_KB_ID, "name": self.kb_name, "status": "ACTIVE", "updatedAt": self.created,
+        }]}
+
+    def get_knowledge_base(self, knowledgeBaseId: str, **kwargs) -> Dict[str, Any]:
+        self._call("GetKnowledgeBase")
+        embedding_model = get_section("local_store").get("embedding_model_id", "amazon.titan-embed-text-v2:0")
+        return {"knowledgeBase": {
+            "knowledgeBaseId": knowledgeBaseId,
+            "name": self.kb_name,
+            "description": load_config().get("knowledge_base_description", ""),
+            "status": "ACTIVE",
+            "createdAt": self.created,
+            "updatedAt": self.created,
+            "knowledgeBaseConfiguration": {
+                "type": "VECTOR",
+                "vectorKnowledgeBaseConfiguration": {
+                    "embeddingModelArn": f"arn:aws:bedrock:{self.region_name}::foundation-model/{embedding_model}",
+                },
+            },
+        }}
+
+    def list_data_sources(self, knowledgeBaseId: str, **kwargs) -> Dict[str, Any]:
+        self._call("ListDataSources")
+        return {"dataSourceSummaries": [{
+            "knowledgeBaseId": knowledgeBaseId, "dataSourceId": FAKE_DS_ID, "name": self.kb_name,
+            "status": "AVAILABLE", "updatedAt": self.created,
+        }]}
+
+    def start_ingestion_job(self, knowledgeBaseId: str, dataSourceId: str, **kwargs) -> Dict[str, Any]:
+        """Rebuilds the local index from kb_files; the job completes immediately"""
+        self._call("StartIngestionJob")
+        local_kb = get_local_knowledge_base()
+        local_kb.invalidate()
+        count = local_kb.store.metadata["count"]
+        now = datetime.now(timezone.utc)
+        job = {
+            "knowledgeBaseId": knowledgeBaseId,
+            "dataSourceId": dataSourceId,
+            "ingestionJobId": uuid.uuid4().hex[:10].upper(),
+            "status": "COMPLETE",
+            "statistics": {"numberOfDocumentsScanned": count, "numberOfNewDocumentsIndexed": count,
+                           "numberOfDocumentsFailed": 0},
+            "startedAt": now,
+            "updatedAt": now,
+        }
+        self._jobs[job["ingestionJobId"]] = job
+        return {"ingestionJob": job}
+
+    def get_ingestion_job(self, knowledgeBaseId: str, dataSourceId: str, ingestionJobId: str,
+                          **kwargs) -> Dict[str, Any]:
+        self._call("GetIngestionJob")
+        return {"ingestionJob": self._jobs[ingestionJobId]}
+
+
+class FakeSts:
+    def __init__(self, region_name: str):
+        self.region_name = region_name
+
+    def get_caller_identity(self) -> Dict[str, str]:
+        return {"Account": FAKE_ACCOUNT, "Arn": f"arn:aws:iam::{FAKE_ACCOUNT}:user/fake-bedrock", "UserId": "FAKE"}
+
+
+_script: Optional[FakeScript] = None
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def fake_client(service: str, region_name: Optional[str] = None):
+    """Process-wide fake client for a service, sharing one behaviour script"""
+    global _script
+    region_name = region_name or load_config().get("region_name", "us-east-1")
+    with _clients_lock:
+        if _script is None:
+            _script = load_fake_script()
+        if service not in _clients:
+            if service == "bedrock-runtime":
+                _clients[service] = FakeBedrockRuntime(script=_script, seed=_script.seed)
+            elif service == "bedrock-agent-runtime":
+                _clients[service] = FakeAgentRuntime(_script)
+            elif service == "bedrock-agent":
+                _clients[service] = FakeBedrockAgent(_script, region_name)
+            elif service == "sts":
+                _clients[service] = FakeSts(region_name)
+            else:
+                raise ValueError(f"No fake client for service '{service}'")
+        return _clients[service]
+
+
+def fake_call_counts() -> Dict[str, Dict[str, int]]:
+    """Calls and throttles per fake operation so far"""
+    return _script.snapshot() if _script is not None else {}
+
+
+class FakeKnowledgeBase:
+    """
+    Search tool backend with the KnowledgeBasesForAmazonBedrock query
+    interface, answering from the local index after a simulated delay
+    """
+
+    def __init__(self, latency="uniform:0.05,0.2", throttle_rate: float = 0.0, seed: Optional[int] = None):
+        self.behavior = FakeBehavior(latency, throttle_rate, seed=seed)
+        self.local_kb = get_local_knowledge_base()
+
+    def get_kb_id_from_name(self, kb_name: str) -> str:
+        return self.local_kb.get_kb_id_from_name(kb_name)
+
+    def knowledge_base_ids(self) -> Dict[str, str]:
+        return self.local_kb.knowledge_base_ids()
+
+    def query_knowledge_base(self, kb_id: str, query: str, model_id: str = "amazon.nova-lite-v1:0",
+                             max_results: int = 5) -> str:
+        try:
+            check_deadline("Knowledge base search")
+            self.behavior.before_call("RetrieveAndGenerate")
+        except BudgetExhausted as e:
+            return f"{str(e)}. Answer with the information already gathered."
+        except ClientError:
+            return "The knowledge base is receiving too many requests right now. Do not retry this search right away."
+        return self.local_kb.query_knowledge_base(kb_id, query, model_id, max_results)
+
+    def retrieve_passages(self, kb_id: str, query: str, max_results: int = 5,
+                          read_timeout: Optional[int] = None) -> List[SearchResult]:
+        check_deadline("Knowledge base search")
+        self.behavior.before_call("Retrieve")
+        return self.local_kb.retrieve_passages(kb_id, query, max_results)
+
+
+_fake_kb: Optional[FakeKnowledgeBase] = None
+_fake_kb_lock = threading.Lock()
+
+
+def configure_fake_knowledge_base(latency="uniform:0.05,0.2", throttle_rate: float = 0.0,
+                                  seed: Optional[int] = None) -> FakeKnowledgeBase:
+    """Replace the process-wide fake knowledge base, e.g. with a new latency distribution"""
+    global _fake_kb
+    with _fake_kb_lock:
+        _fake_kb = FakeKnowledgeBase(latency, throttle_rate, seed)
+        return _fake_kb
+
+
+def get_fake_knowledge_base() -> FakeKnowledgeBase:
+    """Process-wide fake knowledge base (KB_BACKEND=fake)"""
+    global _fake_kb
+    with _fake_kb_lock:
+        if _fake_kb is None:
+            _fake_kb = FakeKnowledgeBase()
+        return _fake_kb
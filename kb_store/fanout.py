@@ -0,0 +1,180 @@
+"""
+Fan-out search across knowledge bases
+
+Searches several knowledge bases (e.g. one per faculty or academic year) with
+one query. Every knowledge base is queried concurrently with `retrieve`, so
+results come back as scored passages rather than generated answers. After
+`fan_out.timeout_seconds` (capped by the time left for the question), the
+results that arrived are merged by score and deduplicated. A slow, failing
+or unknown knowledge base is named in the result instead of holding it up.
+"""
+
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from kb_store.budget import BudgetExhausted, remaining_seconds
+from kb_store.config import get_section
+from kb_store.corpus import SearchResult
+from kb_store.tenants import current_tenant
+from kb_store.tool_results import Passage, citation, compact_passages, record_compaction
+from kb_store.tracing import metrics, span
+
+DEFAULTS = {
+    "timeout_seconds": 4.0,
+    "max_results_per_kb": 5,
+    "max_results": 8,
+    "max_workers": 16,
+}
+
+
+class KBOutcome(NamedTuple):
+    name: str
+    status: str            # answered, timeout, error or not_found
+    results: List[SearchResult]
+    seconds: float
+    error: str = ""
+
+
+class FanOutResult(NamedTuple):
+    results: List[tuple]   # (knowledge base name, SearchResult), best first
+    outcomes: List[KBOutcome]
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def settings() -> Dict[str, Any]:
+    return {**DEFAULTS, **get_section("fan_out")}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings()["max_workers"], thread_name_prefix="kb-fanout")
+        return _executor
+
+
+def knowledge_base_names(spec: str) -> List[str]:
+    """
+    Knowledge base names of a search: a comma-separated list, "all" for the
+    knowledge bases of the current tenant, or empty for its main knowledge base
+    """
+    tenant = current_tenant()
+    if not spec.strip():
+        names = [tenant.knowledge_base_name]
+    elif spec.strip().lower() == "all":
+        names = tenant.knowledge_bases
+    else:
+        names = spec.split(",")
+    return list(dict.fromkeys(name.strip() for name in names if name.strip()))
+
+
+def _search_one(kb_manager, name: str, kb_id: str, query: str, max_results: int,
+                read_timeout: int) -> KBOutcome:
+    start = time.perf_counter()
+    try:
+        results = kb_manager.retrieve_passages(kb_id, query, max_results, read_timeout=read_timeout)
+        return KBOutcome(name, "answered", results, time.perf_counter() - start)
+    except BudgetExhausted:
+        # the whole question is out of time, not just this knowledge base
+        raise
+    except Exception as e:
+        print(f"Error searching knowledge base '{name}': {str(e)}")
+        return KBOutcome(name, "error", [], time.perf_counter() - start, str(e))
+
+
+def merge_results(outcomes: Sequence[KBOutcome], max_results: int) -> List[tuple]:
+    """
+    Results of every knowledge base by descending score; a passage found in
+    several knowledge bases is kept once, with its best score
+    """
+    ranked = sorted(
+        ((outcome.name, result) for outcome in outcomes for result in outcome.results),
+        key=lambda item: -item[1].score,
+    )
+    merged, seen = [], set()
+    for name, result in ranked:
+        key = " ".join(result.text.lower().split())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        merged.append((name, result))
+    return merged[:max_results]
+
+
+def fan_out_search(kb_manager, names: Sequence[str], query: str,
+                   timeout_seconds: Optional[float] = None) -> FanOutResult:
+    """
+    Query several knowledge bases concurrently and merge what arrives in time
+    Args:
+        kb_manager: search backend (see kb_tools.get_kb_manager)
+        names: knowledge base names
+        query: the search query
+        timeout_seconds: time given to every knowledge base (default: fan_out.timeout_seconds)
+    Raises:
+        BudgetExhausted: the question has no time left for the searches
+    """
+    config = settings()
+    timeout = min(timeout_seconds or config["timeout_seconds"], max(0.0, remaining_seconds(float("inf"))))
+    # botocore takes whole seconds; a search still running when the fan-out
+    # gives up must not keep its worker for the default read timeout
+    read_timeout = max(1, math.ceil(timeout))
+    executor = _get_executor()
+    with span("kb.fan_out", knowledge_bases=len(names), timeout_seconds=timeout) as fan_out_span:
+        # one list_knowledge_bases call for every name, rather than one per knowledge base
+        lookup_error = ""
+        try:
+            kb_ids = kb_manager.knowledge_base_ids()
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            print(f"Error listing knowledge bases: {str(e)}")
+            kb_ids, lookup_error = None, str(e)
+        # each search runs in a copy of the caller's context: turn deadline, session and span
+        futures = {
+            executor.submit(contextvars.copy_context().run, _search_one, kb_manager, name, kb_ids[name], query,
+                            config["max_results_per_kb"], read_timeout): name
+            for name in names if kb_ids and name in kb_ids
+        }
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            # searches still queued behind a busy pool never start
+            future.cancel()
+        by_name = {
+            name: future.result() if future in done else KBOutcome(name, "timeout", [], timeout)
+            for future, name in futures.items()
+        }
+        outcomes = [
+            by_name.get(name) or (KBOutcome(name, "error", [], 0.0, lookup_error) if kb_ids is None
+                                  else KBOutcome(name, "not_found", [], 0.0))
+            for name in names
+        ]
+        for outcome in outcomes:
+            metrics.inc("school_assistant_fanout_searches_total", labels={"status": outcome.status},
+                        help_text="Knowledge base searches of fan-out queries by outcome")
+        merged = merge_results(outcomes, config["max_results"])
+        fan_out_span.set_attribute("answered", sum(outcome.status == "answered" for outcome in outcomes))
+        fan_out_span.set_attribute("results", len(merged))
+    return FanOutResult(merged, outcomes)
+
+
+def format_fan_out(query: str, result: FanOutResult) -> str:
+    """Merged passages, cited with their knowledge base, plus the knowledge bases left out"""
+    passages = [Passage(f"{citation(item.source)} ({name})", item.text) for name, item in result.results]
+    if passages:
+        compact = compact_passages(query, passages)
+        record_compaction(compact)
+        text = compact.text
+    else:
+        text = "No relevant information found in the searched knowledge bases."
+    missing = [outcome for outcome in result.outcomes if outcome.status != "answered"]
+    if missing:
+        reasons = {"timeout": "did not answer in time", "error": "failed", "not_found": "not found"}
+        text += "\nNot included: " + "; ".join(f"{outcome.name} ({reasons[outcome.status]})" for outcome in missing)
+    return text
@@ -0,0 +1,213 @@
+"""
+Zero-LLM FAQ matcher
+
+Builds an in-memory index of the canonical question/answer pairs in FAQ.json
+and scores incoming questions against it with a blend of normalized-token
+cosine similarity and character n-gram (Dice) similarity. When the best score
+clears the configured threshold, the stored answer is returned directly and
+the agent loop and retrieve_and_generate are skipped entirely. Every tenant
+matches against the FAQ.json of its own corpus directory.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from kb_store.config import get_section
+from kb_store.tenants import current_tenant
+from kb_store.tracing import metrics
+
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "am", "was", "were", "be", "to", "of", "for", "in", "on",
+    "at", "by", "with", "and", "or", "it", "this", "that", "do", "does", "did", "i", "me",
+    "my", "we", "our", "you", "your", "can", "could", "would", "should", "will", "what",
+    "how", "when", "where", "which", "who", "please", "there", "any", "about", "if",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """
+    Lowercase, split on non-alphanumerics, drop stopwords and strip simple
+    plural endings so that "fees"/"fee" and "units"/"unit" match
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def char_ngrams(text: str, n: int = 3) -> Set[str]:
+    """Character n-grams of the normalized text, with word boundaries marked"""
+    padded = " " + " ".join(normalize_tokens(text)) + " "
+    if len(padded.strip()) == 0:
+        return set()
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class FAQEntry(NamedTuple):
+    question: str
+    answer: str
+
+
+class FAQMatch(NamedTuple):
+    question: str
+    answer: str
+    score: float
+
+
+class FAQIndex:
+    """
+    Precomputed similarity index over FAQ question/answer pairs
+    """
+
+    def __init__(self, entries: List[FAQEntry], token_weight: float = 0.5, ngram_size: int = 3):
+        self.entries = entries
+        self.token_weight = token_weight
+        self.ngram_size = ngram_size
+        self._token_vectors: List[Dict[str, float]] = []
+        self._ngram_sets: List[Set[str]] = []
+        # inverted index: ngram -> entries containing it, used to skip unrelated entries
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+
+        document_frequency = Counter()
+        tokenized = [normalize_tokens(entry.question) for entry in entries]
+        for tokens in tokenized:
+            document_frequency.update(set(tokens))
+        total = len(entries)
+        self._idf = {
+            token: math.log((1 + total) / (1 + df)) + 1.0 for token, df in document_frequency.items()
+        }
+        for i, (entry, tokens) in enumerate(zip(entries, tokenized)):
+            self._token_vectors.append(self._weigh(tokens))
+            ngrams = char_ngrams(entry.question, ngram_size)
+            self._ngram_sets.append(ngrams)
+            for ngram in ngrams:
+                self._postings[ngram].add(i)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "FAQIndex":
+        """
+        Build the index from a JSON file shaped like FAQ.json:
+        {"faq": [{"q": "...", "a": "..."}, ...]}
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        items = data.get("faq", []) if isinstance(data, dict) else data
+        entries = [FAQEntry(item["q"], item["a"]) for item in items if item.get("q") and item.get("a")]
+        return cls(entries, **kwargs)
+
+    def _weigh(self, tokens: List[str]) -> Dict[str, float]:
+        counts = Counter(tokens)
+        vector = {token: count * self._idf.get(token, 1.0) for token, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {token: weight / norm for token, weight in vector.items()}
+
+    def score(self, question: str) -> List[FAQMatch]:
+        """All candidate entries sharing at least one n-gram with the question, best first"""
+        query_vector = self._weigh(normalize_tokens(question))
+        query_ngrams = char_ngrams(question, self.ngram_size)
+        candidates = set()
+        for ngram in query_ngrams:
+            candidates |= self._postings.get(ngram, set())
+
+        matches = []
+        for i in candidates:
+            entry_vector = self._token_vectors[i]
+            token_score = sum(weight * entry_vector.get(token, 0.0) for token, weight in query_vector.items())
+            entry_ngrams = self._ngram_sets[i]
+            ngram_score = (
+                2 * len(query_ngrams & entry_ngrams) / (len(query_ngrams) + len(entry_ngrams))
+                if query_ngrams and entry_ngrams else 0.0
+            )
+            score = self.token_weight * token_score + (1 - self.token_weight) * ngram_score
+            matches.append(FAQMatch(self.entries[i].question, self.entries[i].answer, score))
+        return sorted(matches, key=lambda match: match.score, reverse=True)
+
+    def match(self, question: str, threshold: float) -> Optional[FAQMatch]:
+        """
+        Best FAQ entry for the question if its score clears the threshold
+        Args:
+            question: the user's question
+            threshold: minimum blended similarity in [0, 1]
+        """
+        start = time.perf_counter()
+        matches = self.score(question)
+        best = matches[0] if matches and matches[0].score >= threshold else None
+        metrics.observe(
+            "school_assistant_faq_match_seconds", time.perf_counter() - start,
+            help_text="Latency of the FAQ short-circuit lookup",
+            buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025),
+        )
+        metrics.inc(
+            "school_assistant_faq_lookups_total", labels={"result": "hit" if best else "miss"},
+            help_text="FAQ short-circuit lookups by result",
+        )
+        return best
+
+
+# FAQ.json path -> (index, modification time of the indexed file)
+_indexes: Dict[str, Tuple[FAQIndex, float]] = {}
+_index_lock = threading.Lock()
+
+
+def faq_path() -> Optional[str]:
+    """Location of FAQ.json in the current tenant's corpus directory (None without a corpus)"""
+    corpus_dir = current_tenant().corpus_dir
+    if corpus_dir is None:
+        return None
+    return os.path.join(corpus_dir, get_section("faq").get("file", "FAQ.json"))
+
+
+def get_faq_index() -> Optional[FAQIndex]:
+    """
+    FAQ index of the current tenant, built on first use and rebuilt when its
+    FAQ.json is edited (None if disabled or missing)
+    """
+    if not get_section("faq").get("enabled", True):
+        return None
+    path = faq_path()
+    if path is None:
+        return None
+    with _index_lock:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        index, indexed_mtime = _indexes.get(path, (None, None))
+        if index is None or mtime != indexed_mtime:
+            index = FAQIndex.from_file(path, token_weight=get_section("faq").get("token_weight", 0.5))
+            _indexes[path] = (index, mtime)
+        return index
+
+
+def reset_faq_index():
+    """Drop the cached indexes so the next lookups rebuild them from disk"""
+    with _index_lock:
+        _indexes.clear()
+
+
+def match_faq(question: str) -> Optional[FAQMatch]:
+    """Match a question against the FAQ using the configured threshold"""
+    index = get_faq_index()
+    if index is None:
+        return None
+    return index.match(question, float(get_section("faq").get("match_threshold", 0.6)))
+
+
+def faq_hit_rate() -> float:
+    """Share of FAQ lookups answered without the agent since the process started"""
+    hits = metrics.get("school_assistant_faq_lookups_total", {"result": "hit"})
+    misses = metrics.get("school_assistant_faq_lookups_total", {"result": "miss"})
+    return hits / (hits + misses) if hits + misses else 0.0
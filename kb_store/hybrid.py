@@ -0,0 +1,209 @@
+"""
+Hybrid lexical + vector retrieval
+
+Runs BM25 keyword search and vector search over the local corpus
+concurrently, then merges both rankings with reciprocal rank fusion (RRF).
+Keyword search catches literal tokens that embeddings blur ("Form 12",
+"KES 7,500", course codes); vector search catches paraphrases. An optional
+lightweight reranker re-orders the fused candidates by query-term coverage.
+
+Every stage has a latency budget, capped by the time left for the question
+being answered: a search stage that overruns is dropped and the answer is
+built from whatever finished in time; the rerank is skipped when less than
+its budget is left.
+"""
+
+import contextvars
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Sequence
+
+from kb_store.budget import remaining_seconds
+from kb_store.corpus import Chunk, SearchResult
+from kb_store.tracing import metrics, span
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+_CAMEL_RE = re.compile(r"([a-z])([A-Z])")
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+def _stem(token: str) -> str:
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss") and token.isalpha():
+        return token[:-1]
+    return token
+
+
+def lexical_tokens(text: str) -> List[str]:
+    """
+    Lowercase word tokens (camelCase JSON keys split, plural "s" stripped) with
+    thousands separators removed ("7,500" -> "7500"), plus joined word+number
+    pairs ("form 12" -> "form12") so that form numbers and course codes match
+    as a unit
+    """
+    text = _CAMEL_RE.sub(r"\1 \2", text).lower()
+    words = [_stem(token.replace(",", "")) for token in _TOKEN_RE.findall(text)]
+    joined = [
+        f"{a}{b}" for a, b in zip(words, words[1:])
+        if a.isalpha() and b[:1].isdigit()
+    ]
+    return words + joined
+
+
+class BM25Index:
+    """Okapi BM25 over a list of chunks"""
+
+    def __init__(self, chunks: Sequence[Chunk], k1: float = 1.2, b: float = 0.75):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[tuple]] = defaultdict(list)
+        self._lengths = []
+        for i, chunk in enumerate(self.chunks):
+            counts = Counter(lexical_tokens(chunk.text))
+            self._lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                self._postings[token].append((i, count))
+        total = len(self.chunks)
+        self._avg_length = (sum(self._lengths) / total) if total else 0.0
+        self._idf = {
+            token: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self._postings.items()
+        }
+
+    def search(self, query: str, k: int = 10) -> List[SearchResult]:
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(lexical_tokens(query)):
+            idf = self._idf.get(token)
+            if idf is None:
+                continue
+            for i, count in self._postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[i] / (self._avg_length or 1.0))
+                scores[i] += idf * count * (self.k1 + 1) / (count + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            SearchResult(self.chunks[i].chunk_id, self.chunks[i].source, self.chunks[i].text, score)
+            for i, score in best
+        ]
+
+
+def reciprocal_rank_fusion(rankings: List[List[SearchResult]], k: int = 60) -> List[SearchResult]:
+    """
+    Merge several rankings: each result scores sum(1 / (k + rank)) over the
+    rankings it appears in
+    Args:
+        rankings: result lists, best first
+        k: RRF damping constant
+    """
+    fused: Dict[str, float] = defaultdict(float)
+    by_id: Dict[str, SearchResult] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            fused[result.chunk_id] += 1.0 / (k + rank)
+            by_id.setdefault(result.chunk_id, result)
+    return [
+        by_id[chunk_id]._replace(score=score)
+        for chunk_id, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+def rerank_by_coverage(query: str, results: List[SearchResult]) -> List[SearchResult]:
+    """
+    Lightweight reranker: fused score boosted by the share of query terms (and
+    joined word+number literals) that appear verbatim in the chunk
+    """
+    query_terms = set(lexical_tokens(query))
+    if not query_terms:
+        return results
+    reranked = []
+    for result in results:
+        chunk_terms = set(lexical_tokens(result.text))
+        coverage = len(query_terms & chunk_terms) / len(query_terms)
+        reranked.append(result._replace(score=result.score * (1.0 + coverage)))
+    return sorted(reranked, key=lambda result: result.score, reverse=True)
+
+
+class HybridRetriever:
+    """
+    Concurrent BM25 + vector retrieval over a LocalKnowledgeBase with RRF fusion
+    """
+
+    def __init__(self, local_kb, candidates: int = 20, rrf_k: int = 60, rerank: bool = True,
+                 lexical_budget_ms: float = 200, vector_budget_ms: float = 500, rerank_budget_ms: float = 100):
+        self.local_kb = local_kb
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.rerank = rerank
+        self.lexical_budget = lexical_budget_ms / 1000.0
+        self.vector_budget = vector_budget_ms / 1000.0
+        self.rerank_budget = rerank_budget_ms / 1000.0
+        self._bm25: Optional[BM25Index] = None
+        self._bm25_store = None
+        self._lock = threading.Lock()
+
+    @property
+    def bm25(self) -> BM25Index:
+        store = self.local_kb.store
+        with self._lock:
+            # rebuild when the local store was rebuilt or reopened
+            if self._bm25 is None or self._bm25_store is not store:
+                self._bm25 = BM25Index(store.chunks)
+                self._bm25_store = store
+            return self._bm25
+
+    def _timed(self, stage: str, fn, *args):
+        start = time.perf_counter()
+        with span(f"hybrid.{stage}"):
+            results = fn(*args)
+        metrics.observe("school_assistant_retrieval_stage_seconds", time.perf_counter() - start,
+                        {"stage": stage}, help_text="Latency of each hybrid retrieval stage")
+        return results
+
+    def _collect(self, stage: str, future, deadline: float) -> List[SearchResult]:
+        try:
+            return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        except FutureTimeoutError:
+            metrics.inc("school_assistant_retrieval_stage_timeouts_total", labels={"stage": stage},
+                        help_text="Hybrid retrieval stages dropped for exceeding their latency budget")
+            return []
+        except Exception as e:
+            # the other stage still answers the query on its own
+            print(f"Hybrid retrieval {stage} stage failed: {str(e)}")
+            metrics.inc("school_assistant_retrieval_stage_errors_total", labels={"stage": stage},
+                        help_text="Hybrid retrieval stages dropped because they raised an error")
+            return []
+
+    def retrieve(self, query: str, max_results: int = 5) -> List[SearchResult]:
+        """
+        Top results for a query from both retrievers, fused and optionally reranked
+        """
+        with span("hybrid.retrieve", max_results=max_results) as retrieve_span:
+            bm25 = self.bm25
+            start = time.perf_counter()
+            # each stage runs in a copy of the caller's context: turn deadline, tenant, session and span
+            lexical_future = _executor.submit(contextvars.copy_context().run, self._timed, "lexical",
+                                              bm25.search, query, self.candidates)
+            vector_future = _executor.submit(contextvars.copy_context().run, self._timed, "vector",
+                                             self.local_kb.vector_search, query, self.candidates)
+            # stage budgets never run past the deadline of the question being answered
+            turn_end = start + max(0.0, remaining_seconds(float("inf")))
+            lexical = self._collect("lexical", lexical_future, min(start + self.lexical_budget, turn_end))
+            vector = self._collect("vector", vector_future,
+                                   min(start + max(self.lexical_budget, self.vector_budget), turn_end))
+            retrieve_span.set_attribute("lexical_hits", len(lexical))
+            retrieve_span.set_attribute("vector_hits", len(vector))
+
+            fused = reciprocal_rank_fusion([ranking for ranking in (lexical, vector) if ranking], self.rrf_k)
+            if self.rerank and fused:
+                # a rerank cannot be interrupted, so it only starts with its budget still available
+                if turn_end - time.perf_counter() >= self.rerank_budget:
+                    candidates = fused[: max(max_results * 3, max_results)]
+                    fused = self._timed("rerank", rerank_by_coverage, query, candidates)
+                else:
+                    metrics.inc("school_assistant_retrieval_stage_timeouts_total", labels={"stage": "rerank"},
+                                help_text="Hybrid retrieval stages dropped for exceeding their latency budget")
+            return fused[:max_results]
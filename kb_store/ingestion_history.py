@@ -0,0 +1,260 @@
+"""
+Ingestion job history
+
+Every ingestion job that synchronize_data waits for is written to a local
+SQLite store with its timings and document statistics, so slow or failing
+ingestions can be compared with earlier ones instead of scrolling past a
+pretty-printed job. `python deploy_kb.py --action ingestions` and the
+Streamlit admin page (pages/admin.py) show the history and flag regressions:
+a job that took much longer than the median of the jobs before it, or that
+failed more documents than any of them.
+"""
+
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from kb_store.config import get_section
+from kb_store.tracing import metrics
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HISTORY_PATH = os.path.join(BASE_DIR, "traces", "ingestion_history.db")
+
+# Bedrock ingestion job statistics -> history columns
+STATISTICS = {
+    "numberOfDocumentsScanned": "documents_scanned",
+    "numberOfNewDocumentsIndexed": "new_indexed",
+    "numberOfModifiedDocumentsIndexed": "modified_indexed",
+    "numberOfDocumentsDeleted": "deleted",
+    "numberOfDocumentsFailed": "failed",
+    "numberOfMetadataDocumentsScanned": "metadata_scanned",
+    "numberOfMetadataDocumentsModified": "metadata_modified",
+}
+
+COLUMNS = (
+    ["job_id", "knowledge_base_id", "data_source_id", "tenant", "status", "started_at", "ended_at",
+     "duration_seconds", "wall_seconds"]
+    + list(STATISTICS.values())
+    + ["failure_reasons"]
+)
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def job_record(job: Dict[str, Any], wall_seconds: Optional[float] = None,
+               tenant: Optional[str] = None) -> Dict[str, Any]:
+    """
+    History row of a finished ingestion job
+    Args:
+        job: the ingestionJob of get_ingestion_job
+        wall_seconds: time synchronize_data spent waiting for the job
+        tenant: tenant whose knowledge base was ingested
+    """
+    started, ended = _timestamp(job.get("startedAt")), _timestamp(job.get("updatedAt"))
+    stats = job.get("statistics") or {}
+    record = {
+        "job_id": job["ingestionJobId"],
+        "knowledge_base_id": job.get("knowledgeBaseId"),
+        "data_source_id": job.get("dataSourceId"),
+        "tenant": tenant,
+        "status": job.get("status", "UNKNOWN"),
+        "started_at": started if started is not None else time.time(),
+        "ended_at": ended,
+        "duration_seconds": ended - started if started is not None and ended is not None else None,
+        "wall_seconds": wall_seconds,
+        "failure_reasons": json.dumps(job.get("failureReasons") or []),
+    }
+    for key, column in STATISTICS.items():
+        record[column] = int(stats.get(key, 0))
+    return record
+
+
+class IngestionHistory:
+    """SQLite-backed store of finished ingestion jobs"""
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                job_id TEXT PRIMARY KEY,
+                knowledge_base_id TEXT,
+                data_source_id TEXT,
+                tenant TEXT,
+                status TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                ended_at REAL,
+                duration_seconds REAL,
+                wall_seconds REAL,
+                documents_scanned INTEGER NOT NULL DEFAULT 0,
+                new_indexed INTEGER NOT NULL DEFAULT 0,
+                modified_indexed INTEGER NOT NULL DEFAULT 0,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                metadata_scanned INTEGER NOT NULL DEFAULT 0,
+                metadata_modified INTEGER NOT NULL DEFAULT 0,
+                failure_reasons TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ingestion_jobs_started ON ingestion_jobs (started_at)")
+        self._conn.commit()
+
+    def record(self, record: Dict[str, Any]):
+        """Add (or replace) the row of one job, see job_record"""
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO ingestion_jobs ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                [record.get(column) for column in COLUMNS],
+            )
+            self._conn.commit()
+
+    def jobs(self, since_days: Optional[float] = None, limit: int = 50,
+             tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Recorded jobs, oldest first
+        Args:
+            since_days: only include jobs started in the last N days
+            limit: maximum number of (most recent) jobs
+            tenant: only include jobs of one tenant's knowledge base
+        """
+        where, params = [], []
+        if since_days is not None:
+            where.append("started_at >= ?")
+            params.append(time.time() - since_days * 86400)
+        if tenant:
+            where.append("tenant = ?")
+            params.append(tenant)
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM ingestion_jobs {clause} ORDER BY started_at DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        jobs = [dict(zip(COLUMNS, row)) for row in reversed(rows)]
+        for job in jobs:
+            job["failure_reasons"] = json.loads(job["failure_reasons"] or "[]")
+        return jobs
+
+
+def job_seconds(job: Dict[str, Any]) -> Optional[float]:
+    """How long a job took: Bedrock's own timestamps, else the time waited for it"""
+    return job["duration_seconds"] if job["duration_seconds"] is not None else job["wall_seconds"]
+
+
+def find_regressions(jobs: List[Dict[str, Any]], baseline_jobs: Optional[int] = None,
+                     duration_factor: Optional[float] = None) -> List[str]:
+    """
+    Warnings about the latest job compared with the jobs before it
+    Args:
+        jobs: jobs oldest first, as returned by IngestionHistory.jobs
+        baseline_jobs: number of earlier jobs compared against (default: ingestion_history.baseline_jobs)
+        duration_factor: a job slower than this multiple of the baseline median
+            is a regression (default: ingestion_history.duration_factor)
+    """
+    settings = get_section("ingestion_history")
+    baseline_jobs = baseline_jobs or settings.get("baseline_jobs", 10)
+    duration_factor = duration_factor or settings.get("duration_factor", 1.5)
+    if not jobs:
+        return []
+    latest, baseline = jobs[-1], jobs[-1 - baseline_jobs:-1]
+    warnings = []
+    if latest["status"] != "COMPLETE":
+        warnings.append(f"Latest job {latest['job_id']} ended {latest['status']}")
+    if not baseline:
+        return warnings
+    durations = [job_seconds(job) for job in baseline if job["status"] == "COMPLETE" and job_seconds(job)]
+    latest_seconds = job_seconds(latest)
+    if durations and latest_seconds:
+        median = statistics.median(durations)
+        if latest_seconds > duration_factor * median:
+            warnings.append(
+                f"Latest job took {latest_seconds:.0f}s, {latest_seconds / median:.1f}x the median "
+                f"of the previous {len(durations)} jobs ({median:.0f}s)"
+            )
+    most_failed = max(job["failed"] for job in baseline)
+    if latest["failed"] > most_failed:
+        warnings.append(
+            f"Latest job failed {latest['failed']} documents, more than any of the previous "
+            f"{len(baseline)} jobs (at most {most_failed})"
+        )
+    return warnings
+
+
+_history: Optional[IngestionHistory] = None
+_history_lock = threading.Lock()
+
+
+def get_ingestion_history() -> Optional[IngestionHistory]:
+    """Process-wide history configured from the `ingestion_history` section (None when disabled)"""
+    global _history
+    settings = get_section("ingestion_history")
+    if not settings.get("enabled", True):
+        return None
+    with _history_lock:
+        if _history is None:
+            path = settings.get("db_path") or DEFAULT_HISTORY_PATH
+            if not os.path.isabs(path):
+                path = os.path.join(BASE_DIR, path)
+            _history = IngestionHistory(path)
+        return _history
+
+
+def record_ingestion_job(job: Dict[str, Any], wall_seconds: Optional[float] = None,
+                         tenant: Optional[str] = None):
+    """Record a finished ingestion job in the process-wide history; never raises"""
+    try:
+        record = job_record(job, wall_seconds, tenant)
+        metrics.observe(
+            "school_assistant_ingestion_seconds", job_seconds(record) or 0.0,
+            labels={"status": record["status"]},
+            help_text="Duration of knowledge base ingestion jobs",
+            buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+        )
+        history = get_ingestion_history()
+        if history is not None:
+            history.record(record)
+    except Exception as e:
+        print(f"Could not record ingestion job: {str(e)}")
+
+
+def format_history(jobs: List[Dict[str, Any]]) -> str:
+    """Render jobs (oldest first) as a fixed-width text table"""
+    if not jobs:
+        return "No ingestion jobs recorded yet."
+    header = (f"{'started':<18}{'job':<12}{'status':<10}{'seconds':>9}{'scanned':>9}{'new':>7}"
+              f"{'modified':>10}{'deleted':>9}{'failed':>8}")
+    lines = [header, "-" * len(header)]
+    for job in jobs:
+        started = datetime.fromtimestamp(job["started_at"]).strftime("%Y-%m-%d %H:%M")
+        seconds = job_seconds(job)
+        lines.append(
+            f"{started:<18}{job['job_id'][:10]:<12}{job['status'][:9]:<10}"
+            f"{(f'{seconds:.0f}' if seconds is not None else '-'):>9}{job['documents_scanned']:>9}"
+            f"{job['new_indexed']:>7}{job['modified_indexed']:>10}{job['deleted']:>9}{job['failed']:>8}"
+        )
+    completed = [job_seconds(job) for job in jobs if job["status"] == "COMPLETE" and job_seconds(job) is not None]
+    lines.append("-" * len(header))
+    if completed:
+        lines.append(f"{len(jobs)} jobs, median {statistics.median(completed):.0f}s, "
+                     f"slowest {max(completed):.0f}s, {sum(job['failed'] for job in jobs)} documents failed")
+    return "\n".join(lines)
@@ -5,8 +5,6 @@ import uuid
 import boto3.session
 from botocore.exceptions import ClientError
 from opensearchpy import (
-    OpenSearch,
-    RequestsHttpConnection,
     AWSV4SignerAuth,
     RequestError,
 )
@@ -16,7 +14,29 @@ import random
 import yaml
 import os
 import argparse
-from typing import Optional, Dict, Any
+import threading
+from typing import Optional, Dict, Any, List
+from kb_store.answer_cache import record_ingestion
+from kb_store.budget import BudgetExhausted
+from kb_store.chunking import bedrock_chunking_configuration, get_profile
+from kb_store.clients import fake_bedrock_enabled, opensearch_client, shared_client
+from kb_store.config import load_config
+from kb_store.corpus import SearchResult, list_corpus_files
+from kb_store.ingestion_history import record_ingestion_job
+from kb_store.kb_sessions import count_session, get_kb_sessions
+from kb_store.provisioning import ProvisioningState
+from kb_store.resilience import (
+    CircuitOpenError,
+    RateLimitExceeded,
+    error_code,
+    get_guard,
+    is_throttling_error,
+)
+from kb_store.tenants import current_tenant
+from kb_store.tokens import CHARS_PER_TOKEN, estimate_tokens
+from kb_store.tool_results import compact_generated, record_compaction, references_sources
+from kb_store.tracing import metrics, span, traced
+from kb_store.usage import current_session_id, record_usage
 
 valid_embedding_models = [
     "cohere.embed-multilingual-v3",
@@ -52,6 +72,14 @@ def interactive_sleep(seconds: int):
         print(dots, end="\r")
         time.sleep(1)
 
+def text_length(path: str) -> int:
+    """
+    Characters of a text file, for ingestion token estimates (file sizes
+    count the bytes of non-ASCII characters several times)
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        return len(file.read())
+
 class KnowledgeBasesForAmazonBedrock:
     """
     Support class that allows for:
@@ -61,36 +89,40 @@ class KnowledgeBasesForAmazonBedrock:
         - Deletion of all resources created
     """
 
+    @traced("kb.init")
     def __init__(self, suffix=None):
         """
         Class initializer
         """
         boto3_session = boto3.session.Session()
         self.region_name = boto3_session.region_name
-        self.iam_client = boto3_session.client("iam", region_name=self.region_name)
-        self.account_number = (
-            boto3.client("sts", region_name=self.region_name)
-            .get_caller_identity()
-            .get("Account")
-        )
+        if self.region_name is None and fake_bedrock_enabled():
+            self.region_name = load_config().get("region_name", "us-east-1")
+        self.iam_client = shared_client("iam", self.region_name)
+        with span("sts.get_caller_identity"):
+            self.account_number = (
+                shared_client("sts", self.region_name)
+                .get_caller_identity()
+                .get("Account")
+            )
         if suffix is not None:
             self.suffix = suffix
         else:
             self.suffix = str(uuid.uuid4())[:4]
-        self.identity = boto3.client(
-            "sts", region_name=self.region_name
-        ).get_caller_identity()["Arn"]
-        self.aoss_client = boto3_session.client(
-            "opensearchserverless", region_name=self.region_name
-        )
-        self.s3_client = boto3.client("s3", region_name=self.region_name)
-        self.bedrock_agent_client = boto3.client(
-            "bedrock-agent", region_name=self.region_name
-        )
+        with span("sts.get_caller_identity"):
+            self.identity = shared_client(
+                "sts", self.region_name
+            ).get_caller_identity()["Arn"]
+        self.aoss_client = shared_client("opensearchserverless", self.region_name)
+        self.s3_client = shared_client("s3", self.region_name)
+        self.bedrock_agent_client = shared_client("bedrock-agent", self.region_name)
         credentials = boto3.Session().get_credentials()
-        self.awsauth = AWSV4SignerAuth(credentials, self.region_name, "aoss")
+        # offline runs (BEDROCK_FAKE) have no credentials and never reach OpenSearch
+        self.awsauth = AWSV4SignerAuth(credentials, self.region_name, "aoss") if credentials else None
         self.oss_client = None
         self.data_bucket_name = None
+        # characters uploaded since the last ingestion, used to estimate embedding tokens
+        self._pending_ingestion_chars = 0
 
     def create_or_retrieve_knowledge_base(
             self,
@@ -98,6 +130,7 @@ class KnowledgeBasesForAmazonBedrock:
             kb_description: Optional[str] = None,
             data_bucket_name: Optional[str] = None,
             embedding_model: str = "amazon.titan-embed-text-v2:0",
+            chunking_profile: Optional[str] = None,
         ):
         """
         Function used to create a new Knowledge Base or retrieve an existent one
@@ -107,6 +140,7 @@ class KnowledgeBasesForAmazonBedrock:
             kb_description: Knowledge Base Description
             data_bucket_name: Name of s3 Bucket containing Knowledge Base Data
             embedding_model: Name of Embedding model to be used on Knowledge Base creation
+            chunking_profile: chunking profile from prereqs_config.yaml (default: chunking.profile)
 
         Returns:
             kb_id: str - Knowledge base id
@@ -135,6 +169,13 @@ class KnowledgeBasesForAmazonBedrock:
             print(f"Retrieved Data Source Id: {ds_id}")
         else:
             print(f"Creating KB {kb_name}")
+            state = ProvisioningState.for_knowledge_base(kb_name)
+            if state.suffix and state.matches(self.account_number, self.region_name):
+                # reuse the resource names of the interrupted run
+                self.suffix = state.suffix
+                print(f"Resuming provisioning recorded in {state.path}")
+            else:
+                state.start(self.suffix, self.account_number, self.region_name)
             # self.kb_name = kb_name
             # self.kb_description = kb_description
             if data_bucket_name is None:
@@ -162,31 +203,55 @@ class KnowledgeBasesForAmazonBedrock:
             oss_policy_name = f"AmazonBedrockOSSPolicyForKnowledgeBase_{self.suffix}"
             vector_store_name = f"{kb_name}-{self.suffix}"
             index_name = f"{kb_name}-index-{self.suffix}"
+            resumed = self.verify_provisioning_state(state, {
+                "bucket_name": data_bucket_name,
+                "role_name": kb_execution_role_name,
+                "encryption_policy_name": encryption_policy_name,
+                "network_policy_name": network_policy_name,
+                "access_policy_name": access_policy_name,
+                "collection_name": vector_store_name,
+                "index_name": index_name,
+            })
             print(
                 "========================================================================================"
             )
             print(
                 f"Step 1 - Creating or retrieving {data_bucket_name} S3 bucket for Knowledge Base documents"
             )
-            self.create_s3_bucket(data_bucket_name)
+            if state.step("bucket"):
+                print("Completed in a previous run")
+            else:
+                self.create_s3_bucket(data_bucket_name)
+                state.complete("bucket", bucket_name=data_bucket_name)
             print(
                 "========================================================================================"
             )
             print(
                 f"Step 2 - Creating Knowledge Base Execution Role ({kb_execution_role_name}) and Policies"
             )
-            bedrock_kb_execution_role = self.create_bedrock_kb_execution_role(
-                embedding_model,
-                data_bucket_name,
-                fm_policy_name,
-                s3_policy_name,
-                kb_execution_role_name,
-            )
+            if state.step("role"):
+                print("Completed in a previous run")
+                bedrock_kb_execution_role = resumed["role"]
+            else:
+                bedrock_kb_execution_role = self.create_bedrock_kb_execution_role(
+                    embedding_model,
+                    data_bucket_name,
+                    fm_policy_name,
+                    s3_policy_name,
+                    kb_execution_role_name,
+                )
+                state.complete(
+                    "role",
+                    role_name=kb_execution_role_name,
+                    role_arn=bedrock_kb_execution_role["Role"]["Arn"],
+                )
             print(
                 "========================================================================================"
             )
             print(f"Step 3 - Creating OSS encryption, network and data access policies")
-            encryption_policy, network_policy, access_policy = (
+            if state.step("oss_policies"):
+                print("Completed in a previous run")
+            else:
                 self.create_policies_in_oss(
                     encryption_policy_name,
                     vector_store_name,
@@ -194,55 +259,132 @@ class KnowledgeBasesForAmazonBedrock:
                     bedrock_kb_execution_role["Role"]["Arn"],
                     access_policy_name,
                 )
-            )
+                state.complete(
+                    "oss_policies",
+                    encryption_policy_name=encryption_policy_name,
+                    network_policy_name=network_policy_name,
+                    access_policy_name=access_policy_name,
+                )
             print(
                 "========================================================================================"
             )
             print(
                 f"Step 4 - Creating OSS Collection (this step takes a couple of minutes to complete)"
             )
-            oss_result = self.create_oss(
-                vector_store_name, oss_policy_name, bedrock_kb_execution_role
-            )
-            if oss_result is None:
-                raise RuntimeError("Failed to create or retrieve OpenSearch Serverless collection.")
-            host, collection, collection_id, collection_arn = oss_result
+            if state.step("collection"):
+                print("Completed in a previous run")
+                host, collection_arn = resumed["host"], resumed["collection_arn"]
+            else:
+                oss_result = self.create_oss(
+                    vector_store_name, oss_policy_name, bedrock_kb_execution_role
+                )
+                if oss_result is None:
+                    raise RuntimeError("Failed to create or retrieve OpenSearch Serverless collection.")
+                host, collection, collection_id, collection_arn = oss_result
+                state.complete(
+                    "collection",
+                    collection_name=vector_store_name,
+                    collection_id=collection_id,
+                    collection_arn=collection_arn,
+                    host=host,
+                    oss_policy_arn=f"arn:aws:iam::{self.account_number}:policy/{oss_policy_name}",
+                )
             # Build the OpenSearch client
-            self.oss_client = OpenSearch(
-                hosts=[{"host": host, "port": 443}],
-                http_auth=self.awsauth,
-                use_ssl=True,
-                verify_certs=True,
-                connection_class=RequestsHttpConnection,
-                timeout=300,
-            )
+            self.oss_client = opensearch_client(host, self.awsauth)
 
             print(
                 "========================================================================================"
             )
             print(f"Step 5 - Creating OSS Vector Index")
-            self.create_vector_index(index_name)
+            if state.step("index"):
+                print("Completed in a previous run")
+            else:
+                self.create_vector_index(index_name)
+                state.complete("index", index_name=index_name)
             print(
                 "========================================================================================"
             )
             print(f"Step 6 - Creating Knowledge Base")
-            knowledge_base, data_source = self.create_knowledge_base(
-                collection_arn,
-                index_name,
-                data_bucket_name,
-                embedding_model,
-                kb_name,
-                kb_description,
-                bedrock_kb_execution_role,
-            )
-            interactive_sleep(60)
+            if state.step("knowledge_base"):
+                print("Completed in a previous run")
+                kb_id, ds_id = resumed["kb_id"], resumed["ds_id"]
+            else:
+                knowledge_base, data_source = self.create_knowledge_base(
+                    collection_arn,
+                    index_name,
+                    data_bucket_name,
+                    embedding_model,
+                    kb_name,
+                    kb_description,
+                    bedrock_kb_execution_role,
+                    chunking_profile,
+                )
+                kb_id = knowledge_base["knowledgeBaseId"]
+                ds_id = data_source["dataSourceId"]
+                state.complete(
+                    "knowledge_base",
+                    kb_id=kb_id,
+                    kb_arn=knowledge_base.get("knowledgeBaseArn"),
+                    ds_id=ds_id,
+                )
+                interactive_sleep(60)
             print(
                 "========================================================================================"
             )
-            kb_id = knowledge_base["knowledgeBaseId"]
-            ds_id = data_source["dataSourceId"]
         return kb_id, ds_id
     
+    def verify_provisioning_state(self, state: ProvisioningState, names: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Check that the resources of the recorded provisioning steps still exist,
+        with one describe call per step. The first step that fails the check is
+        forgotten together with the steps after it, so provisioning resumes there.
+        Args:
+            state: provisioning state of the knowledge base
+            names: resource names this run expects (bucket_name, role_name, ...)
+
+        Returns:
+            what the remaining steps need from verified ones: role, host,
+            collection_arn, kb_id, ds_id
+        """
+        resumed = {}
+        for step in state.completed_steps():
+            record = state.step(step)
+            try:
+                if any(key in names and names[key] != value for key, value in record.items()):
+                    raise ValueError("resource names changed")
+                if step == "bucket":
+                    self.s3_client.head_bucket(Bucket=record["bucket_name"])
+                    self.data_bucket_name = record["bucket_name"]
+                elif step == "role":
+                    resumed["role"] = self.iam_client.get_role(RoleName=record["role_name"])
+                elif step == "oss_policies":
+                    self.aoss_client.get_security_policy(name=record["encryption_policy_name"], type="encryption")
+                    self.aoss_client.get_security_policy(name=record["network_policy_name"], type="network")
+                    self.aoss_client.get_access_policy(name=record["access_policy_name"], type="data")
+                elif step == "collection":
+                    details = self.aoss_client.batch_get_collection(ids=[record["collection_id"]])["collectionDetails"]
+                    if not details or details[0]["status"] != "ACTIVE":
+                        raise ValueError("collection is not active")
+                    self.iam_client.get_policy(PolicyArn=record["oss_policy_arn"])
+                    resumed["host"], resumed["collection_arn"] = record["host"], record["collection_arn"]
+                    self.oss_client = opensearch_client(record["host"], self.awsauth)
+                elif step == "index":
+                    if not self.oss_client.indices.exists(index=record["index_name"]):
+                        raise ValueError("index does not exist")
+                elif step == "knowledge_base":
+                    status = self.bedrock_agent_client.get_knowledge_base(
+                        knowledgeBaseId=record["kb_id"]
+                    )["knowledgeBase"]["status"]
+                    if status in ("DELETING", "FAILED"):
+                        raise ValueError(f"knowledge base is {status}")
+                    resumed["kb_id"], resumed["ds_id"] = record["kb_id"], record["ds_id"]
+            except Exception as e:
+                print(f"Recorded step '{step}' could not be verified ({str(e)}), resuming from it")
+                state.discard_from(step)
+                break
+            print(f"Verified step '{step}' from a previous run")
+        return resumed
+
     def create_s3_bucket(self, bucket_name: str):
         """
         Check if bucket exists, and if not create S3 bucket for knowledge base data source
@@ -263,17 +405,71 @@ class KnowledgeBasesForAmazonBedrock:
                     CreateBucketConfiguration={"LocationConstraint": self.region_name},
                 )
 
-    def upload_directory(self, s3_path, bucket_name):
+    @traced("kb.upload_directory")
+    def upload_directory(self, s3_path, bucket_name, remove_stale=False):
         """
         Upload files from a local path to s3
             s3_path: local path of the document
             bucket_name: bucket name
+            remove_stale: delete objects of the bucket that are not part of this
+                upload (e.g. the JSON originals of compacted files), so the next
+                ingestion does not index them too
         """
-        for root, dirs, files in os.walk(s3_path):
-            for file in files:
-                file_to_upload = os.path.join(root, file)
-                print(f"uploading file {file_to_upload} to {bucket_name}")
-                self.s3_client.upload_file(file_to_upload, bucket_name, file)
+        uploaded = set()
+        for file_to_upload in list_corpus_files(s3_path):
+            file = os.path.basename(file_to_upload)
+            print(f"uploading file {file_to_upload} to {bucket_name}")
+            self.s3_client.upload_file(file_to_upload, bucket_name, file)
+            self._pending_ingestion_chars += text_length(file_to_upload)
+            uploaded.add(file)
+        if remove_stale:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket_name):
+                for obj in page.get("Contents", []):
+                    if obj["Key"] not in uploaded:
+                        print(f"removing stale object {obj['Key']} from {bucket_name}")
+                        self.s3_client.delete_object(Bucket=bucket_name, Key=obj["Key"])
+
+    @traced("kb.upload_files")
+    def upload_files(self, files, bucket_name):
+        """
+        Upload single files to s3, e.g. the ones changed since the last sync
+            files: object key -> local path
+            bucket_name: bucket name
+        """
+        for key, path in files.items():
+            print(f"uploading file {path} to {bucket_name}")
+            self.s3_client.upload_file(path, bucket_name, key)
+            self._pending_ingestion_chars += text_length(path)
+
+    @traced("kb.delete_objects")
+    def delete_objects(self, keys, bucket_name):
+        """
+        Delete objects from s3 so the next ingestion removes their documents
+            keys: object keys
+            bucket_name: bucket name
+        """
+        for key in keys:
+            print(f"removing object {key} from {bucket_name}")
+            self.s3_client.delete_object(Bucket=bucket_name, Key=key)
+
+    def get_data_source(self, kb_id):
+        """
+        Get the data source of an existing Knowledge Base and remember its data bucket
+        Args:
+            kb_id: knowledge base id
+        Returns:
+            data source id, or None if the knowledge base has none
+        """
+        ds_available = self.bedrock_agent_client.list_data_sources(
+            knowledgeBaseId=kb_id,
+            maxResults=100,
+        )
+        for ds in ds_available["dataSourceSummaries"]:
+            if kb_id == ds["knowledgeBaseId"]:
+                self.data_bucket_name = self._get_knowledge_base_s3_bucket(kb_id, ds["dataSourceId"])
+                return ds["dataSourceId"]
+        return None
 
     def get_data_bucket_name(self):
         """
@@ -705,6 +901,7 @@ class KnowledgeBasesForAmazonBedrock:
         kb_name: str,
         kb_description: str,
         bedrock_kb_execution_role: Dict[str, Any],
+        chunking_profile: Optional[str] = None,
     ):
         """
         Create Knowledge Base and its Data Source. If existent, retrieve
@@ -716,6 +913,7 @@ class KnowledgeBasesForAmazonBedrock:
             kb_name: knowledge base name
             kb_description: knowledge base description
             bedrock_kb_execution_role: knowledge base execution role
+            chunking_profile: chunking profile from prereqs_config.yaml (default: chunking.profile)
 
         Returns:
             knowledge base object,
@@ -732,13 +930,8 @@ class KnowledgeBasesForAmazonBedrock:
         }
 
         # Ingest strategy - How to ingest data from the data source
-        chunking_strategy_configuration = {
-            "chunkingStrategy": "FIXED_SIZE",
-            "fixedSizeChunkingConfiguration": {
-                "maxTokens": 512,
-                "overlapPercentage": 20,
-            },
-        }
+        chunking_strategy_configuration = bedrock_chunking_configuration(get_profile(chunking_profile))
+        print(f"Chunking configuration: {chunking_strategy_configuration}")
 
         # The data source to ingest documents from, into the OpenSearch serverless knowledge base index
         s3_configuration = {
@@ -818,6 +1011,7 @@ class KnowledgeBasesForAmazonBedrock:
             pp.pprint(ds)
         return kb, ds
     
+    @traced("kb.synchronize_data")
     def synchronize_data(self, kb_id, ds_id):
         """
         Start an ingestion job to synchronize data from an S3 bucket to the Knowledge Base
@@ -825,7 +1019,10 @@ class KnowledgeBasesForAmazonBedrock:
         Args:
             kb_id: knowledge base id
             ds_id: data source id
+        Returns:
+            the finished ingestion job
         """
+        start = time.perf_counter()
         # ensure that the kb is available
         i_status = ["CREATING", "DELETING", "UPDATING"]
         while (
@@ -851,7 +1048,24 @@ class KnowledgeBasesForAmazonBedrock:
             job = get_job_response["ingestionJob"]
             interactive_sleep(5)
         pp.pprint(job)
+        record_ingestion_job(job, time.perf_counter() - start, current_tenant().tenant_id)
+        if job["status"] == "COMPLETE":
+            # new corpus version: cached answers built from the old documents are retired
+            record_ingestion(job["ingestionJobId"])
+        if job["status"] == "COMPLETE" and self._pending_ingestion_chars:
+            embedding_model_arn = self.get_kb(kb_id)["knowledgeBase"]["knowledgeBaseConfiguration"][
+                "vectorKnowledgeBaseConfiguration"
+            ]["embeddingModelArn"]
+            record_usage(
+                "ingestion",
+                embedding_model_arn,
+                input_tokens=self._pending_ingestion_chars // CHARS_PER_TOKEN,
+                estimated=True,
+                tool="synchronize_data",
+            )
+            self._pending_ingestion_chars = 0
         # interactive_sleep(40)
+        return job
 
 
     def get_kb(self, kb_id):
@@ -955,14 +1169,7 @@ class KnowledgeBasesForAmazonBedrock:
                         "opensearchServerlessConfiguration"
                     ]["collectionArn"]
                     host = collection_id + "." + self.region_name + ".aoss.amazonaws.com"
-                    self.oss_client = OpenSearch(
-                        hosts=[{"host": host, "port": 443}],
-                        http_auth=self.awsauth,
-                        use_ssl=True,
-                        verify_certs=True,
-                        connection_class=RequestsHttpConnection,
-                        timeout=300,
-                    )
+                    self.oss_client = opensearch_client(host, self.awsauth)
                 self.oss_client.indices.delete(index=index_name)
                 print("OpenSource Serveless Index deleted successfully!")
             except Exception as e:
@@ -1005,6 +1212,7 @@ class KnowledgeBasesForAmazonBedrock:
                 print("Knowledge Base Roles and Policies deleted successfully!")
             except Exception as e:
                 print(e)
+        ProvisioningState.for_knowledge_base(kb_name).clear()
         print("Resources deleted successfully!")
 
     
@@ -1055,15 +1263,15 @@ class KnowledgeBasesForAmazonBedrock:
             Generated response from the knowledge base
         """
         try:
-            # Initialize Bedrock Runtime client
-            bedrock_runtime = boto3.client("bedrock-agent-runtime", region_name=self.region_name)
+            # Shared Bedrock Runtime client, with botocore retries disabled so
+            # that the guard below owns the retry policy
+            bedrock_runtime = shared_client("bedrock-agent-runtime", self.region_name, guarded=True)
             
-            # Query the knowledge base
-            response = bedrock_runtime.retrieve_and_generate(
-                input={
+            request = {
+                "input": {
                     "text": query
                 },
-                retrieveAndGenerateConfiguration={
+                "retrieveAndGenerateConfiguration": {
                     "type": "KNOWLEDGE_BASE",
                     "knowledgeBaseConfiguration": {
                         "knowledgeBaseId": kb_id,
@@ -1075,16 +1283,102 @@ class KnowledgeBasesForAmazonBedrock:
                         }
                     }
                 }
+            }
+            # Continue the KB session of this user session so Bedrock sees the earlier exchange
+            user_session = current_session_id()
+            tenant_id = current_tenant().tenant_id
+            kb_sessions = get_kb_sessions() if user_session else None
+            kb_session = kb_sessions.get(tenant_id, user_session, kb_id) if kb_sessions is not None else None
+
+            # Query the knowledge base (rate limited, retried on throttling, behind a circuit breaker)
+            guard = get_guard("retrieve_and_generate")
+            with span("kb.retrieve_and_generate", kb_id=kb_id, model_id=model_id,
+                      max_results=max_results, query_chars=len(query)) as rag_span:
+                try:
+                    if kb_session:
+                        response = guard.call(bedrock_runtime.retrieve_and_generate, sessionId=kb_session, **request)
+                    else:
+                        response = guard.call(bedrock_runtime.retrieve_and_generate, **request)
+                except ClientError as e:
+                    if not kb_session or error_code(e) != "ValidationException":
+                        raise
+                    # the session expired or was ended on the Bedrock side: start a new one
+                    kb_sessions.drop(tenant_id, user_session, kb_id)
+                    count_session("rejected")
+                    kb_session = None
+                    response = guard.call(bedrock_runtime.retrieve_and_generate, **request)
+                session_state = "reused" if kb_session else "new"
+                rag_span.set_attribute("kb_session", session_state)
+                rag_span.set_attribute("citations", len(response.get("citations", [])))
+            if kb_sessions is not None and response.get("sessionId"):
+                kb_sessions.put(tenant_id, user_session, kb_id, response["sessionId"])
+            count_session(session_state)
+            metrics.observe("school_assistant_kb_query_tokens", estimate_tokens(query), {"session": session_state},
+                            help_text="Estimated tokens of knowledge base queries by KB session state",
+                            buckets=(5, 10, 20, 40, 80, 160, 320))
+
+            # retrieve_and_generate reports no usage: estimate from the query, retrieved chunks and answer
+            retrieved_text = "".join(
+                reference.get("content", {}).get("text", "")
+                for citation in response.get("citations", [])
+                for reference in citation.get("retrievedReferences", [])
+            )
+            record_usage(
+                "kb",
+                model_id,
+                input_tokens=estimate_tokens(query) + estimate_tokens(retrieved_text),
+                output_tokens=estimate_tokens(response.get("output", {}).get("text", "")),
+                estimated=True,
             )
               # Extract and return the generated text
             if 'output' in response and 'text' in response['output']:
-                return response['output']['text']
+                compact = compact_generated(response['output']['text'], references_sources(response))
+                record_compaction(compact)
+                return compact.text
             else:
                 return "No response generated from the knowledge base."
-                
+
+        except BudgetExhausted as e:
+            return f"{str(e)}. Answer with the information already gathered."
+        except CircuitOpenError as e:
+            return f"Knowledge base is temporarily unavailable: {str(e)}. Do not retry this search right away."
+        except RateLimitExceeded as e:
+            return f"Knowledge base is busy: {str(e)}. Do not retry this search right away."
         except Exception as e:
+            if is_throttling_error(e):
+                return "Knowledge base is throttling requests after several retries. Do not retry this search right away."
             return f"Error querying knowledge base: {str(e)}"
     
+    def retrieve_passages(self, kb_id: str, query: str, max_results: int = 5,
+                          read_timeout: Optional[int] = None) -> List[SearchResult]:
+        """
+        Scored passages for a query, without generation (used to merge the
+        results of several knowledge bases). Errors are raised to the caller.
+        Args:
+            kb_id: Knowledge Base ID
+            query: The query string
+            max_results: Maximum number of passages to return
+            read_timeout: seconds to wait for the response (default: aws_transport.read_timeout_seconds)
+        """
+        overrides = {"read_timeout_seconds": read_timeout} if read_timeout else {}
+        bedrock_runtime = shared_client("bedrock-agent-runtime", self.region_name, guarded=True, **overrides)
+        with span("kb.retrieve", kb_id=kb_id, max_results=max_results, query_chars=len(query)) as retrieve_span:
+            response = get_guard("retrieve").call(
+                bedrock_runtime.retrieve,
+                knowledgeBaseId=kb_id,
+                retrievalQuery={"text": query},
+                retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": max_results}},
+            )
+            retrieve_span.set_attribute("results", len(response.get("retrievalResults", [])))
+        results = []
+        for i, result in enumerate(response.get("retrievalResults", [])):
+            source = result.get("location", {}).get("s3Location", {}).get("uri", "")
+            results.append(SearchResult(
+                f"{kb_id}:{source}#{i}", source, result.get("content", {}).get("text", ""), float(result.get("score", 0.0))
+            ))
+        return results
+
+    @traced("kb.get_kb_id_from_name")
     def get_kb_id_from_name(self, kb_name: str) -> str:
         """
         Get Knowledge Base ID from name
@@ -1093,14 +1387,40 @@ class KnowledgeBasesForAmazonBedrock:
             
         Returns:
             Knowledge Base ID or empty string if not found
+        Raises:
+            BudgetExhausted: the current turn has no time left for the lookup
         """
         try:
-            kbs_available = self.bedrock_agent_client.list_knowledge_bases(maxResults=100)
-            for kb in kbs_available["knowledgeBaseSummaries"]:
-                if kb_name == kb["name"]:
-                    return kb["knowledgeBaseId"]
-            return ""
+            return self.knowledge_base_ids().get(kb_name, "")
+        except BudgetExhausted:
+            raise
         except Exception as e:
             print(f"Error retrieving knowledge base ID: {str(e)}")
             return ""
 
+    def knowledge_base_ids(self) -> Dict[str, str]:
+        """
+        IDs of the account's knowledge bases by name, from a single
+        list_knowledge_bases call. Errors are raised to the caller.
+        """
+        kbs_available = get_guard("list_knowledge_bases").call(
+            self.bedrock_agent_client.list_knowledge_bases, maxResults=100
+        )
+        return {kb["name"]: kb["knowledgeBaseId"] for kb in kbs_available["knowledgeBaseSummaries"]}
+
+
+_shared_kb: Optional[KnowledgeBasesForAmazonBedrock] = None
+_shared_kb_lock = threading.Lock()
+
+
+def get_bedrock_knowledge_base() -> KnowledgeBasesForAmazonBedrock:
+    """
+    Process-wide manager used for searches. Knowledge base IDs are passed per
+    call, so one manager (and its clients) serves every tenant, and the STS
+    lookups of the initializer run once instead of on every search.
+    """
+    global _shared_kb
+    with _shared_kb_lock:
+        if _shared_kb is None:
+            _shared_kb = KnowledgeBasesForAmazonBedrock()
+        return _shared_kb
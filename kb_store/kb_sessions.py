@@ -0,0 +1,95 @@
+"""
+Knowledge base sessions
+
+retrieve_and_generate returns a sessionId. Passing it back on the next call
+lets Bedrock use the earlier exchange to interpret a follow-up ("and what
+about the fees for that?"), so the agent does not have to restate the whole
+context in a longer query. The KB session of every user session (the
+session_id given to assistant.ask, within its tenant) is kept here with an idle time-to-live
+(`kb_sessions` in prereqs_config.yaml). Bedrock also expires sessions on its
+side; a rejected session is dropped and the call is retried without it.
+
+A standalone question starts a new KB session, so unrelated questions asked
+one after another under the same session id (cache warm-up) never share
+context. Questions answered concurrently need a session id each, as batch
+runs give them.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from kb_store.config import get_section
+from kb_store.tracing import metrics
+
+
+class KBSessionStore:
+    """
+    Thread-safe LRU of Bedrock KB session ids per (tenant, user session,
+    knowledge base). Session ids are chosen by clients, so two tenants can
+    use the same one.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800, max_sessions: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str, user_session: str, kb_id: str) -> Optional[str]:
+        """KB session id to continue, or None when there is none or it has expired"""
+        key = (tenant_id, user_session, kb_id)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl_seconds:
+                del self._sessions[key]
+                entry = None
+                count_session("expired")
+            if entry is not None:
+                self._sessions.move_to_end(key)
+        return entry[1] if entry else None
+
+    def put(self, tenant_id: str, user_session: str, kb_id: str, kb_session_id: str):
+        key = (tenant_id, user_session, kb_id)
+        with self._lock:
+            self._sessions[key] = (time.time(), kb_session_id)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def drop(self, tenant_id: str, user_session: str, kb_id: str):
+        with self._lock:
+            self._sessions.pop((tenant_id, user_session, kb_id), None)
+
+    def forget(self, tenant_id: str, user_session: str):
+        """Drop every KB session of a user session of a tenant"""
+        with self._lock:
+            for key in [key for key in self._sessions if key[:2] == (tenant_id, user_session)]:
+                del self._sessions[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+def count_session(state: str):
+    """Count a knowledge base call by KB session state (new, reused, expired, rejected)"""
+    metrics.inc("school_assistant_kb_sessions_total", labels={"state": state},
+                help_text="Knowledge base calls by KB session state")
+
+
+_store: Optional[KBSessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_kb_sessions() -> Optional[KBSessionStore]:
+    """Process-wide KB session store, or None when KB sessions are disabled"""
+    global _store
+    settings = get_section("kb_sessions")
+    if not settings.get("enabled", True):
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = KBSessionStore(settings.get("ttl_seconds", 1800), settings.get("max_sessions", 1000))
+        return _store
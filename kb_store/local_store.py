@@ -0,0 +1,413 @@
+"""
+Local vector store backend
+
+An in-process alternative to the OpenSearch Serverless collection used by the
+Bedrock Knowledge Base. Chunk embeddings are stored as an L2-normalized float32
+matrix in a raw file that is memory-mapped at query time, with a JSON sidecar
+holding the chunk texts and index metadata. Every build writes a new vector
+file and the sidecar names it, so replacing the sidecar swaps the whole index. Cosine top-k is a single matrix
+product over the map; large stores also get an IVF index (see ann.py).
+
+Embedders are pluggable:
+    - "hashing": deterministic feature hashing, no network (tests, offline runs)
+    - "bedrock": Amazon Titan text embeddings through bedrock-runtime
+
+LocalKnowledgeBase exposes the same get_kb_id_from_name / query_knowledge_base
+interface as KnowledgeBasesForAmazonBedrock so the KB tools can use either.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from kb_store.ann import IVFIndex
+from kb_store.clients import shared_client
+from kb_store.config import get_section, load_config
+from kb_store.corpus import Chunk, SearchResult, compaction_enabled, corpus_manifest_hash, kb_files_dir, load_chunks
+from kb_store.hybrid import HybridRetriever
+from kb_store.resilience import get_guard
+from kb_store.tool_results import Passage, compact_passages, record_compaction
+from kb_store.tracing import span
+from kb_store.usage import record_usage
+
+KB_STORE_DIR = os.path.dirname(os.path.abspath(__file__))
+VECTORS_FILE = "vectors.f32"   # sidecars written before vector files were versioned
+METADATA_FILE = "metadata.json"
+ANN_DIR = "ann"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Deterministic embedder based on signed feature hashing of word unigrams,
+    word bigrams and character trigrams. Needs no model and no network, so
+    results are reproducible across runs and machines.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimension: int = 512):
+        self.dimension = dimension
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD_RE.findall(text.lower())
+        features = list(words)
+        features += [f"{a}_{b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"#{word}#"
+            features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                matrix[row, value % self.dimension] += 1.0 if (value >> 63) & 1 else -1.0
+        return _normalize_rows(matrix)
+
+
+class BedrockEmbedder:
+    """Amazon Titan text embeddings (one request per text)"""
+
+    name = "bedrock"
+
+    def __init__(self, model_id: str = "amazon.titan-embed-text-v2:0", dimension: int = 1024,
+                 region_name: Optional[str] = None):
+        self.model_id = model_id
+        self.dimension = dimension
+        # calls go through the invoke_model guard, which owns the retry policy
+        self.client = shared_client("bedrock-runtime", region_name or load_config().get("region_name", "us-east-1"),
+                                    guarded=True)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        guard = get_guard("invoke_model")
+        vectors = []
+        for text in texts:
+            body = {"inputText": text}
+            if "v2" in self.model_id:
+                body.update({"dimensions": self.dimension, "normalize": True})
+            response = guard.call(
+                self.client.invoke_model,
+                modelId=self.model_id,
+                body=json.dumps(body),
+                contentType="application/json",
+                accept="application/json",
+            )
+            payload = json.loads(response["body"].read())
+            record_usage("embedding", self.model_id, input_tokens=payload.get("inputTextTokenCount", 0))
+            vectors.append(payload["embedding"])
+        return _normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1))
+
+
+def get_embedder(name: Optional[str] = None, **kwargs):
+    """
+    Build an embedder by name, defaulting to the `local_store.embedder` setting
+    Args:
+        name: "hashing" or "bedrock"
+    """
+    settings = get_section("local_store")
+    name = name or settings.get("embedder", "hashing")
+    if name == "hashing":
+        return HashingEmbedder(dimension=kwargs.get("dimension", settings.get("dimension", 512)))
+    if name == "bedrock":
+        return BedrockEmbedder(
+            model_id=kwargs.get("model_id", settings.get("embedding_model_id", "amazon.titan-embed-text-v2:0")),
+            dimension=kwargs.get("dimension", settings.get("dimension", 1024)),
+        )
+    raise ValueError(f"Unknown embedder '{name}'. Valid embedders: hashing, bedrock")
+
+
+class LocalVectorStore:
+    """
+    Memory-mapped float32 embedding matrix plus a JSON metadata sidecar
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.metadata: Dict[str, Any] = {}
+        self.chunks: List[Chunk] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.ann_index: Optional[IVFIndex] = None
+
+    @property
+    def vectors_path(self) -> str:
+        """Vector file named by the loaded sidecar"""
+        return os.path.join(self.directory, self.metadata.get("vectors_file", VECTORS_FILE))
+
+    @property
+    def metadata_path(self) -> str:
+        return os.path.join(self.directory, METADATA_FILE)
+
+    @property
+    def ann_path(self) -> str:
+        return os.path.join(self.directory, ANN_DIR)
+
+    def exists(self) -> bool:
+        # the sidecar names its vector file, which open() checks
+        return os.path.exists(self.metadata_path)
+
+    def build_ann(self, settings: Optional[Dict[str, Any]] = None) -> Optional[IVFIndex]:
+        """
+        Build and save the IVF index when the store is large enough for it to pay off
+        Args:
+            settings: the `local_store.ann` config section
+        """
+        settings = settings if settings is not None else get_section("local_store").get("ann") or {}
+        if not settings.get("enabled", True) or len(self.chunks) < settings.get("min_vectors", 5000):
+            return None
+        with span("local_kb.build_ann", vectors=len(self.chunks)):
+            index = IVFIndex.build(
+                self.vectors,
+                nlist=settings.get("nlist"),
+                nprobe=settings.get("nprobe", 8),
+                kmeans_iterations=settings.get("kmeans_iterations", 10),
+                train_sample_size=settings.get("train_sample_size", 65536),
+            )
+            index.save(self.ann_path)
+        self.ann_index = IVFIndex.load(self.ann_path)
+        return self.ann_index
+
+    @classmethod
+    def build(cls, directory: str, chunks: List[Chunk], embedder, batch_size: int = 64,
+              extra_metadata: Optional[Dict[str, Any]] = None) -> "LocalVectorStore":
+        """
+        Embed chunks and write the matrix and sidecar to `directory`
+        Args:
+            directory: output directory
+            chunks: chunks to index
+            embedder: object with `name`, `dimension` and `embed(texts)`
+            batch_size: number of chunks embedded per call
+            extra_metadata: additional fields stored in the sidecar (e.g. corpus hash)
+        """
+        os.makedirs(directory, exist_ok=True)
+        store = cls(directory)
+        # a new file per build: readers keep the vectors their sidecar names
+        vectors_file = f"vectors-{time.time_ns()}.f32"
+        matrix = np.memmap(os.path.join(directory, vectors_file), dtype=np.float32, mode="w+",
+                           shape=(max(len(chunks), 1), embedder.dimension))
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            matrix[start:start + len(batch)] = embedder.embed([chunk.text for chunk in batch])
+        matrix.flush()
+        del matrix
+        if os.path.isdir(os.path.join(directory, ANN_DIR)):
+            # a stale ANN index must never be paired with new vectors
+            for name in os.listdir(os.path.join(directory, ANN_DIR)):
+                os.remove(os.path.join(directory, ANN_DIR, name))
+
+        metadata = {
+            "vectors_file": vectors_file,
+            "embedder": embedder.name,
+            "dimension": embedder.dimension,
+            "count": len(chunks),
+            "chunks": [chunk._asdict() for chunk in chunks],
+        }
+        metadata.update(extra_metadata or {})
+        tmp_metadata = store.metadata_path + ".tmp"
+        with open(tmp_metadata, "w", encoding="utf-8") as file:
+            json.dump(metadata, file)
+        # the sidecar is the only file replaced: readers see the old or the new index, never a mix
+        os.replace(tmp_metadata, store.metadata_path)
+        for name in os.listdir(directory):
+            if name != vectors_file and (name == VECTORS_FILE or re.fullmatch(r"vectors-\d+\.f32", name)):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass  # still mapped by a reader (Windows); removed by a later build
+        store.open()
+        store.build_ann()
+        return store
+
+    def open(self) -> "LocalVectorStore":
+        """Load the sidecar and memory-map the embedding matrix it names (read-only)"""
+        for attempt in range(2):
+            with open(self.metadata_path, "r", encoding="utf-8") as file:
+                self.metadata = json.load(file)
+            count, dimension = self.metadata["count"], self.metadata["dimension"]
+            try:
+                self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                         shape=(max(count, 1), dimension))[:count]
+                break
+            except FileNotFoundError:
+                # a rebuild replaced the sidecar and removed its vectors in between
+                if attempt:
+                    raise
+        self.chunks = [Chunk(**chunk) for chunk in self.metadata["chunks"]]
+        self.ann_index = None
+        if IVFIndex.exists(self.ann_path):
+            index = IVFIndex.load(self.ann_path)
+            if index.params.get("count") == count:
+                self.ann_index = index
+        return self
+
+    def search_vector(self, query_vector: np.ndarray, k: int = 5, exact: bool = False) -> List[SearchResult]:
+        """
+        Cosine top-k: through the IVF index when one is loaded, otherwise an
+        exact scan of the memory-mapped matrix (rows are normalized)
+        Args:
+            query_vector: normalized query embedding of shape (dimension,)
+            k: number of results
+            exact: bypass the ANN index
+        """
+        if self.vectors is None or len(self.chunks) == 0:
+            return []
+        if self.ann_index is not None and not exact:
+            ids, scores = self.ann_index.search(query_vector, k)
+            return [
+                SearchResult(self.chunks[i].chunk_id, self.chunks[i].source, self.chunks[i].text, float(score))
+                for i, score in zip(ids, scores)
+            ]
+        scores = self.vectors @ query_vector.astype(np.float32)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            SearchResult(self.chunks[i].chunk_id, self.chunks[i].source, self.chunks[i].text, float(scores[i]))
+            for i in top
+        ]
+
+
+def format_results(query: str, results: List[SearchResult]) -> str:
+    """Render search results as compact, cited passages within the tool-result token budget"""
+    if not results:
+        return "No relevant information found in the knowledge base."
+    compact = compact_passages(query, [Passage(result.source, result.text) for result in results])
+    record_compaction(compact)
+    return compact.text
+
+
+class LocalKnowledgeBase:
+    """
+    Knowledge base backed by a LocalVectorStore built from kb_files.
+    The index is (re)built automatically when the corpus or embedder changes.
+    """
+
+    def __init__(self, corpus_dir: Optional[str] = None, index_dir: Optional[str] = None, embedder=None):
+        settings = get_section("local_store")
+        self.corpus_dir = corpus_dir or kb_files_dir()
+        self.index_dir = index_dir or os.path.join(KB_STORE_DIR, settings.get("index_path", "local_index"))
+        self.embedder = embedder or get_embedder()
+        self.chunk_max_tokens = settings.get("chunk_max_tokens", 200)
+        self.chunk_overlap_percentage = settings.get("chunk_overlap_percentage", 20)
+        self.knowledge_base_name = load_config().get("knowledge_base_name", "schoolassistant")
+        self.max_results_cap = settings.get("max_results_cap")
+        hybrid_settings = settings.get("hybrid") or {}
+        self.hybrid = HybridRetriever(
+            self,
+            candidates=hybrid_settings.get("candidates", 20),
+            rrf_k=hybrid_settings.get("rrf_k", 60),
+            rerank=hybrid_settings.get("rerank", True),
+            lexical_budget_ms=hybrid_settings.get("lexical_budget_ms", 200),
+            vector_budget_ms=hybrid_settings.get("vector_budget_ms", 500),
+            rerank_budget_ms=hybrid_settings.get("rerank_budget_ms", 100),
+        ) if hybrid_settings.get("enabled", True) else None
+        self._store: Optional[LocalVectorStore] = None
+        self._lock = threading.Lock()
+
+    def _is_current(self, store: LocalVectorStore) -> bool:
+        metadata = store.metadata
+        return (
+            metadata.get("corpus_hash") == corpus_manifest_hash(self.corpus_dir)
+            and metadata.get("embedder") == self.embedder.name
+            and metadata.get("dimension") == self.embedder.dimension
+            and metadata.get("chunk_max_tokens") == self.chunk_max_tokens
+            and metadata.get("compact") == compaction_enabled()
+        )
+
+    def build(self) -> LocalVectorStore:
+        """Chunk and embed the corpus into the index directory"""
+        with span("local_kb.build", corpus_dir=self.corpus_dir, embedder=self.embedder.name):
+            chunks = load_chunks(self.corpus_dir, self.chunk_max_tokens, self.chunk_overlap_percentage)
+            return LocalVectorStore.build(
+                self.index_dir, chunks, self.embedder,
+                extra_metadata={
+                    "corpus_hash": corpus_manifest_hash(self.corpus_dir),
+                    "chunk_max_tokens": self.chunk_max_tokens,
+                    "compact": compaction_enabled(),
+                },
+            )
+
+    @property
+    def store(self) -> LocalVectorStore:
+        with self._lock:
+            if self._store is None:
+                store = LocalVectorStore(self.index_dir)
+                if store.exists():
+                    store.open()
+                if not store.exists() or not self._is_current(store):
+                    store = self.build()
+                self._store = store
+            return self._store
+
+    def invalidate(self):
+        """Forget the opened index so it is re-validated on the next query"""
+        with self._lock:
+            self._store = None
+
+    def vector_search(self, query: str, max_results: int = 5) -> List[SearchResult]:
+        """Top-k chunks for a query by embedding similarity only"""
+        store = self.store
+        with span("local_kb.search", max_results=max_results, chunks=len(store.chunks)):
+            query_vector = self.embedder.embed([query])[0]
+            return store.search_vector(query_vector, max_results)
+
+    def retrieve(self, query: str, max_results: int = 5) -> List[SearchResult]:
+        """Top-k chunks for a query, hybrid lexical + vector when enabled"""
+        if self.max_results_cap:
+            max_results = min(max_results, self.max_results_cap)
+        if self.hybrid is not None:
+            return self.hybrid.retrieve(query, max_results)
+        return self.vector_search(query, max_results)
+
+    def retrieve_passages(self, kb_id: str, query: str, max_results: int = 5,
+                          read_timeout: Optional[int] = None) -> List[SearchResult]:
+        """Same interface as KnowledgeBasesForAmazonBedrock.retrieve_passages (nothing to time out)"""
+        return self.retrieve(query, max_results)
+
+    def get_kb_id_from_name(self, kb_name: str) -> str:
+        """The local backend serves a single knowledge base named after the config"""
+        return kb_name if kb_name == self.knowledge_base_name else ""
+
+    def knowledge_base_ids(self) -> Dict[str, str]:
+        """Same interface as KnowledgeBasesForAmazonBedrock.knowledge_base_ids"""
+        return {self.knowledge_base_name: self.knowledge_base_name}
+
+    def query_knowledge_base(self, kb_id: str, query: str, model_id: str = "amazon.nova-lite-v1:0",
+                             max_results: int = 5) -> str:
+        """
+        Same interface as KnowledgeBasesForAmazonBedrock.query_knowledge_base.
+        Returns the retrieved passages, compacted and cited; the calling agent's
+        model writes the answer.
+        """
+        try:
+            return format_results(query, self.retrieve(query, max_results))
+        except Exception as e:
+            return f"Error querying knowledge base: {str(e)}"
+
+
+_local_kb: Optional[LocalKnowledgeBase] = None
+_local_kb_lock = threading.Lock()
+
+
+def get_local_knowledge_base() -> LocalKnowledgeBase:
+    """Process-wide LocalKnowledgeBase so the memory map is opened once"""
+    global _local_kb
+    with _local_kb_lock:
+        if _local_kb is None:
+            _local_kb = LocalKnowledgeBase()
+        return _local_kb
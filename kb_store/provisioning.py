@@ -0,0 +1,100 @@
+"""
+Provisioning checkpoints
+
+create_or_retrieve_knowledge_base creates a knowledge base in six steps (S3
+bucket, IAM role, OpenSearch Serverless policies, collection, vector index,
+knowledge base), several of which wait a minute or more. Every resource name
+carries a random suffix, so a failed run used to leave its resources behind
+and a rerun started over with new names.
+
+After each completed step the names, IDs and ARNs it produced are written to a
+local state file, one per knowledge base name, under
+`provisioning.state_dir`. A rerun reuses the suffix, verifies the recorded
+resources with one cheap describe call per step and resumes at the first step
+that is not complete (or whose resource has disappeared). The file is removed
+when the knowledge base is deleted.
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from kb_store.config import get_section
+
+KB_STORE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STEPS = ["bucket", "role", "oss_policies", "collection", "index", "knowledge_base"]
+
+
+def state_dir() -> str:
+    """Absolute path of the directory holding provisioning state files"""
+    return os.path.join(KB_STORE_DIR, get_section("provisioning").get("state_dir", "provisioning_state"))
+
+
+class ProvisioningState:
+    """Completed provisioning steps of one knowledge base, persisted as JSON"""
+
+    def __init__(self, path: str, data: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.data = data or {"steps": {}}
+
+    @classmethod
+    def for_knowledge_base(cls, kb_name: str) -> "ProvisioningState":
+        """State of a knowledge base, empty if it was never (partially) provisioned"""
+        path = os.path.join(state_dir(), f"{kb_name}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return cls(path, json.load(file))
+        except FileNotFoundError:
+            return cls(path)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable provisioning state {path}: {str(e)}")
+            return cls(path)
+
+    def matches(self, account: str, region: str) -> bool:
+        """True when the state was written for this account and region"""
+        return self.data.get("account") == account and self.data.get("region") == region
+
+    def start(self, suffix: str, account: str, region: str):
+        """Begin a new provisioning run, forgetting any recorded steps"""
+        self.data = {"suffix": suffix, "account": account, "region": region,
+                     "started_at": time.time(), "steps": {}}
+        self.save()
+
+    @property
+    def suffix(self) -> Optional[str]:
+        return self.data.get("suffix")
+
+    def step(self, name: str) -> Optional[Dict[str, Any]]:
+        """Outputs of a completed step, or None"""
+        return self.data["steps"].get(name)
+
+    def complete(self, name: str, **outputs):
+        """Record a completed step and its outputs (names, IDs, ARNs)"""
+        self.data["steps"][name] = {**outputs, "completed_at": time.time()}
+        self.save()
+
+    def discard_from(self, name: str):
+        """Forget a step and every step after it, which depend on its resource"""
+        for step in STEPS[STEPS.index(name):]:
+            self.data["steps"].pop(step, None)
+        self.save()
+
+    def completed_steps(self) -> List[str]:
+        return [step for step in STEPS if step in self.data["steps"]]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.data, file, indent=2)
+        # a crash while writing must not leave a truncated state behind
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Remove the state file, e.g. after the knowledge base was deleted"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
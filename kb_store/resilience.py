@@ -0,0 +1,419 @@
+"""
+Client-side protection for Amazon Bedrock calls
+
+Provides a token-bucket rate limiter sized to the account quotas, retries with
+jittered exponential backoff for throttling and transient errors only, and a
+circuit breaker that fails fast while the service is degraded. One guard is
+kept per Bedrock operation and its state can be inspected with guard_states().
+A tenant with its own `rate_limits` (see tenants.py) gets a guard of its own
+per operation: its calls take a token from the tenant's bucket and then from
+the shared one, and share the operation's circuit breaker.
+"""
+
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ReadTimeoutError,
+)
+
+from kb_store.budget import bounded_timeout, check_deadline
+from kb_store.config import get_section
+from kb_store.tenants import current_tenant
+
+# Error codes that are worth retrying; everything else is surfaced immediately
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "RequestLimitExceeded",
+}
+TRANSIENT_ERROR_CODES = {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "InternalFailure",
+    "ModelNotReadyException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+TRANSIENT_EXCEPTIONS = (
+    ConnectTimeoutError,
+    ReadTimeoutError,
+    EndpointConnectionError,
+    ConnectionClosedError,
+)
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised when a token could not be acquired within the allowed wait"""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit breaker rejects a call"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(
+            f"{name} is temporarily unavailable (circuit open), retry in {retry_after:.0f}s"
+        )
+        self.retry_after = retry_after
+
+
+def error_code(error: BaseException) -> str:
+    """Return the AWS error code of a ClientError, or an empty string"""
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code", "")
+    return ""
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """Check if an exception is a Bedrock throttling error"""
+    return error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Check if an exception is throttling or a transient service/network error"""
+    if isinstance(error, TRANSIENT_EXCEPTIONS):
+        return True
+    code = error_code(error)
+    return code in THROTTLING_ERROR_CODES or code in TRANSIENT_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill continuously at `rate` per second
+    up to `capacity`; each call consumes one token.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens if available
+        Args:
+            tokens: number of tokens to take
+
+        Returns:
+            0.0 if the tokens were taken, otherwise the seconds until they will be available
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.acquired += 1
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Block until tokens are available
+        Args:
+            tokens: number of tokens to take
+            timeout: maximum seconds to wait, None waits indefinitely
+
+        Returns:
+            True if the tokens were taken, False if the timeout expired
+        """
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                self.total_wait_seconds += time.monotonic() - start
+                return True
+            if timeout is not None and time.monotonic() - start + wait > timeout:
+                with self._lock:
+                    self.rejected += 1
+                return False
+            time.sleep(wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current limiter state"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "rate_per_second": self.rate,
+                "capacity": self.capacity,
+                "available_tokens": round(self._tokens, 3),
+                "acquired": self.acquired,
+                "rejected": self.rejected,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+            }
+
+
+class LimiterChain:
+    """Takes a token from every limiter in turn, e.g. a tenant's bucket then the shared one"""
+
+    def __init__(self, *limiters: TokenBucket):
+        self.limiters = limiters
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        start = time.monotonic()
+        for limiter in self.limiters:
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+            if not limiter.acquire(tokens, remaining):
+                return False
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State of the first (most specific) limiter"""
+        return self.limiters[0].snapshot()
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast for `reset_timeout` seconds. Then a limited number of trial calls
+    are let through; one success closes the circuit, one failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _current_state(self, now: float) -> str:
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go through"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == self.OPEN:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.reset_timeout - (now - self._opened_at))
+            if state == self.HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._half_open_calls += 1
+
+    def release(self):
+        """
+        Give back the half-open trial slot of a call that ended without an
+        outcome (a caller error, or an interruption)
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self._consecutive_failures += 1
+            if (
+                self._current_state(now) == self.HALF_OPEN
+                or self._consecutive_failures >= self.failure_threshold
+            ):
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current breaker state"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "seconds_until_retry": (
+                    round(max(0.0, self.reset_timeout - (now - self._opened_at)), 1)
+                    if state == self.OPEN else 0.0
+                ),
+            }
+
+
+class BedrockCallGuard:
+    """
+    Wraps a Bedrock operation with rate limiting, retries and a circuit breaker
+    """
+
+    def __init__(self, name: str, limiter: TokenBucket, breaker: CircuitBreaker,
+                 max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8.0,
+                 acquire_timeout: float = 10.0):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.retries = 0
+        self.throttled = 0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (1-based) attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Call `fn` through the limiter and breaker, retrying retryable errors
+        Raises:
+            CircuitOpenError: the breaker is open
+            RateLimitExceeded: no token could be acquired in time
+            BudgetExhausted: the current turn's deadline leaves no time for the call or its retry
+            the last error raised by `fn` when it is not retryable or retries are exhausted
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            check_deadline(self.name)
+            # the token comes first: a rejected call must not take a half-open trial slot
+            if not self.limiter.acquire(timeout=bounded_timeout(self.acquire_timeout)):
+                raise RateLimitExceeded(
+                    f"{self.name}: client-side rate limit reached, try again shortly"
+                )
+            self.breaker.before_call()
+            recorded = False
+            try:
+                result = fn(*args, **kwargs)
+                self.breaker.record_success()
+                recorded = True
+                return result
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # caller errors (validation, access denied...) say nothing about service health
+                    raise
+                if is_throttling_error(e):
+                    self.throttled += 1
+                self.breaker.record_failure()
+                recorded = True
+                if attempt >= self.max_attempts:
+                    raise
+            finally:
+                if not recorded:
+                    self.breaker.release()
+            delay = self.backoff_delay(attempt)
+            # no retry that would only start after the turn's deadline
+            check_deadline(self.name, delay)
+            self.retries += 1
+            time.sleep(delay)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limiter": self.limiter.snapshot(),
+            "breaker": self.breaker.snapshot(),
+            "retries": self.retries,
+            "throttled": self.throttled,
+        }
+
+
+_guards: Dict[str, BedrockCallGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def _create_guard(operation: str) -> BedrockCallGuard:
+    limits = get_section("bedrock_limits")
+    quota = limits.get(operation) or limits.get("default") or {}
+    retry_cfg = limits.get("retry") or {}
+    breaker_cfg = limits.get("circuit_breaker") or {}
+    return BedrockCallGuard(
+        operation,
+        TokenBucket(
+            rate=quota.get("requests_per_second", 5),
+            capacity=quota.get("burst"),
+        ),
+        CircuitBreaker(
+            operation,
+            failure_threshold=breaker_cfg.get("failure_threshold", 5),
+            reset_timeout=breaker_cfg.get("reset_timeout_seconds", 30),
+            half_open_max_calls=breaker_cfg.get("half_open_max_calls", 1),
+        ),
+        max_attempts=retry_cfg.get("max_attempts", 4),
+        base_delay=retry_cfg.get("base_delay_seconds", 0.5),
+        max_delay=retry_cfg.get("max_delay_seconds", 8.0),
+        acquire_timeout=quota.get("max_wait_seconds", 10.0),
+    )
+
+
+def get_guard(operation: str) -> BedrockCallGuard:
+    """
+    Return the shared guard for a Bedrock operation, creating it from the
+    `bedrock_limits` section of prereqs_config.yaml on first use. When the
+    current tenant has its own rate limit for the operation, the tenant's guard
+    is returned instead.
+    Args:
+        operation: operation name, e.g. "retrieve_and_generate"
+    """
+    tenant = current_tenant()
+    quota = tenant.rate_limits.get(operation) or tenant.rate_limits.get("default")
+    with _guards_lock:
+        guard = _guards.get(operation)
+        if guard is None:
+            guard = _create_guard(operation)
+            _guards[operation] = guard
+        if not quota:
+            return guard
+        name = f"{operation}@{tenant.tenant_id}"
+        tenant_guard = _guards.get(name)
+        if tenant_guard is None:
+            tenant_guard = BedrockCallGuard(
+                name,
+                LimiterChain(
+                    TokenBucket(rate=quota.get("requests_per_second", 5), capacity=quota.get("burst")),
+                    guard.limiter,
+                ),
+                guard.breaker,
+                max_attempts=guard.max_attempts,
+                base_delay=guard.base_delay,
+                max_delay=guard.max_delay,
+                acquire_timeout=quota.get("max_wait_seconds", guard.acquire_timeout),
+            )
+            _guards[name] = tenant_guard
+        return tenant_guard
+
+
+def guard_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every guard created so far, keyed by operation (operation@tenant for tenant guards)"""
+    with _guards_lock:
+        guards = dict(_guards)
+    return {name: guard.snapshot() for name, guard in guards.items()}
@@ -0,0 +1,118 @@
+"""
+Model tiering
+
+Routes each question to the cheapest tier that can answer it:
+- lookup: answered from the answer cache or the FAQ, no model call (see assistant.ask)
+- default tier ("simple"): single factual questions, answered by a small fast model
+- complex tier ("complex"): multi-part or planning questions, answered by a stronger model
+
+Tiers, model IDs and the routing rules live in the `model_tiers` section of
+prereqs_config.yaml. The router is a cheap deterministic heuristic (length,
+number of sub-questions and planning/comparison markers) so routing itself
+adds no latency or cost.
+"""
+
+import re
+from typing import Any, Dict, List, NamedTuple
+
+from kb_store.config import get_section
+
+DEFAULT_TIERS = {
+    "simple": {"model_id": "amazon.nova-lite-v1:0", "temperature": 0.3},
+    "complex": {"model_id": "amazon.nova-lite-v1:0", "temperature": 0.3},
+}
+# phrases, not single words: "exam schedule" or "payment plan" are simple lookups
+DEFAULT_COMPLEX_MARKERS = [
+    "compare", "difference between", "help me plan", "plan my", "plan out", "step by step", "should i",
+    "which is better", "schedule my", "make a schedule", "create a schedule", "what if", "pros and cons",
+    "explain why",
+]
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_QUESTION_WORDS = {"what", "when", "where", "which", "who", "how", "why", "can", "do", "does", "is", "are"}
+
+
+class RouteDecision(NamedTuple):
+    tier: str
+    reasons: List[str]
+
+
+def _tiers() -> Dict[str, Any]:
+    return get_section("model_tiers").get("tiers") or DEFAULT_TIERS
+
+
+def tier_settings(tier: str) -> Dict[str, Any]:
+    """Model settings (model_id, temperature, max_tokens) of a tier"""
+    tiers = _tiers()
+    if tier not in tiers:
+        raise ValueError(f"Unknown model tier '{tier}'. Configured tiers: {', '.join(tiers)}")
+    return tiers[tier]
+
+
+def _configured_tier(key: str, default: str) -> str:
+    tier = get_section("model_tiers").get(key, default)
+    if tier not in _tiers():
+        raise ValueError(f"model_tiers.{key} '{tier}' is not a configured tier: {', '.join(_tiers())}")
+    return tier
+
+
+def default_tier() -> str:
+    """Tier of questions the router does not flag as complex"""
+    return _configured_tier("default_tier", "simple")
+
+
+def complex_tier() -> str:
+    """Tier of multi-part or planning questions"""
+    return _configured_tier("complex_tier", "complex")
+
+
+def validate_tiers():
+    """
+    Check that default_tier and complex_tier name configured tiers
+    Raises:
+        ValueError: when either names a tier missing from model_tiers.tiers
+    """
+    default_tier()
+    complex_tier()
+
+
+def kb_model_id() -> str:
+    """Model used by the knowledge base tools for retrieve_and_generate"""
+    return get_section("model_tiers").get("kb_model_id") or tier_settings(default_tier())["model_id"]
+
+
+def _sub_questions(text: str, words: List[str]) -> int:
+    """Rough count of the questions asked in one message"""
+    marks = text.count("?")
+    # "when does X start and how do I register" -> two questions without two "?"
+    joined = sum(
+        1 for i, word in enumerate(words[1:], start=1)
+        if word in _QUESTION_WORDS and words[i - 1] in ("and", "also", "then")
+    )
+    return max(1, marks) + joined
+
+
+def route_question(question: str) -> RouteDecision:
+    """
+    Pick the model tier for a question that was not answered by a lookup
+    Args:
+        question: the user's question
+    """
+    settings = get_section("model_tiers").get("router") or {}
+    if not settings.get("enabled", True):
+        return RouteDecision(default_tier(), ["router disabled"])
+
+    text = question.lower()
+    words = _WORD_RE.findall(text)
+    reasons = []
+    if len(words) >= settings.get("complex_min_words", 30):
+        reasons.append(f"{len(words)} words")
+    sub_questions = _sub_questions(text, words)
+    if sub_questions >= settings.get("complex_min_questions", 2):
+        reasons.append(f"{sub_questions} questions")
+    padded = f" {' '.join(words)} "
+    markers = [marker for marker in settings.get("complex_markers", DEFAULT_COMPLEX_MARKERS)
+               if f" {marker} " in padded]
+    if markers:
+        reasons.append("markers: " + ", ".join(markers))
+    return RouteDecision(complex_tier() if reasons else default_tier(), reasons)
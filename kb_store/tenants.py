@@ -0,0 +1,188 @@
+"""
+Tenants
+
+One process can serve the assistants of several institutions. Each tenant has
+its own knowledge base(s), system prompt, answer-cache namespace and Bedrock
+rate limits. AWS clients and their connection pools, models and pooled agents
+are shared by every tenant. Tenants are configured in the `tenants` section of
+prereqs_config.yaml:
+
+    tenants:
+      default: 'kca'
+      profiles:
+        kca:
+          display_name: 'KCA University'
+          knowledge_base_name: 'schoolassistant'
+        riverside:
+          display_name: 'Riverside College'
+          knowledge_base_name: 'riverside-kb'
+          knowledge_bases: ['riverside-2025']   # searched for "all", with knowledge_base_name
+          kb_files_path: 'kb_files_riverside'                   # its documents and FAQ.json
+          system_prompt_file: 'prompts/riverside.md'            # relative to kb_store
+          rate_limits:                                          # per-tenant bedrock_limits
+            retrieve_and_generate: {requests_per_second: 2, burst: 4}
+
+A tenant with a profile can only search and manage the knowledge bases of its
+profile. Without profiles the process serves one tenant built from the
+top-level settings (knowledge_base_name, knowledge_base_description) that can
+search any knowledge base of the account, as before.
+
+Each tenant's knowledge base, FAQ and answer-cache corpus version come from
+its own corpus directory (`kb_files_path`, relative to kb_store). The default
+tenant falls back to the top-level kb_files_path; another tenant without one
+has no corpus, so it cannot deploy a knowledge base or answer from a FAQ.
+Requests run in a
+tenant_scope(); code outside one (CLI, Streamlit, deploy_kb.py) uses the tenant
+named by the ASSISTANT_TENANT environment variable, else the default tenant.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from kb_store.config import get_section, load_config
+
+TENANT_ENV_VAR = "ASSISTANT_TENANT"
+SINGLE_TENANT_ID = "default"
+
+KB_STORE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class UnknownTenant(ValueError):
+    """Raised for a tenant id that has no profile"""
+
+    def __init__(self, tenant_id: str, known: List[str]):
+        super().__init__(f"Unknown tenant '{tenant_id}', expected one of {', '.join(known)}")
+        self.tenant_id = tenant_id
+
+
+class Tenant(NamedTuple):
+    tenant_id: str
+    display_name: str
+    knowledge_base_name: str
+    knowledge_base_description: str
+    knowledge_bases: List[str]               # searched for knowledge_base_name="all", main one first
+    system_prompt: Optional[str]             # None: the assistant's built-in prompt
+    cache_namespace: str
+    rate_limits: Dict[str, Dict[str, Any]]   # bedrock_limits entries by operation
+    faq: bool                                # answer close matches from FAQ.json of its corpus
+    isolated: bool                           # may only search and manage its own knowledge bases
+    corpus_dir: Optional[str]                # its kb_files directory, None: no corpus of its own
+
+    def owns(self, kb_name: str) -> bool:
+        """True when the tenant may search or manage a knowledge base"""
+        return not self.isolated or kb_name in self.knowledge_bases
+
+
+_current_tenant: ContextVar[Optional[str]] = ContextVar("tenant_id", default=None)
+
+_tenants: Optional[Dict[str, Tenant]] = None
+_tenants_config: Optional[Dict[str, Any]] = None
+_tenants_lock = threading.Lock()
+
+
+def _read_prompt(path: str) -> str:
+    if not os.path.isabs(path):
+        path = os.path.join(KB_STORE_DIR, path)
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def _corpus_dir(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(KB_STORE_DIR, path)
+
+
+def _build_tenants(config: Dict[str, Any]) -> Dict[str, Tenant]:
+    profiles = get_section("tenants").get("profiles") or {}
+    shared_corpus = _corpus_dir(config.get("kb_files_path", "kb_files"))
+    if not profiles:
+        name = config.get("knowledge_base_name", "schoolassistant")
+        return {SINGLE_TENANT_ID: Tenant(
+            SINGLE_TENANT_ID, "KCA University", name, config.get("knowledge_base_description", ""),
+            [name], None, SINGLE_TENANT_ID, {}, True, False, shared_corpus,
+        )}
+    # the configured default, not the ASSISTANT_TENANT override
+    default_id = str(get_section("tenants").get("default") or next(iter(profiles)))
+    tenants = {}
+    for tenant_id, profile in profiles.items():
+        profile = profile or {}
+        name = profile.get("knowledge_base_name") or config.get("knowledge_base_name", "schoolassistant")
+        # the top-level kb_files belong to the default tenant only
+        corpus_dir = (_corpus_dir(profile["kb_files_path"]) if profile.get("kb_files_path")
+                      else shared_corpus if str(tenant_id) == default_id else None)
+        prompt = profile.get("system_prompt")
+        if not prompt and profile.get("system_prompt_file"):
+            prompt = _read_prompt(profile["system_prompt_file"])
+        tenants[str(tenant_id)] = Tenant(
+            tenant_id=str(tenant_id),
+            display_name=profile.get("display_name", str(tenant_id)),
+            knowledge_base_name=name,
+            knowledge_base_description=profile.get(
+                "knowledge_base_description", config.get("knowledge_base_description", "")
+            ),
+            # the main knowledge base is always searchable, even when not listed
+            knowledge_bases=list(dict.fromkeys([name] + list(profile.get("knowledge_bases") or []))),
+            system_prompt=prompt or None,
+            cache_namespace=profile.get("cache_namespace", str(tenant_id)),
+            rate_limits=dict(profile.get("rate_limits") or {}),
+            faq=profile.get("faq", corpus_dir is not None),
+            isolated=True,
+            corpus_dir=corpus_dir,
+        )
+    return tenants
+
+
+def get_tenants() -> Dict[str, Tenant]:
+    """Every configured tenant by id, rebuilt when the configuration is reloaded"""
+    global _tenants, _tenants_config
+    config = load_config()
+    with _tenants_lock:
+        if _tenants is None or _tenants_config is not config:
+            _tenants = _build_tenants(config)
+            _tenants_config = config
+        return _tenants
+
+
+def default_tenant_id() -> str:
+    """Tenant of requests that name none: ASSISTANT_TENANT, else `tenants.default`"""
+    settings = get_section("tenants")
+    profiles = settings.get("profiles") or {}
+    if not profiles:
+        return SINGLE_TENANT_ID
+    return os.environ.get(TENANT_ENV_VAR) or str(settings.get("default") or next(iter(profiles)))
+
+
+def get_tenant(tenant_id: Optional[str] = None) -> Tenant:
+    """
+    Tenant by id (default: the current tenant)
+    Raises:
+        UnknownTenant: no tenant has this id
+    """
+    if tenant_id is None:
+        return current_tenant()
+    tenants = get_tenants()
+    if tenant_id not in tenants:
+        raise UnknownTenant(tenant_id, sorted(tenants))
+    return tenants[tenant_id]
+
+
+def current_tenant() -> Tenant:
+    """Tenant of the request being served, or the default tenant"""
+    return get_tenant(_current_tenant.get() or default_tenant_id())
+
+
+@contextmanager
+def tenant_scope(tenant_id: Optional[str]) -> Iterator[Tenant]:
+    """
+    Serve everything inside the block for a tenant (None keeps the current one)
+    Raises:
+        UnknownTenant: no tenant has this id
+    """
+    tenant = get_tenant(tenant_id) if tenant_id else current_tenant()
+    token = _current_tenant.set(tenant.tenant_id)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(token)
@@ -0,0 +1,23 @@
+"""
+Token estimation helpers
+
+Bedrock does not report token usage for every call (retrieve_and_generate and
+ingestion jobs report none), so those are estimated from text length using the
+usual ~4 characters per token heuristic for English text.
+"""
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a piece of text
+    Args:
+        text: the text to measure
+
+    Returns:
+        estimated token count (0 for empty text)
+    """
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
@@ -0,0 +1,203 @@
+"""
+Compact tool results
+
+Everything a search tool returns is sent back to the model on the next model
+call, so results are compacted before they leave the tools:
+- whitespace is collapsed and repeated key paths of flattened JSON
+  ("trimesters > events > date: ...") are written once
+- duplicate passages and passages that mostly repeat an earlier one (the
+  overlap between neighbouring chunks) are dropped
+- each passage is trimmed to `max_passage_tokens`, keeping the sentences and
+  fields that match the query, and the whole result to `max_tokens`
+- every passage carries a short citation: [1] academic_calendar.json
+
+Budgets live in the `tool_results` section of prereqs_config.yaml. Token
+counts before and after compaction are recorded as metrics and span attributes.
+"""
+
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from kb_store.config import get_section
+from kb_store.hybrid import lexical_tokens
+from kb_store.tokens import CHARS_PER_TOKEN, estimate_tokens
+from kb_store.tracing import current_span, metrics
+from kb_store.usage import current_tool
+
+DEFAULTS = {
+    "enabled": True,
+    "max_tokens": 600,
+    "max_passage_tokens": 200,
+    "min_passage_tokens": 30,
+    "duplicate_overlap": 0.6,
+}
+
+_KEY_PATH_RE = re.compile(r"(?<!\S)(?:[\w-]+ > )*(?=[\w-]+: )")
+_SEGMENT_RE = re.compile(r"(?<=[.!?;])\s+|\s(?=[\w-]+: )")
+_SHINGLE = 3
+
+
+class Passage(NamedTuple):
+    source: str
+    text: str
+
+
+class CompactResult(NamedTuple):
+    text: str
+    tokens_before: int
+    tokens_after: int
+    passages: int
+    dropped: int
+
+
+def settings() -> Dict[str, Any]:
+    return {**DEFAULTS, **get_section("tool_results")}
+
+
+def citation(source: str) -> str:
+    """Short citation of a source: its file name without bucket or folders"""
+    return os.path.basename(source.rstrip("/")) or source
+
+
+def compact_text(text: str) -> str:
+    """
+    Collapse whitespace and drop the key path of a flattened JSON field when it
+    repeats the path of the field before it
+    ("events > event: A events > date: B" -> "events > event: A date: B")
+    """
+    previous = {"path": None, "end": -1}
+
+    def shorten(match) -> str:
+        path = match.group(0)
+        if not path and match.start() == previous["end"]:
+            # the key right after a path, not a top-level field
+            return ""
+        previous["end"] = match.end()
+        if path == previous["path"]:
+            return ""
+        previous["path"] = path
+        return path
+
+    return _KEY_PATH_RE.sub(shorten, " ".join(text.split()))
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + _SHINGLE]) for i in range(max(1, len(words) - _SHINGLE + 1))}
+
+
+def _trim(text: str, query_terms: set, max_tokens: int) -> str:
+    """
+    Shorten a passage to about max_tokens, keeping the segments (sentences or
+    fields) that share the most words with the query, each with the segment
+    that follows it (a field's value is often in the next field, e.g. a date)
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    segments = [segment for segment in _SEGMENT_RE.split(text) if segment]
+    scores = [len(query_terms & set(lexical_tokens(segment))) for segment in segments]
+    order = sorted(range(len(segments)), key=lambda i: (-scores[i], i))
+    chosen, used = set(), 0
+    for i in order:
+        for j in (i, i + 1):
+            if j >= len(segments) or j in chosen:
+                continue
+            cost = estimate_tokens(segments[j]) + 1
+            if used + cost > max_tokens:
+                break
+            chosen.add(j)
+            used += cost
+    if not chosen:
+        cut = text[: max_tokens * CHARS_PER_TOKEN]
+        return cut.rsplit(" ", 1)[0] + " …"
+    pieces, previous = [], None
+    for i in sorted(chosen):
+        if previous is not None and i != previous + 1:
+            pieces.append("…")
+        pieces.append(segments[i])
+        previous = i
+    if max(chosen) < len(segments) - 1:
+        pieces.append("…")
+    return " ".join(pieces)
+
+
+def compact_passages(query: str, passages: Sequence[Passage], max_tokens: Optional[int] = None) -> CompactResult:
+    """
+    Deduplicate, trim and cite retrieved passages (best first)
+    Args:
+        query: the search query, used to pick what to keep from long passages
+        passages: retrieved passages in rank order
+        max_tokens: budget of the whole result (default from the config)
+    """
+    config = settings()
+    max_tokens = max_tokens or config["max_tokens"]
+    tokens_before = sum(estimate_tokens(passage.text) for passage in passages)
+    if not config.get("enabled", True):
+        text = "\n".join(f"[{i}] {citation(p.source)}: {p.text}" for i, p in enumerate(passages, start=1))
+        return CompactResult(text, tokens_before, estimate_tokens(text), len(passages), 0)
+
+    query_terms = set(lexical_tokens(query))
+    seen: set = set()
+    lines, used, dropped = [], 0, 0
+    for passage in passages:
+        text = compact_text(passage.text)
+        shingles = _shingles(text)
+        if not text or len(shingles & seen) >= config["duplicate_overlap"] * len(shingles):
+            dropped += 1
+            continue
+        label = f"[{len(lines) + 1}] {citation(passage.source)}: "
+        budget = min(config["max_passage_tokens"], max_tokens - used - estimate_tokens(label))
+        if budget < config["min_passage_tokens"]:
+            dropped += 1
+            continue
+        line = label + _trim(text, query_terms, budget)
+        seen |= shingles
+        lines.append(line)
+        used += estimate_tokens(line) + 1
+    text = "\n".join(lines)
+    return CompactResult(text, tokens_before, estimate_tokens(text), len(lines), dropped)
+
+
+def compact_generated(answer: str, sources: Sequence[str], max_tokens: Optional[int] = None) -> CompactResult:
+    """
+    Compact a retrieve_and_generate answer and append its deduplicated citations
+    Args:
+        answer: generated text
+        sources: source URIs of the retrieved references, in citation order
+        max_tokens: budget of the whole result (default from the config)
+    """
+    max_tokens = max_tokens or settings()["max_tokens"]
+    tokens_before = estimate_tokens(answer)
+    names = list(dict.fromkeys(citation(source) for source in sources if source))
+    text = compact_text(answer)
+    if estimate_tokens(text) > max_tokens:
+        text = text[: max_tokens * CHARS_PER_TOKEN].rsplit(" ", 1)[0] + " …"
+    if names:
+        text += "\nSources: " + "; ".join(f"[{i}] {name}" for i, name in enumerate(names, start=1))
+    return CompactResult(text, tokens_before, estimate_tokens(text), len(names), 0)
+
+
+def record_compaction(result: CompactResult):
+    """Record token counts before and after compaction, by the tool being run"""
+    tool = current_tool() or "none"
+    metrics.inc("school_assistant_tool_result_tokens_total", result.tokens_before,
+                {"tool": tool, "stage": "retrieved"},
+                help_text="Estimated tokens of tool results before and after compaction")
+    metrics.inc("school_assistant_tool_result_tokens_total", result.tokens_after,
+                {"tool": tool, "stage": "returned"},
+                help_text="Estimated tokens of tool results before and after compaction")
+    result_span = current_span()
+    if result_span is not None:
+        result_span.set_attribute("result_tokens_before", result.tokens_before)
+        result_span.set_attribute("result_tokens_after", result.tokens_after)
+        result_span.set_attribute("passages_dropped", result.dropped)
+
+
+def references_sources(response: Dict[str, Any]) -> List[str]:
+    """Source URIs of the references cited by a retrieve_and_generate response"""
+    return [
+        reference.get("location", {}).get("s3Location", {}).get("uri", "")
+        for citation_part in response.get("citations", [])
+        for reference in citation_part.get("retrievedReferences", [])
+    ]
@@ -0,0 +1,416 @@
+"""
+Lightweight span tracing and Prometheus metrics
+
+Every stage of an agent turn (manager construction, STS calls, KB lookups,
+retrieve_and_generate, model calls, tool calls) is recorded as a span with its
+duration and attributes. Finished spans are:
+    - aggregated into a Prometheus histogram (always, cheap)
+    - appended to a local JSONL file (buffered, flushed when a root span ends)
+
+Metrics are served in Prometheus text format by start_metrics_server().
+Tracing is configured from the `tracing` section of prereqs_config.yaml.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from kb_store.config import get_section
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed unit of work within a trace"""
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id", "attributes",
+        "start_time", "duration", "status", "_start", "_sampled",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self._sampled = parent._sampled
+        else:
+            self.trace_id = uuid.uuid4().hex
+            self.parent_id = None
+            self._sampled = random.random() < tracer.sample_rate
+        self.attributes = attributes
+        self.status = "ok"
+        self.duration = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, status: Optional[str] = None):
+        """Finish the span and hand it to the tracer (idempotent)"""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        if status is not None:
+            self.status = status
+        tracer.finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe counters, gauges and histograms rendered in the
+    Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], List[float]]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable[["MetricsRegistry"], None]] = []
+
+    @staticmethod
+    def _key(labels: Optional[Dict[str, Any]]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+    def _declare(self, name: str, kind: str, help_text: str):
+        if name not in self._help:
+            self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict[str, Any]] = None,
+            help_text: str = ""):
+        """Increase a counter"""
+        key = self._key(labels)
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None,
+                  help_text: str = ""):
+        """Set a gauge to an absolute value"""
+        key = self._key(labels)
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+            self._values.setdefault(name, {})[key] = float(value)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None,
+                help_text: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """Record an observation in a histogram"""
+        key = self._key(labels)
+        with self._lock:
+            self._declare(name, "histogram", help_text)
+            bounds = self._buckets.setdefault(name, buckets)
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                # one slot per bucket, then sum and count
+                state = series[key] = [0.0] * (len(bounds) + 2)
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def get(self, name: str, labels: Optional[Dict[str, Any]] = None) -> float:
+        """Current value of a counter or gauge (0 if never set)"""
+        with self._lock:
+            return self._values.get(name, {}).get(self._key(labels), 0.0)
+
+    def histogram_summary(self, name: str, labels: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+        """Count, sum and mean of a histogram series"""
+        with self._lock:
+            state = self._histograms.get(name, {}).get(self._key(labels))
+        if not state:
+            return {"count": 0, "sum": 0.0, "mean": 0.0}
+        return {"count": state[-1], "sum": state[-2], "mean": state[-2] / state[-1]}
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]):
+        """Register a callback that refreshes gauges right before rendering"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    @staticmethod
+    def _labels_text(key: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = key + extra
+        if not pairs:
+            return ""
+        escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format"""
+        for collector in list(self._collectors):
+            try:
+                collector(self)
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in sorted(self._help.items()):
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "histogram":
+                    bounds = self._buckets[name]
+                    for key, state in self._histograms.get(name, {}).items():
+                        for bound, count in zip(bounds, state):
+                            lines.append(f"{name}_bucket{self._labels_text(key, (('le', str(bound)),))} {count:g}")
+                        lines.append(f"{name}_bucket{self._labels_text(key, (('le', '+Inf'),))} {state[-1]:g}")
+                        lines.append(f"{name}_sum{self._labels_text(key)} {state[-2]:.6f}")
+                        lines.append(f"{name}_count{self._labels_text(key)} {state[-1]:g}")
+                else:
+                    for key, value in self._values.get(name, {}).items():
+                        lines.append(f"{name}{self._labels_text(key)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class JsonlSpanExporter:
+    """Buffers finished spans and appends them to a JSONL file"""
+
+    def __init__(self, path: str, max_buffer: int = 256):
+        self.path = path
+        self.max_buffer = max_buffer
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, span: Span, force_flush: bool = False):
+        with self._lock:
+            self._buffer.append(span.to_dict())
+            if not force_flush and len(self._buffer) < self.max_buffer:
+                return
+            pending, self._buffer = self._buffer, []
+        self._write(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._buffer = self._buffer, []
+        self._write(pending)
+
+    def _write(self, spans: List[Dict[str, Any]]):
+        if not spans:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write("".join(json.dumps(s, default=str) + "\n" for s in spans))
+        except OSError as e:
+            print(f"Could not write spans to {self.path}: {str(e)}")
+
+
+class Tracer:
+    """Routes finished spans to the Prometheus histogram and the JSONL exporter"""
+
+    def __init__(self):
+        self.enabled = True
+        self.sample_rate = 1.0
+        self.exporter: Optional[JsonlSpanExporter] = None
+
+    def configure(self, enabled: bool = True, jsonl_path: Optional[str] = None, sample_rate: float = 1.0):
+        if self.exporter is not None:
+            self.exporter.flush()
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.exporter = JsonlSpanExporter(jsonl_path) if (enabled and jsonl_path) else None
+
+    def finish(self, span: Span):
+        metrics.observe(
+            "school_assistant_stage_duration_seconds",
+            span.duration,
+            {"stage": span.name, "status": span.status},
+            help_text="Duration of each traced stage of an agent turn",
+        )
+        if self.exporter is not None and span._sampled:
+            # flush a whole trace at once when its root span ends
+            self.exporter.export(span, force_flush=span.parent_id is None)
+
+
+tracer = Tracer()
+atexit.register(lambda: tracer.exporter.flush() if tracer.exporter else None)
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled so call sites need no branching"""
+
+    name = ""
+    duration = 0.0
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def end(self, status: Optional[str] = None):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def current_span() -> Optional[Span]:
+    """The innermost active span in this context, if any"""
+    return _current_span.get()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes) -> Span:
+    """
+    Start a span that the caller ends explicitly with span.end()
+    Args:
+        name: stage name, e.g. "kb.retrieve_and_generate"
+        parent: parent span, defaults to the active span of the current context
+        attributes: span attributes
+    """
+    if not tracer.enabled:
+        return _NOOP_SPAN
+    return Span(name, parent if parent is not None else _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Context manager that traces the enclosed block as a child of the active span
+    """
+    if not tracer.enabled:
+        yield _NOOP_SPAN
+        return
+    s = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set_attribute("error", f"{type(e).__name__}: {e}")
+        s.status = "error"
+        raise
+    finally:
+        _current_span.reset(token)
+        s.end()
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span(); the span name defaults to the function's qualified name"""
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_setup_lock = threading.Lock()
+_configured = False
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve /metrics in the Prometheus text format from a daemon thread
+    Args:
+        port: TCP port to listen on (0 picks a free port)
+        host: interface to bind
+    """
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Prometheus metrics available at http://{host}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def setup_tracing():
+    """
+    Configure tracing from prereqs_config.yaml once per process and start the
+    metrics endpoint if a port is configured
+    """
+    global _configured
+    with _setup_lock:
+        if _configured:
+            return
+        _configured = True
+        settings = get_section("tracing")
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        jsonl_path = settings.get("jsonl_path")
+        if jsonl_path and not os.path.isabs(jsonl_path):
+            jsonl_path = os.path.join(base_dir, jsonl_path)
+        tracer.configure(
+            enabled=settings.get("enabled", True),
+            jsonl_path=jsonl_path,
+            sample_rate=float(settings.get("sample_rate", 1.0)),
+        )
+        port = os.environ.get("METRICS_PORT", settings.get("prometheus_port"))
+        if tracer.enabled and port:
+            try:
+                start_metrics_server(int(port), settings.get("prometheus_host", "127.0.0.1"))
+            except OSError as e:
+                print(f"Could not start metrics server on port {port}: {str(e)}")
+
+
+def _collect_guard_states(registry: MetricsRegistry):
+    from kb_store.resilience import guard_states
+
+    for operation, state in guard_states().items():
+        labels = {"operation": operation}
+        registry.set_gauge("school_assistant_limiter_available_tokens",
+                           state["limiter"]["available_tokens"], labels,
+                           help_text="Tokens currently available in the Bedrock rate limiter")
+        registry.set_gauge("school_assistant_circuit_open",
+                           1 if state["breaker"]["state"] != "closed" else 0, labels,
+                           help_text="1 while the Bedrock circuit breaker is open or half-open")
+        registry.set_gauge("school_assistant_bedrock_throttled",
+                           state["throttled"], labels,
+                           help_text="Throttling errors received from Bedrock")
+        registry.set_gauge("school_assistant_bedrock_retries",
+                           state["retries"], labels,
+                           help_text="Retries performed for Bedrock calls")
+
+
+metrics.add_collector(_collect_guard_states)
@@ -0,0 +1,286 @@
+"""
+Token usage and cost ledger
+
+Every model call made by the agent loop, every knowledge base call and every
+ingestion is written to a local SQLite ledger with its input, output and cached
+token counts. Records carry the session, turn (question) and tool they belong
+to so that usage can be aggregated per session, per tool or per question.
+Costs are computed at report time from the `pricing` table in
+prereqs_config.yaml, so price changes apply to historical data as well.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from kb_store.config import get_section
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LEDGER_PATH = os.path.join(BASE_DIR, "traces", "usage.db")
+
+GROUP_BY_COLUMNS = {
+    "session": "session_id",
+    "tool": "tool",
+    "question": "question_key",
+    "model": "model_id",
+    "source": "source",
+    "turn": "turn_id",
+}
+
+# session of the answer-cache warm-up, whose replayed questions are not user demand
+WARMUP_SESSION_ID = "cache-warmup"
+
+_session_id: ContextVar[Optional[str]] = ContextVar("usage_session_id", default=None)
+_turn: ContextVar[Optional[Dict[str, str]]] = ContextVar("usage_turn", default=None)
+_tool: ContextVar[Optional[str]] = ContextVar("usage_tool", default=None)
+
+
+def normalize_question(question: str) -> str:
+    """Collapse case and whitespace so that repeated questions group together"""
+    return " ".join((question or "").lower().split())[:500]
+
+
+@contextmanager
+def usage_scope(session_id: str, question: str):
+    """
+    Attribute all usage recorded in the enclosed block to one question (turn)
+    of a session
+    Args:
+        session_id: identifier of the user session
+        question: the user's question
+    """
+    session_token = _session_id.set(session_id)
+    turn_token = _turn.set({"turn_id": uuid.uuid4().hex, "question": question})
+    try:
+        yield _turn.get()
+    finally:
+        _turn.reset(turn_token)
+        _session_id.reset(session_token)
+
+
+def current_session_id() -> Optional[str]:
+    """Session the current context is attributed to, if any"""
+    return _session_id.get()
+
+
+def current_turn() -> Optional[Dict[str, str]]:
+    """Turn (turn_id and question) the current context is attributed to, if any"""
+    return _turn.get()
+
+
+def set_current_tool(tool_name: Optional[str]):
+    """Attribute usage recorded from now on in this context to a tool"""
+    _tool.set(tool_name)
+
+
+def current_tool() -> Optional[str]:
+    """Tool the current context is attributed to, if any"""
+    return _tool.get()
+
+
+def model_id_from_arn(model: str) -> str:
+    """Turn a foundation-model ARN into its model id (plain ids are returned unchanged)"""
+    return model.split("foundation-model/")[-1] if "foundation-model/" in model else model
+
+
+def estimate_cost(model_id: str, input_tokens: float, output_tokens: float, cached_tokens: float = 0) -> float:
+    """
+    Estimated cost in USD from the `pricing` section of prereqs_config.yaml
+    Args:
+        model_id: model identifier
+        input_tokens: uncached input tokens
+        output_tokens: output tokens
+        cached_tokens: input tokens served from the prompt cache
+    """
+    prices = get_section("pricing").get(model_id_from_arn(model_id)) or {}
+    return (
+        input_tokens * prices.get("input_per_1k", 0.0)
+        + output_tokens * prices.get("output_per_1k", 0.0)
+        + cached_tokens * prices.get("cached_input_per_1k", prices.get("input_per_1k", 0.0))
+    ) / 1000.0
+
+
+class UsageLedger:
+    """SQLite-backed store of usage records"""
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                session_id TEXT,
+                turn_id TEXT,
+                question TEXT,
+                question_key TEXT,
+                source TEXT NOT NULL,
+                tool TEXT,
+                model_id TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                estimated INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+        self._conn.commit()
+
+    def record(self, source: str, model_id: str, input_tokens: int = 0, output_tokens: int = 0,
+               cached_tokens: int = 0, estimated: bool = False, tool: Optional[str] = None):
+        """
+        Add a usage record attributed to the current session, turn and tool
+        Args:
+            source: where the tokens were spent ("agent", "kb", "ingestion")
+            model_id: model id or foundation-model ARN
+            input_tokens: uncached input tokens
+            output_tokens: output tokens
+            cached_tokens: input tokens read from the prompt cache
+            estimated: True when the counts are estimates rather than reported by Bedrock
+            tool: tool name, defaults to the tool running in the current context
+        """
+        turn = _turn.get() or {}
+        question = turn.get("question")
+        row = (
+            time.time(),
+            _session_id.get(),
+            turn.get("turn_id"),
+            question,
+            normalize_question(question) if question else None,
+            source,
+            tool or _tool.get() or source,
+            model_id_from_arn(model_id),
+            int(input_tokens),
+            int(output_tokens),
+            int(cached_tokens),
+            int(estimated),
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO usage (ts, session_id, turn_id, question, question_key, source, tool, "
+                "model_id, input_tokens, output_tokens, cached_tokens, estimated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            self._conn.commit()
+
+    def summarize(self, group_by: str = "question", since_days: Optional[float] = None,
+                  limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Aggregate usage and estimated cost, most expensive groups first
+        Args:
+            group_by: one of session, tool, question, model, source, turn
+            since_days: only include records from the last N days
+            limit: maximum number of groups returned
+        """
+        if group_by not in GROUP_BY_COLUMNS:
+            raise ValueError(f"group_by must be one of {sorted(GROUP_BY_COLUMNS)}")
+        column = GROUP_BY_COLUMNS[group_by]
+        where, params = "", []
+        if since_days is not None:
+            where = "WHERE ts >= ?"
+            params.append(time.time() - since_days * 86400)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT COALESCE({column}, '(none)'), model_id, COUNT(*), "
+                f"SUM(input_tokens), SUM(output_tokens), SUM(cached_tokens), MAX(estimated) "
+                f"FROM usage {where} GROUP BY 1, 2",
+                params,
+            ).fetchall()
+            turns = dict(self._conn.execute(
+                f"SELECT COALESCE({column}, '(none)'), COUNT(DISTINCT turn_id) FROM usage {where} GROUP BY 1",
+                params,
+            ).fetchall())
+
+        groups: Dict[str, Dict[str, Any]] = {}
+        for key, model_id, calls, input_tokens, output_tokens, cached_tokens, estimated in rows:
+            group = groups.setdefault(key, {
+                group_by: key, "calls": 0, "turns": turns.get(key, 0), "input_tokens": 0,
+                "output_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0, "estimated": False,
+            })
+            group["calls"] += calls
+            group["input_tokens"] += input_tokens
+            group["output_tokens"] += output_tokens
+            group["cached_tokens"] += cached_tokens
+            group["cost_usd"] += estimate_cost(model_id, input_tokens, output_tokens, cached_tokens)
+            group["estimated"] = group["estimated"] or bool(estimated)
+        for group in groups.values():
+            group["cost_per_turn_usd"] = group["cost_usd"] / group["turns"] if group["turns"] else group["cost_usd"]
+        return sorted(groups.values(), key=lambda g: g["cost_usd"], reverse=True)[:limit]
+
+    def top_questions(self, limit: int = 10, since_days: Optional[float] = None) -> List[str]:
+        """Most frequently asked questions, most popular first, not counting the cache warm-up"""
+        where, params = "WHERE question IS NOT NULL AND session_id IS NOT ?", [WARMUP_SESSION_ID]
+        if since_days is not None:
+            where += " AND ts >= ?"
+            params.append(time.time() - since_days * 86400)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT MIN(question), COUNT(DISTINCT turn_id) AS asked FROM usage {where} "
+                f"GROUP BY question_key ORDER BY asked DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> Optional[UsageLedger]:
+    """Process-wide ledger configured from the `usage` section (None when disabled)"""
+    global _ledger
+    settings = get_section("usage")
+    if not settings.get("enabled", True):
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            path = settings.get("db_path") or DEFAULT_LEDGER_PATH
+            if not os.path.isabs(path):
+                path = os.path.join(BASE_DIR, path)
+            _ledger = UsageLedger(path)
+        return _ledger
+
+
+def record_usage(source: str, model_id: str, input_tokens: int = 0, output_tokens: int = 0,
+                 cached_tokens: int = 0, estimated: bool = False, tool: Optional[str] = None):
+    """Record usage in the process-wide ledger; never raises"""
+    try:
+        ledger = get_ledger()
+        if ledger is not None:
+            ledger.record(source, model_id, input_tokens, output_tokens, cached_tokens, estimated, tool)
+    except Exception as e:
+        print(f"Could not record usage: {str(e)}")
+
+
+def format_report(rows: List[Dict[str, Any]], group_by: str) -> str:
+    """Render summarize() output as a fixed-width text table"""
+    if not rows:
+        return "No usage recorded yet."
+    header = f"{group_by[:48]:<50}{'turns':>7}{'calls':>7}{'input':>10}{'output':>9}{'cached':>9}{'cost $':>11}{'$/turn':>10}"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        label = str(row[group_by])
+        label = label if len(label) <= 48 else label[:45] + "..."
+        marker = "~" if row["estimated"] else " "
+        lines.append(
+            f"{label:<50}{row['turns']:>7}{row['calls']:>7}{row['input_tokens']:>10}"
+            f"{row['output_tokens']:>9}{row['cached_tokens']:>9}{row['cost_usd']:>10.6f}{marker}"
+            f"{row['cost_per_turn_usd']:>10.6f}"
+        )
+    total = sum(row['cost_usd'] for row in rows)
+    lines.append("-" * len(header))
+    lines.append(f"{'total (shown rows)':<50}{'':>49}{total:>10.6f}")
+    if any(row["estimated"] for row in rows):
+        lines.append("~ includes estimated token counts (knowledge base and ingestion calls)")
+    return "\n".join(lines)
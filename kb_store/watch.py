@@ -0,0 +1,316 @@
+"""
+Continuous knowledge base sync
+
+Watches kb_files and keeps the knowledge base in step with it, so edits no
+longer wait for someone to run a full deploy:
+
+    python deploy_kb.py --action watch
+
+File events come from watchdog (inotify, FSEvents, ...) when it is installed,
+else from polling file sizes and modification times. Events are debounced: a
+sync starts once the directory has been quiet for `kb_watch.debounce_seconds`
+(or `max_wait_seconds` after the first event of a burst that never settles).
+Only corpus files (corpus.is_corpus_file: no editor backups, lock files or
+dotfiles) whose content actually changed are compacted and uploaded, removed
+files are deleted from the data bucket, and one ingestion job covers the whole
+burst. Afterwards the caches built from kb_files are invalidated: the FAQ
+index, the local vector index and the answer cache's corpus version.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from kb_store.answer_cache import get_answer_cache
+from kb_store.compaction import compact_file, compacted_name, output_dir
+from kb_store.config import get_section
+from kb_store.corpus import compaction_enabled, is_corpus_file, list_corpus_files
+from kb_store.faq import reset_faq_index
+from kb_store.local_store import LocalVectorStore, get_local_knowledge_base
+from kb_store.tracing import metrics, span
+
+DEFAULTS = {
+    "debounce_seconds": 5.0,
+    "max_wait_seconds": 60.0,
+    "poll_interval_seconds": 2.0,
+    "use_polling": False,
+}
+
+WATCHED_EVENTS = ("created", "modified", "deleted", "moved")
+
+
+class SyncResult(NamedTuple):
+    changed: List[str]       # corpus files added or edited, relative to the corpus directory
+    removed: List[str]
+    ingestion: str           # ingestion job status, or "skipped" without a knowledge base
+    seconds: float
+
+
+def settings() -> Dict[str, Any]:
+    return {**DEFAULTS, **get_section("kb_watch")}
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def corpus_files(directory: str) -> List[str]:
+    """Relative paths of the watched corpus files"""
+    return [os.path.relpath(path, directory) for path in list_corpus_files(directory)]
+
+
+def snapshot(directory: str) -> Dict[str, tuple]:
+    """Size and modification time of every corpus file, by relative path"""
+    state = {}
+    for relative in corpus_files(directory):
+        try:
+            stat = os.stat(os.path.join(directory, relative))
+        except OSError:
+            continue
+        state[relative] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+
+def diff_snapshots(before: Dict[str, tuple], after: Dict[str, tuple]) -> Set[str]:
+    """Relative paths added, removed or modified between two snapshots"""
+    return {path for path in before.keys() | after.keys() if before.get(path) != after.get(path)}
+
+
+class ChangeBatcher:
+    """
+    Collects changed paths and hands them out as one batch per burst of edits
+    """
+
+    def __init__(self, debounce_seconds: float, max_wait_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: Set[str] = set()
+        self._first = 0.0
+        self._last = 0.0
+        self._condition = threading.Condition()
+
+    def add(self, paths: Iterable[str]):
+        paths = set(paths)
+        if not paths:
+            return
+        with self._condition:
+            now = time.monotonic()
+            if not self._pending:
+                self._first = now
+            self._pending |= paths
+            self._last = now
+            self._condition.notify_all()
+
+    def next_batch(self, stop: threading.Event) -> Set[str]:
+        """
+        Wait until the pending changes are quiet for debounce_seconds (or
+        max_wait_seconds old) and return them; an empty set once stop is set
+        """
+        with self._condition:
+            while not stop.is_set():
+                if not self._pending:
+                    self._condition.wait(0.5)
+                    continue
+                now = time.monotonic()
+                due = min(self._last + self.debounce_seconds, self._first + self.max_wait_seconds)
+                if now >= due:
+                    batch, self._pending = self._pending, set()
+                    return batch
+                self._condition.wait(due - now)
+            return set()
+
+
+def _poll(directory: str, batcher: ChangeBatcher, interval: float, stop: threading.Event):
+    state = snapshot(directory)
+    while not stop.wait(interval):
+        current = snapshot(directory)
+        batcher.add(diff_snapshots(state, current))
+        state = current
+
+
+def start_watcher(directory: str, batcher: ChangeBatcher, stop: threading.Event):
+    """
+    Feed file events of a directory into a batcher: a watchdog observer when
+    watchdog is installed, else a polling thread
+    Returns:
+        (the observer or polling thread, which ends once stop is set, and "file events" or "polling")
+    """
+    config = settings()
+    if not config["use_polling"]:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog is not installed, polling for changes instead")
+        else:
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if event.is_directory or event.event_type not in WATCHED_EVENTS:
+                        return
+                    paths = [event.src_path, getattr(event, "dest_path", "")]
+                    relative_paths = (os.path.relpath(path, directory) for path in paths if path)
+                    batcher.add(relative for relative in relative_paths if is_corpus_file(relative))
+
+            observer = Observer()
+            observer.schedule(Handler(), directory, recursive=True)
+            observer.start()
+            threading.Thread(target=lambda: (stop.wait(), observer.stop()), daemon=True).start()
+            return observer, "file events"
+    thread = threading.Thread(
+        target=_poll, args=(directory, batcher, config["poll_interval_seconds"], stop),
+        name="kb-watch-poll", daemon=True,
+    )
+    thread.start()
+    return thread, "polling"
+
+
+def invalidate_corpus_caches():
+    """
+    Drop what this process built from the old kb_files: the FAQ index, the
+    opened local index (rebuilt now if one exists) and the answer cache's
+    corpus version. Other processes notice the new FAQ.json and corpus version
+    on their own.
+    """
+    reset_faq_index()
+    local_kb = get_local_knowledge_base()
+    local_kb.invalidate()
+    if LocalVectorStore(local_kb.index_dir).exists():
+        local_kb.store  # re-validated, so rebuilt from the new corpus
+    cache = get_answer_cache()
+    if cache is not None:
+        cache.invalidate_version()
+
+
+class CorpusSync:
+    """
+    Brings a knowledge base up to date with the corpus files that changed
+    since the last sync, tracked by content hash
+    """
+
+    def __init__(self, source_dir: str, kb=None, kb_id: Optional[str] = None, ds_id: Optional[str] = None):
+        """
+        Args:
+            source_dir: corpus directory (kb_files)
+            kb: KnowledgeBasesForAmazonBedrock with its data bucket set, or
+                None to only refresh the local caches
+            kb_id: knowledge base id
+            ds_id: data source id
+        """
+        self.source_dir = source_dir
+        self.kb = kb
+        self.kb_id = kb_id
+        self.ds_id = ds_id
+        # the corpus at start-up is taken as already ingested
+        self._hashes = {
+            relative: file_hash(os.path.join(source_dir, relative)) for relative in corpus_files(source_dir)
+        }
+
+    def changes(self, candidates: Iterable[str]) -> tuple:
+        """
+        Candidates whose content differs from the last sync
+        Returns:
+            (changed, removed) relative paths
+        """
+        changed, removed = [], []
+        for relative in sorted(set(candidates)):
+            if not is_corpus_file(relative):
+                continue
+            path = os.path.join(self.source_dir, relative)
+            if os.path.isfile(path):
+                if file_hash(path) != self._hashes.get(relative):
+                    changed.append(relative)
+            elif relative in self._hashes:
+                removed.append(relative)
+        return changed, removed
+
+    def _object_key(self, relative: str) -> str:
+        # upload_directory keys objects by file name
+        return os.path.basename(compacted_name(relative) if compaction_enabled() else relative)
+
+    def sync(self, candidates: Iterable[str]) -> Optional[SyncResult]:
+        """
+        Upload the changed files, delete the removed ones and run one ingestion job
+        Returns:
+            what was synced, or None when no file content changed
+        """
+        changed, removed = self.changes(candidates)
+        if not changed and not removed:
+            return None
+        start = time.perf_counter()
+        with span("kb.watch_sync", changed=len(changed), removed=len(removed)) as sync_span:
+            uploads = {}
+            for relative in changed:
+                path = os.path.join(self.source_dir, relative)
+                if compaction_enabled():
+                    path = os.path.join(output_dir(self.source_dir), compact_file(self.source_dir, path).output)
+                uploads[self._object_key(relative)] = path
+            for relative in removed:
+                if compaction_enabled():
+                    try:
+                        os.remove(os.path.join(output_dir(self.source_dir), compacted_name(relative)))
+                    except OSError:
+                        pass
+            ingestion = "skipped"
+            if self.kb is not None:
+                bucket = self.kb.get_data_bucket_name()
+                if uploads:
+                    self.kb.upload_files(uploads, bucket)
+                if removed:
+                    self.kb.delete_objects([self._object_key(relative) for relative in removed], bucket)
+                job = self.kb.synchronize_data(self.kb_id, self.ds_id)
+                ingestion = job["status"] if job else "unknown"
+            for relative in changed:
+                self._hashes[relative] = file_hash(os.path.join(self.source_dir, relative))
+            for relative in removed:
+                self._hashes.pop(relative, None)
+            invalidate_corpus_caches()
+            sync_span.set_attribute("ingestion", ingestion)
+        metrics.inc("school_assistant_kb_watch_syncs_total", labels={"ingestion": ingestion},
+                    help_text="Knowledge base syncs of watch mode by ingestion job status")
+        metrics.inc("school_assistant_kb_watch_files_total", len(changed) + len(removed),
+                    help_text="Corpus files uploaded or removed by watch mode")
+        return SyncResult(changed, removed, ingestion, time.perf_counter() - start)
+
+
+def format_sync(result: SyncResult) -> str:
+    lines = [f"Synced {len(result.changed)} changed and {len(result.removed)} removed files "
+             f"in {result.seconds:.1f}s (ingestion: {result.ingestion})"]
+    lines += [f"   updated {path}" for path in result.changed]
+    lines += [f"   removed {path}" for path in result.removed]
+    return "\n".join(lines)
+
+
+def watch_corpus(corpus_sync: CorpusSync, stop: Optional[threading.Event] = None):
+    """
+    Sync the knowledge base after every burst of edits until interrupted
+    Args:
+        corpus_sync: the sync target
+        stop: event that ends watching (default: run until Ctrl+C)
+    """
+    config = settings()
+    stop = stop or threading.Event()
+    batcher = ChangeBatcher(config["debounce_seconds"], config["max_wait_seconds"])
+    watcher, mode = start_watcher(corpus_sync.source_dir, batcher, stop)
+    print(f"Watching {corpus_sync.source_dir} ({mode}, debounce {config['debounce_seconds']}s), Ctrl+C to stop")
+    try:
+        while not stop.is_set():
+            batch = batcher.next_batch(stop)
+            if not batch:
+                continue
+            try:
+                result = corpus_sync.sync(batch)
+            except Exception as e:
+                print(f"Error syncing {', '.join(sorted(batch))}: {str(e)}")
+                # retried with the next burst, or after another debounce period
+                batcher.add(batch)
+                continue
+            if result is not None:
+                print(format_sync(result))
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        stop.set()
+        watcher.join()
@@ -8,37 +8,79 @@ functionality into any Strands agent system.
 import os
 import boto3
 from strands import tool
-from kb_store.kb import KnowledgeBasesForAmazonBedrock, read_yaml_file
+from kb_store.budget import BudgetExhausted
+from kb_store.compaction import upload_source_dir
+from kb_store.config import load_config
+from kb_store.fake_bedrock import get_fake_knowledge_base
+from kb_store.fanout import fan_out_search, format_fan_out, knowledge_base_names
+from kb_store.kb import KnowledgeBasesForAmazonBedrock, get_bedrock_knowledge_base, read_yaml_file
+from kb_store.local_store import get_local_knowledge_base
+from kb_store.resilience import guard_states
+from kb_store.routing import kb_model_id
+from kb_store.tenants import current_tenant
+from kb_store.tracing import traced
+
+
+def get_kb_manager():
+    """
+    Knowledge base backend used by the search tools: the Bedrock Knowledge Base
+    (default), the in-process local vector store, or the local store behind a
+    simulated delay ("fake", for offline load tests), selected by the
+    `retrieval_backend` config setting or the KB_BACKEND environment variable.
+    Every backend is shared by all tenants.
+    """
+    backend = os.environ.get("KB_BACKEND", load_config().get("retrieval_backend", "bedrock"))
+    if backend == "local":
+        return get_local_knowledge_base()
+    if backend == "fake":
+        return get_fake_knowledge_base()
+    return get_bedrock_knowledge_base()
 
 
 @tool
-def search_knowledge_base(query: str, knowledge_base_name: str = "schoolassistant") -> str:
+@traced("kb_tools.search_knowledge_base")
+def search_knowledge_base(query: str, knowledge_base_name: str = "") -> str:
     """
     Search any Amazon Bedrock Knowledge Base for information.
     
     This is a general-purpose tool that can query any knowledge base by name.
     It's particularly useful for searching academic information, documentation,
     or any other content that has been ingested into a Bedrock Knowledge Base.
+    Several knowledge bases (e.g. per faculty or academic year) are searched at
+    once when given as a comma-separated list, or "all"; their results are
+    merged by relevance.
     
     Args:
         query: The search query or question
-        knowledge_base_name: Name of the knowledge base to search (default: schoolassistant)
+        knowledge_base_name: Name of the knowledge base to search, a comma-separated
+            list of names, or "all" (default: the university's main knowledge base)
         
     Returns:
         Relevant information from the knowledge base
     """
     try:
+        tenant = current_tenant()
+        names = knowledge_base_names(knowledge_base_name)
+        not_allowed = [name for name in names if not tenant.owns(name)]
+        if not_allowed:
+            return (f"Knowledge base '{not_allowed[0]}' is not available to {tenant.display_name}. "
+                    f"Available knowledge bases: {', '.join(tenant.knowledge_bases)}")
+
         # Initialize KB manager
-        kb_manager = KnowledgeBasesForAmazonBedrock()
+        kb_manager = get_kb_manager()
+        if len(names) > 1:
+            return format_fan_out(query, fan_out_search(kb_manager, names, query))
+        knowledge_base_name = names[0] if names else knowledge_base_name
         
         # Get knowledge base ID from name
         kb_id = kb_manager.get_kb_id_from_name(knowledge_base_name)
         
         if not kb_id:
-            available_kbs = []
+            available_kbs = tenant.knowledge_bases if tenant.isolated else []
             try:
-                kbs_response = kb_manager.bedrock_agent_client.list_knowledge_bases(maxResults=100)
-                available_kbs = [kb['name'] for kb in kbs_response.get("knowledgeBaseSummaries", [])]
+                if not tenant.isolated:
+                    kbs_response = kb_manager.bedrock_agent_client.list_knowledge_bases(maxResults=100)
+                    available_kbs = [kb['name'] for kb in kbs_response.get("knowledgeBaseSummaries", [])]
             except:
                 pass
             
@@ -51,17 +93,20 @@ def search_knowledge_base(query: str, knowledge_base_name: str = "schoolassistan
         response = kb_manager.query_knowledge_base(
             kb_id=kb_id,
             query=query,
-            model_id="amazon.nova-lite-v1:0",
+            model_id=kb_model_id(),
             max_results=5
         )
         
         return response
         
+    except BudgetExhausted as e:
+        return f"{str(e)}. Answer with the information already gathered."
     except Exception as e:
         return f"Error searching knowledge base: {str(e)}"
 
 
 @tool
+@traced("kb_tools.intelligent_search")
 def intelligent_search(query: str) -> str:
     """
     Intelligent search that automatically determines the best knowledge source.
@@ -79,7 +124,7 @@ def intelligent_search(query: str) -> str:
     """
     try:
         # Initialize KB manager
-        kb_manager = KnowledgeBasesForAmazonBedrock()
+        kb_manager = get_kb_manager()
         
         # Keywords that suggest school-related queries
         school_keywords = [
@@ -105,15 +150,15 @@ def intelligent_search(query: str) -> str:
         
         if has_school_keywords and not has_aws_keywords:
             # Query school knowledge base
-            kb_id = kb_manager.get_kb_id_from_name("schoolassistant")
+            kb_id = kb_manager.get_kb_id_from_name(current_tenant().knowledge_base_name)
             if kb_id:
                 response = kb_manager.query_knowledge_base(
                     kb_id=kb_id,
                     query=query,
-                    model_id="amazon.nova-lite-v1:0",
+                    model_id=kb_model_id(),
                     max_results=5
                 )
-                return f"📚 **School Knowledge Base Response:**\n\n{response}"
+                return response
             else:
                 return "School knowledge base is not available. Please create it first using the create_school_knowledge_base tool."
         
@@ -123,18 +168,18 @@ def intelligent_search(query: str) -> str:
         
         else:
             # Mixed or general query - try school KB first, then provide general guidance
-            kb_id = kb_manager.get_kb_id_from_name("schoolassistant")
+            kb_id = kb_manager.get_kb_id_from_name(current_tenant().knowledge_base_name)
             if kb_id:
                 try:
                     response = kb_manager.query_knowledge_base(
                         kb_id=kb_id,
                         query=query,
-                        model_id="amazon.nova-lite-v1:0",
+                        model_id=kb_model_id(),
                         max_results=3
                     )
                     # If the response seems relevant (contains actual information)
                     if len(response) > 50 and "error" not in response.lower():
-                        return f"📚 **Knowledge Base Response:**\n\n{response}"
+                        return response
                 except:
                     pass
             
@@ -145,18 +190,40 @@ def intelligent_search(query: str) -> str:
 
 
 @tool 
-def manage_knowledge_base(action: str, kb_name: str = "schoolassistant") -> str:
+@traced("kb_tools.manage_knowledge_base")
+def manage_knowledge_base(action: str, kb_name: str = "") -> str:
     """
-    Manage knowledge base operations including create, delete, status, and list.
+    Manage knowledge base operations including create, delete, status, list, and health.
     
     Args:
-        action: The action to perform (create, delete, status, list)
-        kb_name: Name of the knowledge base (default: schoolassistant)
+        action: The action to perform (create, delete, status, list, health)
+        kb_name: Name of the knowledge base (default: the university's main knowledge base)
         
     Returns:
         Result of the management operation
     """
     try:
+        tenant = current_tenant()
+        kb_name = kb_name or tenant.knowledge_base_name
+        if not tenant.owns(kb_name):
+            return f"❌ Knowledge base '{kb_name}' is not available to {tenant.display_name}"
+
+        if action.lower() == "health":
+            states = guard_states()
+            if not states:
+                return "🩺 No Bedrock calls made yet in this process"
+            result = "🩺 **Bedrock Call Health:**\n\n"
+            for operation, state in states.items():
+                limiter, breaker = state["limiter"], state["breaker"]
+                result += (
+                    f"• **{operation}** - circuit: {breaker['state']}"
+                    f" (opened {breaker['times_opened']}x, retry in {breaker['seconds_until_retry']}s), "
+                    f"tokens: {limiter['available_tokens']}/{limiter['capacity']}, "
+                    f"throttled: {state['throttled']}, retries: {state['retries']}, "
+                    f"rejected: {limiter['rejected'] + breaker['rejected']}\n"
+                )
+            return result
+
         kb_manager = KnowledgeBasesForAmazonBedrock()
         
         if action.lower() == "create":
@@ -168,19 +235,24 @@ def manage_knowledge_base(action: str, kb_name: str = "schoolassistant") -> str:
             if not config_data:
                 return f"Could not load configuration from {config_path}"
             
-            # Create knowledge base
+            # Create the knowledge base of the current tenant, filled from its own corpus only
+            if tenant.corpus_dir is None:
+                return (f"❌ {tenant.display_name} has no documents of its own to create a knowledge base from. "
+                        f"Set kb_files_path in its tenants profile first.")
             kb_id, ds_id = kb_manager.create_or_retrieve_knowledge_base(
-                kb_name=config_data["knowledge_base_name"],
-                kb_description=config_data["knowledge_base_description"]
+                kb_name=tenant.knowledge_base_name,
+                kb_description=tenant.knowledge_base_description
             )
             
             if kb_id and ds_id:
                 # Upload documents
-                documents_path = os.path.join(current_dir, "kb_store", config_data["kb_files_path"])
+                documents_path = tenant.corpus_dir
                 if os.path.exists(documents_path):
-                    kb_manager.upload_directory(documents_path, kb_manager.get_data_bucket_name())
+                    upload_path = upload_source_dir(documents_path)
+                    kb_manager.upload_directory(upload_path, kb_manager.get_data_bucket_name(),
+                                                remove_stale=upload_path != documents_path)
                     kb_manager.synchronize_data(kb_id, ds_id)
-                    return f"✅ Successfully created and populated knowledge base '{config_data['knowledge_base_name']}' with ID: {kb_id}"
+                    return f"✅ Successfully created and populated knowledge base '{tenant.knowledge_base_name}' with ID: {kb_id}"
                 else:
                     return f"⚠️ Knowledge base created but documents directory not found: {documents_path}"
             else:
@@ -217,12 +289,14 @@ def manage_knowledge_base(action: str, kb_name: str = "schoolassistant") -> str:
             
             result = "📋 **Available Knowledge Bases:**\n\n"
             for kb in kbs_response["knowledgeBaseSummaries"]:
+                if not tenant.owns(kb["name"]):
+                    continue
                 result += f"• **{kb['name']}** (ID: {kb['knowledgeBaseId']}) - Status: {kb['status']}\n"
             
             return result
             
         else:
-            return f"❌ Unknown action '{action}'. Supported actions: create, delete, status, list"
+            return f"❌ Unknown action '{action}'. Supported actions: create, delete, status, list, health"
             
     except Exception as e:
         return f"❌ Error managing knowledge base: {str(e)}"
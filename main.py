@@ -21,7 +21,9 @@ How do I access the Virtual Campus?
 What are the attendance requirements?
 ```
 """
-from assistant import create_agent
+import uuid
+
+from assistant import ask, create_agent
 
 # Interactive mode when run directly
 supervisor_agent = create_agent()
@@ -43,6 +45,8 @@ if __name__ == "__main__":
     print("📊 Status: 'Check knowledge base status'")
     
 
+    session_id = uuid.uuid4().hex
+
     # Interactive loop
     while True:
         try:
@@ -51,12 +55,7 @@ if __name__ == "__main__":
                 print("\nThank you for using KCA University Academic Assistant! Goodbye!")
                 break
 
-            response = supervisor_agent(
-                user_input,
-            )
-
-            # Extract and print only the relevant content from the agent's response
-            content = str(response)
+            content = ask(supervisor_agent, user_input, session_id)
             print(content)
 
         except KeyboardInterrupt:
@@ -0,0 +1,67 @@
+import statistics
+
+import pandas as pd
+import streamlit as st
+
+from kb_store.ingestion_history import find_regressions, get_ingestion_history, job_seconds
+from kb_store.tenants import default_tenant_id, get_tenants
+
+st.set_page_config(page_title="Ingestion history", page_icon="📈")
+st.title("📈 Knowledge base ingestion history")
+st.caption("Timings and document counts of every ingestion job, to spot slow or failing ingestions.")
+
+history = get_ingestion_history()
+if history is None:
+    st.info("Ingestion history is disabled (ingestion_history.enabled in prereqs_config.yaml).")
+    st.stop()
+
+tenants = get_tenants()
+tenant_ids = sorted(tenants)
+tenant_id = default_tenant_id()
+if len(tenant_ids) > 1:
+    tenant_id = st.selectbox("Tenant", tenant_ids, index=tenant_ids.index(tenant_id),
+                             format_func=lambda t: tenants[t].display_name)
+since_days = st.slider("Days", min_value=1, max_value=365, value=90)
+
+jobs = history.jobs(since_days=since_days, limit=500, tenant=tenant_id)
+if not jobs:
+    st.info("No ingestion jobs recorded yet. They are recorded by deploy and watch mode.")
+    st.stop()
+
+for warning in find_regressions(jobs):
+    st.warning(warning)
+
+frame = pd.DataFrame(jobs)
+frame["started"] = pd.to_datetime(frame["started_at"], unit="s")
+frame["seconds"] = [job_seconds(job) for job in jobs]
+
+latest = frame.iloc[-1]
+completed = frame[(frame["status"] == "COMPLETE") & frame["seconds"].notna()]
+median = statistics.median(completed["seconds"]) if len(completed) else None
+columns = st.columns(3)
+columns[0].metric("Latest job", f"{latest['seconds']:.0f}s" if pd.notna(latest["seconds"]) else "-",
+                  f"{latest['seconds'] - median:+.0f}s vs median" if median is not None and pd.notna(latest["seconds"]) else None,
+                  delta_color="inverse")
+columns[1].metric("Documents scanned", int(latest["documents_scanned"]))
+columns[2].metric("Documents failed", int(latest["failed"]), delta_color="inverse")
+
+st.subheader("Duration")
+st.line_chart(frame, x="started", y="seconds")
+
+st.subheader("Documents")
+st.bar_chart(frame, x="started", y=["new_indexed", "modified_indexed", "deleted", "failed"])
+
+st.subheader("Jobs")
+st.dataframe(
+    frame.iloc[::-1][["started", "job_id", "status", "seconds", "documents_scanned", "new_indexed",
+                      "modified_indexed", "deleted", "failed"]],
+    hide_index=True,
+)
+
+failed = [job for job in reversed(jobs) if job["failure_reasons"]]
+if failed:
+    st.subheader("Failure reasons")
+    for job in failed[:10]:
+        with st.expander(f"{job['job_id']} ({job['status']})"):
+            for reason in job["failure_reasons"]:
+                st.write(reason)
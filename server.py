@@ -0,0 +1,328 @@
+"""
+# 🎓 KCA University Academic Assistant - HTTP service
+
+ASGI entry point for putting the assistant behind the campus portal.
+
+- A bounded pool of agents answers requests; agents are created on demand up
+  to `server.workers` and each handles one question at a time
+- Requests wait in a queue for a free agent; when more than
+  `server.max_queue_depth` are already waiting the request is shed with
+  503 and a Retry-After estimate instead of piling up
+- Every request has a deadline (`server.request_timeout_seconds`) covering
+  the wait for an agent and the answer itself
+- Conversation history is kept per session_id, so follow-up questions work
+  no matter which pooled agent answers them
+- One process serves every configured tenant (see kb_store/tenants.py),
+  named by the "tenant" body field or the X-Tenant header; pooled agents
+  take the tenant's system prompt for each question
+
+Endpoints:
+    POST /ask          {"question": ..., "session_id": ..., "tenant": ...} -> JSON answer
+    POST /ask/stream   same body -> server-sent events with text as it is generated
+    GET  /health       pool and Bedrock guard state
+    GET  /metrics      Prometheus metrics
+
+Usage:
+    python server.py
+    uvicorn server:app --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from assistant import ask, create_agent
+from kb_store.config import get_section
+from kb_store.resilience import guard_states
+from kb_store.tenants import UnknownTenant, get_tenant, get_tenants
+from kb_store.tracing import metrics
+
+
+class Overloaded(Exception):
+    """Raised when the request queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many requests waiting, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SessionStore:
+    """Bounded LRU of conversation histories keyed by session id (prefixed with the tenant)"""
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if messages is not None:
+                self._sessions.move_to_end(session_id)
+            return list(messages or [])
+
+    def save(self, session_id: str, messages: List[Dict[str, Any]]):
+        with self._lock:
+            self._sessions[session_id] = list(messages)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+
+class AgentPool:
+    """
+    Fixed number of agents shared by all requests, with a bounded wait queue
+    """
+
+    def __init__(self, workers: int = 4, max_queue_depth: int = 16, agent_factory=None):
+        self.workers = workers
+        self.max_queue_depth = max_queue_depth
+        self.agent_factory = agent_factory or (lambda: create_agent(callback_handler=None))
+        self.waiting = 0
+        self.busy = 0
+        self.shed = 0
+        self._avg_seconds = 5.0
+        self._idle: Optional[asyncio.Queue] = None
+
+    def _queue(self) -> asyncio.Queue:
+        # created lazily so it binds to the server's event loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.workers):
+                self._idle.put_nowait(None)
+        return self._idle
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is likely to have drained"""
+        backlog = (self.waiting + self.busy) / max(1, self.workers)
+        return max(1, min(60, math.ceil(backlog * self._avg_seconds)))
+
+    async def acquire(self):
+        if self.waiting >= self.max_queue_depth:
+            self.shed += 1
+            metrics.inc("school_assistant_server_shed_total",
+                        help_text="Requests rejected with 503 because the queue was full")
+            raise Overloaded(self.retry_after())
+        self.waiting += 1
+        metrics.set_gauge("school_assistant_server_queue_depth", self.waiting,
+                          help_text="Requests waiting for a free agent")
+        try:
+            agent = await self._queue().get()
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("school_assistant_server_queue_depth", self.waiting,
+                              help_text="Requests waiting for a free agent")
+        self.busy += 1
+        if agent is None:
+            try:
+                agent = await asyncio.to_thread(self.agent_factory)
+            except BaseException:
+                # give the slot back so a failed or cancelled creation does not shrink the pool
+                self.release(None)
+                raise
+        return agent
+
+    def release(self, agent, seconds: Optional[float] = None):
+        self.busy -= 1
+        if seconds is not None:
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+        self._queue().put_nowait(agent)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "shed": self.shed,
+            "avg_answer_seconds": round(self._avg_seconds, 3),
+        }
+
+
+settings = get_section("server")
+pool = AgentPool(settings.get("workers", 4), settings.get("max_queue_depth", 16))
+sessions = SessionStore(settings.get("max_sessions", 1000))
+REQUEST_TIMEOUT = float(settings.get("request_timeout_seconds", 60))
+
+
+def _run_turn(agent, question: str, session_id: str, tenant_id: str, on_text=None) -> str:
+    """Answer one question on a pooled agent with the session's history (worker thread)"""
+    # the same session id sent to two tenants is two conversations
+    history_key = f"{tenant_id}:{session_id}"
+    agent.messages = sessions.load(history_key)
+    agent.callback_handler = (lambda **event: on_text(event["data"]) if "data" in event else None) \
+        if on_text else (lambda **event: None)
+    try:
+        answer = ask(agent, question, session_id, tenant_id)
+        sessions.save(history_key, agent.messages)
+        return answer
+    finally:
+        agent.callback_handler = lambda **event: None
+
+
+async def _start_turn(question: str, session_id: str, tenant_id: str, on_text=None):
+    """
+    Wait for an agent and start the turn in a worker thread. The agent goes
+    back to the pool when the thread finishes, even if the request timed out.
+    """
+    agent = await pool.acquire()
+    start = time.perf_counter()
+    future = asyncio.ensure_future(asyncio.to_thread(_run_turn, agent, question, session_id, tenant_id, on_text))
+    future.add_done_callback(lambda _: pool.release(agent, time.perf_counter() - start))
+    return future
+
+
+async def _parse(request: Request):
+    """
+    Question, session id and tenant id of a request
+    Raises:
+        UnknownTenant: the request names a tenant that is not configured
+    """
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None, None, None
+    question = (body or {}).get("question") if isinstance(body, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        return None, None, None
+    tenant = get_tenant(body.get("tenant") or request.headers.get("x-tenant") or None)
+    return question.strip(), str(body.get("session_id") or uuid.uuid4().hex), tenant.tenant_id
+
+
+def _unknown_tenant_response(e: UnknownTenant) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=404)
+
+
+def _count(status: str, start: float, endpoint: str):
+    metrics.inc("school_assistant_server_requests_total", labels={"endpoint": endpoint, "status": status},
+                help_text="HTTP requests by endpoint and outcome")
+    metrics.observe("school_assistant_server_request_seconds", time.perf_counter() - start,
+                    {"endpoint": endpoint}, help_text="HTTP request latency including queueing")
+
+
+def _overloaded_response(e: Overloaded) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+
+async def ask_endpoint(request: Request):
+    start = time.perf_counter()
+    try:
+        question, session_id, tenant_id = await _parse(request)
+    except UnknownTenant as e:
+        return _unknown_tenant_response(e)
+    if question is None:
+        return JSONResponse({"error": "Body must be JSON with a non-empty 'question'"}, status_code=400)
+    deadline = start + REQUEST_TIMEOUT
+    try:
+        future = await asyncio.wait_for(_start_turn(question, session_id, tenant_id), timeout=REQUEST_TIMEOUT)
+        answer = await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - time.perf_counter()))
+    except Overloaded as e:
+        _count("shed", start, "ask")
+        return _overloaded_response(e)
+    except asyncio.TimeoutError:
+        _count("timeout", start, "ask")
+        return JSONResponse({"error": f"No answer within {REQUEST_TIMEOUT:g}s", "session_id": session_id},
+                            status_code=504)
+    except Exception as e:
+        _count("error", start, "ask")
+        return JSONResponse({"error": str(e), "session_id": session_id}, status_code=500)
+    _count("ok", start, "ask")
+    return JSONResponse({
+        "answer": answer,
+        "session_id": session_id,
+        "tenant": tenant_id,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+    })
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def ask_stream_endpoint(request: Request):
+    start = time.perf_counter()
+    try:
+        question, session_id, tenant_id = await _parse(request)
+    except UnknownTenant as e:
+        return _unknown_tenant_response(e)
+    if question is None:
+        return JSONResponse({"error": "Body must be JSON with a non-empty 'question'"}, status_code=400)
+
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def on_text(text: str):
+        loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+    # shed before the 200 and the event stream start
+    try:
+        future = await asyncio.wait_for(_start_turn(question, session_id, tenant_id, on_text), timeout=REQUEST_TIMEOUT)
+    except Overloaded as e:
+        _count("shed", start, "ask_stream")
+        return _overloaded_response(e)
+    except asyncio.TimeoutError:
+        _count("timeout", start, "ask_stream")
+        return JSONResponse({"error": f"No free agent within {REQUEST_TIMEOUT:g}s"}, status_code=504)
+
+    async def events():
+        deadline = start + REQUEST_TIMEOUT
+        streamed = False
+        yield _sse("session", {"session_id": session_id, "tenant": tenant_id})
+        while not future.done() or not chunks.empty():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                _count("timeout", start, "ask_stream")
+                yield _sse("error", {"error": f"No answer within {REQUEST_TIMEOUT:g}s"})
+                return
+            getter = asyncio.ensure_future(chunks.get())
+            done, _ = await asyncio.wait({getter, future}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                streamed = True
+                yield _sse("text", {"text": getter.result()})
+            else:
+                getter.cancel()
+        try:
+            answer = future.result()
+        except Exception as e:
+            _count("error", start, "ask_stream")
+            yield _sse("error", {"error": str(e)})
+            return
+        if not streamed:
+            # cache and FAQ answers arrive in one piece
+            yield _sse("text", {"text": answer})
+        _count("ok", start, "ask_stream")
+        yield _sse("done", {"answer": answer, "latency_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def health_endpoint(request: Request):
+    return JSONResponse({"status": "ok", "pool": pool.snapshot(), "tenants": sorted(get_tenants()),
+                         "bedrock": guard_states()})
+
+
+async def metrics_endpoint(request: Request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+app = Starlette(routes=[
+    Route("/ask", ask_endpoint, methods=["POST"]),
+    Route("/ask/stream", ask_stream_endpoint, methods=["POST"]),
+    Route("/health", health_endpoint, methods=["GET"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+])
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=settings.get("host", "127.0.0.1"), port=int(settings.get("port", 8080)))
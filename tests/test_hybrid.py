@@ -0,0 +1,88 @@
+"""
+Context propagation and budgets of kb_store.hybrid
+"""
+
+import copy
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_store import tenants  # noqa: E402
+from kb_store.budget import current_budget, turn_budget  # noqa: E402
+from kb_store.config import load_config  # noqa: E402
+from kb_store.corpus import SearchResult  # noqa: E402
+from kb_store.hybrid import HybridRetriever  # noqa: E402
+from kb_store.tenants import current_tenant, tenant_scope  # noqa: E402
+
+TENANTS = {
+    "default": "kca",
+    "profiles": {
+        "kca": {"knowledge_base_name": "schoolassistant"},
+        "riverside": {"knowledge_base_name": "riverside-kb"},
+    },
+}
+
+
+class RecordingStage:
+    """Search stage that records the turn budget and tenant it runs under"""
+
+    def __init__(self, chunk_id: str):
+        self.chunk_id = chunk_id
+        self.seen = None
+
+    def search(self, query, max_results):
+        self.seen = (current_budget(), current_tenant().tenant_id)
+        return [SearchResult(self.chunk_id, "source.json", f"exam dates in {self.chunk_id}", 1.0)]
+
+
+class FakeLocalKB:
+    def __init__(self):
+        self.store = object()
+        self.vector = RecordingStage("vector-hit")
+
+    def vector_search(self, query, max_results):
+        return self.vector.search(query, max_results)
+
+
+def retriever(local_kb: FakeLocalKB, lexical: RecordingStage, **kwargs) -> HybridRetriever:
+    hybrid = HybridRetriever(local_kb, lexical_budget_ms=2000, vector_budget_ms=2000, **kwargs)
+    # skip building BM25 over a real store
+    hybrid._bm25, hybrid._bm25_store = lexical, local_kb.store
+    return hybrid
+
+
+class HybridContextTest(unittest.TestCase):
+
+    def setUp(self):
+        config = load_config()
+        self._saved_tenants = copy.deepcopy(config.get("tenants"))
+        config["tenants"] = copy.deepcopy(TENANTS)
+        tenants._tenants = None
+
+    def tearDown(self):
+        load_config()["tenants"] = self._saved_tenants
+        tenants._tenants = None
+
+    def test_stages_see_the_callers_budget_and_tenant(self):
+        local_kb, lexical = FakeLocalKB(), RecordingStage("lexical-hit")
+        hybrid = retriever(local_kb, lexical)
+        with turn_budget(enabled=True, deadline_seconds=30) as budget, tenant_scope("riverside"):
+            results = hybrid.retrieve("exam dates", 5)
+        self.assertEqual({result.chunk_id for result in results}, {"lexical-hit", "vector-hit"})
+        self.assertIsNotNone(budget)
+        self.assertEqual(lexical.seen, (budget, "riverside"))
+        self.assertEqual(local_kb.vector.seen, (budget, "riverside"))
+
+    def test_rerank_is_skipped_without_time_for_it(self):
+        local_kb, lexical = FakeLocalKB(), RecordingStage("lexical-hit")
+        hybrid = retriever(local_kb, lexical, rerank_budget_ms=60_000)
+        with turn_budget(enabled=True, deadline_seconds=30):
+            results = hybrid.retrieve("exam dates", 5)
+        # fused scores only: the rerank would have boosted them
+        self.assertTrue(all(result.score < 0.02 for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Circuit breaker state machine of kb_store.resilience
+"""
+
+import os
+import sys
+import time
+import unittest
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_store.resilience import (  # noqa: E402
+    BedrockCallGuard,
+    CircuitBreaker,
+    CircuitOpenError,
+    LimiterChain,
+    RateLimitExceeded,
+    TokenBucket,
+)
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "RetrieveAndGenerate")
+
+
+def half_open_guard(limiter=None) -> BedrockCallGuard:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return BedrockCallGuard("test", limiter or TokenBucket(1000), breaker, max_attempts=1,
+                            base_delay=0, acquire_timeout=0)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_half_open_success_closes(self):
+        guard = half_open_guard()
+        self.assertEqual(guard.call(lambda: "ok"), "ok")
+        self.assertEqual(guard.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_failure_reopens(self):
+        guard = half_open_guard()
+
+        def unavailable():
+            raise client_error("ServiceUnavailableException")
+
+        with self.assertRaises(ClientError):
+            guard.call(unavailable)
+        self.assertEqual(guard.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_only_one_trial_at_a_time(self):
+        breaker = half_open_guard().breaker
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_caller_error_releases_trial_slot(self):
+        guard = half_open_guard()
+
+        def invalid():
+            raise client_error("ValidationException")
+
+        with self.assertRaises(ClientError):
+            guard.call(invalid)
+        self.assertEqual(guard.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(guard.call(lambda: "ok"), "ok")
+        self.assertEqual(guard.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_rate_limited_call_takes_no_trial_slot(self):
+        tenant_bucket = TokenBucket(0.001, capacity=1)
+        tenant_bucket.acquire()
+        guard = half_open_guard(LimiterChain(tenant_bucket, TokenBucket(1000)))
+        with self.assertRaises(RateLimitExceeded):
+            guard.call(lambda: "ok")
+        guard.limiter = TokenBucket(1000)
+        self.assertEqual(guard.call(lambda: "ok"), "ok")
+        self.assertEqual(guard.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_interrupted_call_releases_trial_slot(self):
+        guard = half_open_guard()
+
+        def interrupted():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            guard.call(interrupted)
+        guard.breaker.before_call()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
+import uuid
+
 import streamlit as st
 
-from assistant import create_agent
+from assistant import ask, create_agent
 
 st.set_page_config(page_title="KCA University Assistant", page_icon="🎓")
 st.title("🎓 KCA University Academic Assistant")
@@ -14,6 +16,9 @@ def get_agent():
 
 agent = get_agent()
 
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 if "messages" not in st.session_state:
     st.session_state.messages = [
         {
@@ -37,7 +42,6 @@ if prompt:
 
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
-            response = agent(prompt)
-            content = str(response)
+            content = ask(agent, prompt, st.session_state.session_id)
             st.markdown(content)
     st.session_state.messages.append({"role": "assistant", "content": content})